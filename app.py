@@ -1 +1,256 @@
+#!/usr/bin/env python3
+"""
+Long-running scheduler (daemon mode).
 
+Keeps upcoming matches in an in-memory priority queue keyed on the time work is due:
+a prediction at kickoff - PREMATCH_LEAD_MIN and a verification at kickoff + POSTMATCH_DELAY_MIN.
+Fixture changes (e.g. from weekly_sync) are picked up incrementally through matches.updated_at.
+The cron workflows can keep running as a fallback; work leases prevent double processing.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs"))
+
+import post_match  # noqa: E402
+import pre_match  # noqa: E402
+from async_clients import AsyncGeminiClient, AsyncSupabaseClient  # noqa: E402
+from gemini_client import GeminiClient, TokenBudgetExceeded  # noqa: E402
+from supabase_client import SupabaseClient  # noqa: E402
+from tracing import bind_run, flush  # noqa: E402
+
+UTC = timezone.utc
+PREDICT = "predict"
+VERIFY = "verify"
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, UTC).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+
+
+def _kickoff_ts(match: dict) -> float:
+    return datetime.fromisoformat(str(match["kickoff_utc"]).replace("Z", "+00:00")).timestamp()
+
+
+class Scheduler:
+    def __init__(self, gemini: GeminiClient, supabase: SupabaseClient):
+        self.gemini = gemini
+        self.supabase = supabase
+        self.pre_settings = pre_match.settings_from_env()
+        self.post_settings = post_match.settings_from_env()
+        self.lead_min = int(os.getenv("PREMATCH_LEAD_MIN", "60"))
+        self.verify_delay_min = int(os.getenv("POSTMATCH_DELAY_MIN", "120"))
+        self.horizon_hours = int(os.getenv("DAEMON_HORIZON_HOURS", "48"))
+        self.refresh_sec = int(os.getenv("DAEMON_REFRESH_SEC", "300"))
+        self.retry_min = int(os.getenv("DAEMON_RETRY_MIN", "15"))
+        # Events due within this many seconds of each other are fired as one batch
+        self.batch_window_sec = int(os.getenv("DAEMON_BATCH_WINDOW_SEC", "30"))
+
+        self._heap = []  # (due_ts, kind, match_id, kickoff_ts)
+        self._kickoffs = {}  # match_id -> current kickoff_ts; heap entries with another kickoff are stale
+        self._watermark = None
+        self._next_refresh = 0.0
+        self._requeue = queue.Queue()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="daemon")
+
+    def stop(self, *_args) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def _schedule(self, match: dict) -> None:
+        kickoff = _kickoff_ts(match)
+        match_id = match["id"]
+        if match.get("status") == "finished":
+            self._kickoffs.pop(match_id, None)
+            return
+        if self._kickoffs.get(match_id) == kickoff:
+            return
+        self._kickoffs[match_id] = kickoff
+        now = time.time()
+        deadline = kickoff - self.pre_settings["deadline_min"] * 60
+        if now < deadline:
+            heapq.heappush(self._heap, (max(now, kickoff - self.lead_min * 60), PREDICT, match_id, kickoff))
+        heapq.heappush(self._heap, (kickoff + self.verify_delay_min * 60, VERIFY, match_id, kickoff))
+
+    def _track(self, row: dict) -> None:
+        updated = row.get("updated_at")
+        if updated and (self._watermark is None or updated > self._watermark):
+            self._watermark = updated
+
+    def load(self) -> None:
+        now = time.time()
+        lower = now - self.post_settings["lookback_days"] * 86400
+        upper = now + self.horizon_hours * 3600
+        rows = self.supabase.fetch_matches(
+            {
+                "select": "id,kickoff_utc,status,updated_at",
+                "and": f"(kickoff_utc.gte.{_iso(lower)},kickoff_utc.lte.{_iso(upper)})",
+                "status": "neq.finished",
+                "order": "kickoff_utc.asc",
+            }
+        )
+        for row in rows:
+            self._schedule(row)
+            self._track(row)
+        if self._watermark is None:
+            self._watermark = _iso(now)
+        self._next_refresh = now + self.refresh_sec
+
+    def refresh(self) -> None:
+        """Pick up rows inserted or changed since the last look (served by idx_matches_updated_at)."""
+        rows = self.supabase.fetch_matches(
+            {
+                "select": "id,kickoff_utc,status,updated_at",
+                "updated_at": f"gt.{self._watermark}",
+                "order": "updated_at.asc",
+            }
+        )
+        horizon = time.time() + self.horizon_hours * 3600
+        for row in rows:
+            self._track(row)
+            if _kickoff_ts(row) <= horizon or row["id"] in self._kickoffs:
+                self._schedule(row)
+        self._next_refresh = time.time() + self.refresh_sec
+
+    def _pop_due(self) -> dict:
+        due = {PREDICT: [], VERIFY: []}
+        limit = time.time() + self.batch_window_sec
+        while self._heap and self._heap[0][0] <= limit:
+            _, kind, match_id, kickoff = heapq.heappop(self._heap)
+            if self._kickoffs.get(match_id) == kickoff and match_id not in due[kind]:
+                due[kind].append(match_id)
+        return due
+
+    def _run_predictions(self, match_ids: list) -> None:
+        # Re-read at fire time: the cron fallback may have predicted some of them already
+        candidates = self.supabase.fetch_unpredicted_matches(
+            {"id": f"in.({','.join(match_ids)})", "status": "eq.scheduled", "order": "kickoff_utc.asc"}
+        )
+        if not candidates:
+            return
+        run_id = self.supabase.log_run("pre_match")
+        status, notes = "error", []
+        try:
+            # The batch was sized by the queue, so the cron per-run cap does not apply
+            settings = dict(self.pre_settings, max_per_run=len(candidates))
+            with bind_run(run_id):
+                self.gemini.load_budget(self.supabase, self.pre_settings["tz"])
+                status, notes = pre_match.process_matches(candidates, self.gemini, self.supabase, settings, notes)
+        except TokenBudgetExceeded as exc:
+            status = "budget_exceeded"
+            notes.append(f"תקציב טוקנים יומי נוצל ({exc})")
+        except Exception as exc:  # noqa: BLE001
+            notes.append(f"שגיאת מערכת: {exc}")
+        finally:
+            flush(self.supabase, run_id)
+            self.supabase.finish_run(run_id, status, "; ".join(["daemon"] + notes), self.gemini.run_usage(run_id))
+        if status != "ok":
+            retry_at = time.time() + self.retry_min * 60
+            for match in candidates:
+                kickoff = _kickoff_ts(match)
+                if retry_at < kickoff - self.pre_settings["deadline_min"] * 60:
+                    self._requeue.put((retry_at, PREDICT, match["id"], kickoff))
+
+    def _run_verifications(self, match_ids: list) -> None:
+        candidates = self.supabase.fetch_unresolved_matches(
+            {"id": f"in.({','.join(match_ids)})", "status": "neq.finished", "order": "kickoff_utc.asc"}
+        )
+        if not candidates:
+            return
+        run_id = self.supabase.log_run("post_match")
+        status, notes = "error", []
+
+        async def _verify():
+            async with AsyncGeminiClient(self.gemini, self.post_settings["concurrency"]) as gemini:
+                async with AsyncSupabaseClient(self.supabase) as supabase:
+                    settings = dict(self.post_settings, max_per_run=len(candidates))
+                    return await post_match.process_matches(candidates, gemini, supabase, settings, notes)
+
+        try:
+            with bind_run(run_id):
+                self.gemini.load_budget(self.supabase, self.post_settings["tz"])
+                status, notes = asyncio.run(_verify())
+        except TokenBudgetExceeded as exc:
+            status = "budget_exceeded"
+            notes.append(f"תקציב טוקנים יומי נוצל ({exc})")
+        except Exception as exc:  # noqa: BLE001
+            notes.append(f"שגיאת מערכת: {exc}")
+        finally:
+            flush(self.supabase, run_id)
+            self.supabase.finish_run(run_id, status, "; ".join(["daemon"] + notes), self.gemini.run_usage(run_id))
+        if status != "ok":
+            # Results are often published late; try again until the lookback window closes
+            retry_at = time.time() + self.retry_min * 60
+            give_up = timedelta(days=self.post_settings["lookback_days"]).total_seconds()
+            for match in candidates:
+                kickoff = _kickoff_ts(match)
+                if retry_at < kickoff + give_up:
+                    self._requeue.put((retry_at, VERIFY, match["id"], kickoff))
+
+    def _dispatch(self, kind: str, match_ids: list) -> None:
+        kickoffs = {match_id: self._kickoffs[match_id] for match_id in match_ids}
+        fn = self._run_predictions if kind == PREDICT else self._run_verifications
+
+        def _task():
+            try:
+                fn(match_ids)
+            except Exception as exc:  # noqa: BLE001
+                # Typically Supabase being unreachable; keep the work instead of dropping it
+                print(f"daemon {kind} task failed: {exc}")
+                retry_at = time.time() + self.retry_min * 60
+                for match_id, kickoff in kickoffs.items():
+                    self._requeue.put((retry_at, kind, match_id, kickoff))
+            finally:
+                self._wake.set()
+
+        self._pool.submit(_task)
+
+    def run_forever(self) -> None:
+        if self.gemini.hedge is not None:
+            self.gemini.hedge.seed(self.supabase.fetch_span_durations("gemini.call"))
+        self.load()
+        while not self._stop.is_set():
+            while not self._requeue.empty():
+                heapq.heappush(self._heap, self._requeue.get())
+            if time.time() >= self._next_refresh:
+                try:
+                    self.refresh()
+                except Exception as exc:  # noqa: BLE001
+                    print(f"refresh failed: {exc}")
+                    self._next_refresh = time.time() + self.refresh_sec
+            due = self._pop_due()
+            for kind, match_ids in due.items():
+                if match_ids:
+                    self._dispatch(kind, match_ids)
+            next_event = self._heap[0][0] if self._heap else self._next_refresh
+            timeout = max(0.0, min(next_event - self.batch_window_sec, self._next_refresh) - time.time())
+            self._wake.wait(timeout)
+            self._wake.clear()
+        self._pool.shutdown(wait=True)
+
+
+def main() -> int:
+    # pre_match and post_match batches can run at the same time and share one client
+    concurrency = pre_match.settings_from_env()["workers"] + post_match.settings_from_env()["concurrency"]
+    scheduler = Scheduler(GeminiClient(os.environ["GEMINI_API_KEY"], concurrency=concurrency), SupabaseClient())
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    scheduler.run_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
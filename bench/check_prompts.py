@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Renders every Gemini request of every prompt version through the real GeminiClient methods and
+fails if a template cannot be formatted, leaves a placeholder behind, or v1/v2 disagree about
+responseSchema. Nothing is sent: _retry_parse is intercepted before the HTTP call.
+
+    python bench/check_prompts.py
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import sys
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "jobs"))
+
+from gemini_client import PROMPT_VERSIONS, GeminiClient  # noqa: E402
+
+# An unformatted {name} left in the text; the JSON templates only contain quoted keys
+LEFTOVER = re.compile(r"\{[A-Za-z_][A-Za-z0-9_]*\}")
+MATCH = {
+    "league": "EPL",
+    "home_team": "Arsenal",
+    "away_team": "Chelsea",
+    "date_israel": "17/10/2026",
+    "time_israel": "17:00",
+    "venue": "Emirates Stadium",
+}
+RESEARCH = {"league_position": {"home": "1", "away": "4"}, "sources": {"match_details": ["https://example.com"]}}
+
+
+class _Rendered(Exception):
+    def __init__(self, system_prompt: str, user_prompt: str, schema: Any):
+        super().__init__("rendered")
+        self.system_prompt = system_prompt
+        self.user_prompt = user_prompt
+        self.schema = schema
+
+
+def _capture(system_prompt, user_prompt, validator=None, max_attempts=3, deadline=None, cache_kind=None, schema=None):
+    raise _Rendered(system_prompt, user_prompt, schema)
+
+
+def calls(client: GeminiClient) -> List[Tuple[str, Callable[[], Any]]]:
+    return [
+        ("prediction", lambda: client.generate_pre_match_prediction(MATCH)),
+        ("research", lambda: client.generate_research(MATCH)),
+        ("prediction_delta", lambda: client.generate_pre_match_update(MATCH, RESEARCH, "2026-10-17T06:00:00+00:00")),
+        ("result", lambda: client.verify_match_result(MATCH, "HOME")),
+        ("result_batch", lambda: client.verify_match_results_batch([MATCH, MATCH], ["HOME", "DRAW"])),
+        ("fixtures", lambda: client.fetch_fixtures("EPL", "Premier League")),
+    ]
+
+
+def check(version: str) -> List[str]:
+    client = GeminiClient("check", prompt_version=version, stream=False)
+    client._retry_parse = _capture
+    errors = []
+    for kind, call in calls(client):
+        try:
+            call()
+            errors.append(f"{version}/{kind}: no request was built")
+            continue
+        except _Rendered as rendered:
+            request = rendered
+        except (KeyError, IndexError, ValueError) as exc:
+            errors.append(f"{version}/{kind}: template failed ({type(exc).__name__}: {exc})")
+            continue
+        body: Dict[str, Any] = client._build_request(request.system_prompt, request.user_prompt, request.schema)
+        json.dumps(body, ensure_ascii=False)
+        leftover = LEFTOVER.findall(request.user_prompt)
+        if leftover:
+            errors.append(f"{version}/{kind}: unformatted placeholders {leftover}")
+        has_schema = "responseSchema" in json.dumps(body.get("generationConfig") or {})
+        if has_schema != client.structured:
+            errors.append(f"{version}/{kind}: responseSchema {'present' if has_schema else 'missing'}")
+        print(f"{version}/{kind}: {len(request.user_prompt)} chars")
+    return errors
+
+
+def main() -> int:
+    errors = [error for version in PROMPT_VERSIONS for error in check(version)]
+    for error in errors:
+        print(error, file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+"""
+Gemini stand-in for offline runs. Answers :generateContent and :streamGenerateContent (SSE).
+
+A request found in the cassette (recorder.py) is answered with the recorded response; any other
+request gets a synthetic answer that passes the jobs' validation, built from the match data in
+the prompt. Latency is drawn from a lognormal distribution and a share of requests fails with a
+retryable status. Draws are seeded per request content, so runs are reproducible regardless of
+thread interleaving.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from recorder import cassette_key, load_cassette
+
+# Prompt marker -> call kind; the first match wins, so the more specific markers come first
+KIND_MARKERS = (
+    ("תיק מחקר", "research"),
+    ("המחקר הכללי בוצע מראש", "prediction_delta"),
+    ("אימות תוצאות של", "result_batch"),
+    ("אימות תוצאת משחק", "result"),
+    ("שבעת הימים הקרובים", "fixtures"),
+    ("תחזית משחק", "prediction"),
+)
+SSE_CHUNK_CHARS = 200
+
+
+class Profile:
+    """Latency and failure behaviour of the stand-in."""
+
+    def __init__(
+        self,
+        latency_median_ms: float = 50,
+        latency_sigma: float = 0.5,
+        fail_rate: float = 0.0,
+        fail_status: int = 503,
+        fixtures_per_league: int = 10,
+        seed: int = 0,
+    ):
+        self.latency_median_ms = latency_median_ms
+        self.latency_sigma = latency_sigma
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.fixtures_per_league = fixtures_per_league
+        self.seed = seed
+
+
+def _urls(rng: random.Random, n: int = 2) -> List[str]:
+    return [f"https://stub.example/{rng.randrange(10**8)}" for _ in range(n)]
+
+
+def _teams(prompt: str) -> Tuple[str, str]:
+    home = re.search(r"- בית: (.+)", prompt)
+    away = re.search(r"- חוץ: (.+)", prompt)
+    return (home.group(1).strip() if home else "?", away.group(1).strip() if away else "?")
+
+
+def _probabilities(rng: random.Random) -> Dict[str, str]:
+    home = rng.randint(20, 60)
+    draw = rng.randint(15, 35)
+    return {"home": f"{home}%", "draw": f"{draw}%", "away": f"{100 - home - draw}%"}
+
+
+def _prediction_core(rng: random.Random) -> Dict[str, Any]:
+    probs = _probabilities(rng)
+    winner = max(("HOME", "DRAW", "AWAY"), key=lambda k: int(probs[k.lower()][:-1]))
+    return {
+        "estimated_winner": winner,
+        "win_probability": probs,
+        "reasoning": "נתון סינתטי",
+        "recommended_bet_focus": "לא ידוע",
+    }
+
+
+def _team_news(rng: random.Random, status: Optional[str] = None) -> Dict[str, Any]:
+    news = {
+        "missing_players": [f"שחקן {rng.randrange(30)} (פציעה)"],
+        "predicted_lineup": ["GK: ...", "DEF: ...", "MID: ...", "ATT: ..."],
+        "notes": "",
+    }
+    if status:
+        news = {"status": status, "current_form": "WDLWW", **news}
+    return news
+
+
+def _result(rng: random.Random, predicted: str) -> Dict[str, Any]:
+    home, away = rng.randint(0, 4), rng.randint(0, 3)
+    winner = "HOME" if home > away else "AWAY" if away > home else "DRAW"
+    return {
+        "match_details": {"fixture": "", "date": "", "time_israel": "", "venue": ""},
+        "final_score": {"home_goals": home, "away_goals": away},
+        "winner_result": winner,
+        "comparison": {"predicted_winner": predicted, "is_correct": predicted == winner},
+        "notes": "",
+        "sources": {"result_verification": _urls(rng)},
+    }
+
+
+def synthesize(kind: str, prompt: str, rng: random.Random, profile: Profile) -> Any:
+    """A payload of the given kind that passes the matching GeminiClient validator."""
+    home, away = _teams(prompt)
+    if kind == "research":
+        return {
+            "league_position": {"home": str(rng.randint(1, 20)), "away": str(rng.randint(1, 20))},
+            "current_form": {"home": "WDLWW", "away": "LLDWW"},
+            "missing_players": {"home": [], "away": []},
+            "head_to_head_trends": {"last_meeting": "1-1", "trend": "", "away_dominance": ""},
+            "sources": {k: _urls(rng, 1) for k in ("match_details", "team_news_home", "team_news_away", "head_to_head")},
+        }
+    if kind == "prediction_delta":
+        return {
+            "team_news": {"home": _team_news(rng), "away": _team_news(rng)},
+            "match_prediction": _prediction_core(rng),
+            "sources": {k: _urls(rng, 1) for k in ("team_news_home", "team_news_away", "prediction_context")},
+        }
+    if kind == "prediction":
+        return {
+            "match_details": {
+                "fixture": f"{home} vs {away}",
+                "date": "",
+                "time_israel": "",
+                "venue": "",
+                "league_position": {"home": str(rng.randint(1, 20)), "away": str(rng.randint(1, 20))},
+            },
+            "team_news": {"home": _team_news(rng, "Home Team"), "away": _team_news(rng, "Away Team")},
+            "head_to_head_trends": {"last_meeting": "1-1", "trend": "", "away_dominance": ""},
+            "match_prediction": _prediction_core(rng),
+            "sources": {
+                k: _urls(rng, 1)
+                for k in ("match_details", "team_news_home", "team_news_away", "head_to_head", "prediction_context")
+            },
+        }
+    if kind == "result":
+        predicted = re.search(r"^- predicted_winner[^:\n]*: (\w+)", prompt, flags=re.MULTILINE)
+        return _result(rng, predicted.group(1) if predicted else "DRAW")
+    if kind == "result_batch":
+        items = []
+        for ref, winner in re.findall(r"^(\d+): .+ \| (\w+)\s*$", prompt, flags=re.MULTILINE):
+            items.append({"match_ref": ref, **_result(rng, winner)})
+        return items
+    if kind == "fixtures":
+        code = re.search(r'"league"\s*:\s*"(\w+)"|league כתוב "(\w+)"', prompt)
+        league = next(g for g in code.groups() if g) if code else "XX"
+        start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        return [
+            {
+                "league": league,
+                "home_team": f"{league} Home {i}",
+                "away_team": f"{league} Away {i}",
+                "venue": f"Stadium {i}",
+                "kickoff_utc": (start + timedelta(hours=6 + i * 150 // profile.fixtures_per_league)).strftime(
+                    "%Y-%m-%dT%H:%M:%SZ"
+                ),
+                "source_urls": _urls(rng, 1),
+            }
+            for i in range(profile.fixtures_per_league)
+        ]
+    raise ValueError(f"unknown kind {kind}")
+
+
+def _kind(prompt: str) -> str:
+    return next((kind for marker, kind in KIND_MARKERS if marker in prompt), "prediction")
+
+
+def _response(text: str, prompt: str) -> Dict[str, Any]:
+    prompt_tokens = len(prompt) // 3
+    output_tokens = len(text) // 3
+    return {
+        "candidates": [
+            {
+                "content": {"parts": [{"text": text}]},
+                "groundingMetadata": {
+                    "webSearchQueries": ["stub"],
+                    "groundingChunks": [{"web": {"uri": "https://stub.example/"}}],
+                },
+            }
+        ],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "toolUsePromptTokenCount": 0,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        },
+    }
+
+
+class GeminiStub:
+    def __init__(self, profile: Optional[Profile] = None, cassette: Optional[str] = None):
+        self.profile = profile or Profile()
+        self.cassette = load_cassette(cassette)
+        self.calls: Counter = Counter()
+        self._seen: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _rng(self, key: str) -> random.Random:
+        # Repeats of one request (retries) get the next draw, not the same one again
+        with self._lock:
+            self._seen[key] += 1
+            n = self._seen[key]
+        digest = hashlib.sha256(f"{self.profile.seed}:{key}:{n}".encode()).hexdigest()
+        return random.Random(int(digest[:16], 16))
+
+    def handle(self, method: str, path: str, body: Dict[str, Any]) -> Tuple[int, str, bytes, float]:
+        """Returns (status, content type, body, latency in seconds)."""
+        key = cassette_key(method, path, body)
+        recorded = self.cassette.get(key)
+        if recorded:
+            with self._lock:
+                entry = recorded[(self._seen[key]) % len(recorded)]
+                self._seen[key] += 1
+                self.calls["replayed"] += 1
+            return entry["status"], entry["content_type"], entry["body"].encode("utf-8"), entry["latency_ms"] / 1000
+        rng = self._rng(key)
+        latency = rng.lognormvariate(0, self.profile.latency_sigma) * self.profile.latency_median_ms / 1000
+        prompt = "".join(part.get("text", "") for c in body.get("contents") or [] for part in c.get("parts") or [])
+        kind = _kind(prompt)
+        if rng.random() < self.profile.fail_rate:
+            self.calls[f"failed:{kind}"] += 1
+            error = {"error": {"code": self.profile.fail_status, "message": "stub failure"}}
+            return self.profile.fail_status, "application/json", json.dumps(error).encode(), latency
+        self.calls[kind] += 1
+        text = json.dumps(synthesize(kind, prompt, rng, self.profile), ensure_ascii=False)
+        response = _response(text, prompt)
+        if ":streamGenerateContent" in path:
+            events = []
+            for i in range(0, len(text), SSE_CHUNK_CHARS):
+                chunk = json.loads(json.dumps(response))
+                chunk["candidates"][0]["content"]["parts"][0]["text"] = text[i : i + SSE_CHUNK_CHARS]
+                if i + SSE_CHUNK_CHARS < len(text):
+                    chunk.pop("usageMetadata")
+                events.append("data: " + json.dumps(chunk, ensure_ascii=False) + "\r\n\r\n")
+            return 200, "text/event-stream", "".join(events).encode("utf-8"), latency
+        return 200, "application/json", json.dumps(response, ensure_ascii=False).encode("utf-8"), latency
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stub: GeminiStub
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        status, content_type, data, latency = self.stub.handle("POST", self.path, body)
+        time.sleep(latency)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(stub: Optional[GeminiStub] = None, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Starts the stand-in on a background thread; server.server_address has the bound port."""
+    handler = type("Handler", (_Handler,), {"stub": stub or GeminiStub()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="gemini-stub", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Gemini stand-in")
+    parser.add_argument("--port", type=int, default=8788)
+    parser.add_argument("--cassette")
+    parser.add_argument("--latency-median-ms", type=float, default=50)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    profile = Profile(args.latency_median_ms, args.latency_sigma, args.fail_rate, seed=args.seed)
+    srv = serve(GeminiStub(profile, args.cassette), port=args.port)
+    print(f"Gemini stand-in on http://127.0.0.1:{srv.server_address[1]} (GEMINI_BASE_URL)")
+    threading.Event().wait()
@@ -0,0 +1,483 @@
+"""
+In-memory stand-in for the PostgREST subset SupabaseClient._rest uses.
+
+Supported: GET/POST/PATCH on tables, eq/neq/gt/gte/lt/lte/in/is filters (also inside and=(...)
+and negated with not.), order/limit/offset, select with embedded relations through match_id
+(anti-joins such as predictions=is.null), on_conflict with Prefer resolution=merge-duplicates or
+ignore-duplicates, Prefer return=representation, the RPCs declared in db/schema.sql and the
+trigger that keeps stats_rollup up to date. Every request is counted per method and table so benchmarks can report round trips.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+# Primary key per table; tables with an "id" key get a generated uuid (bigint for run_spans)
+PRIMARY_KEYS = {
+    "matches": ("id",),
+    "predictions": ("id",),
+    "results": ("match_id",),
+    "baselines": ("match_id",),
+    "research_snapshots": ("match_id",),
+    "runs": ("id",),
+    "run_spans": ("id",),
+    "work_leases": ("match_id", "job_name"),
+    "evaluation_metrics": ("slice_type", "slice_value"),
+    "stats_rollup": ("league", "week", "prompt_version", "model_name"),
+    "stats_rollup_calibration": ("league", "week", "prompt_version", "model_name", "bin"),
+    "team_ratings": ("league", "team"),
+}
+UNIQUE_KEYS = {
+    "matches": [("league", "kickoff_utc", "home_team", "away_team")],
+    "predictions": [("match_id",)],
+}
+OUTCOMES = ("HOME", "DRAW", "AWAY")
+DEFAULTS: Dict[str, Callable[[], Any]] = {
+    "created_at": lambda: _now().isoformat(),
+}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _coerce(value: Any) -> Any:
+    """Comparable form of a stored or filter value: timestamps as datetimes, numbers as floats."""
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value)
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    if len(text) >= 10 and text[4:5] == "-" and text[7:8] == "-":
+        try:
+            parsed = datetime.fromisoformat(text.replace("Z", "+00:00").replace(" ", "+"))
+            return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    return text
+
+
+def _normalized(row: Optional[Dict[str, Any]]) -> Optional[List[float]]:
+    probs = [(row or {}).get(k) for k in ("prob_home", "prob_draw", "prob_away")]
+    if any(p is None for p in probs):
+        return None
+    total = sum(float(p) for p in probs)
+    return [float(p) / total for p in probs] if total else None
+
+
+def _split_top(text: str) -> List[str]:
+    """Splits on commas that are not inside parentheses."""
+    parts, depth, current = [], 0, []
+    for ch in text:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(ch)
+    if current:
+        parts.append("".join(current))
+    return parts
+
+
+def _compare(op: str, actual: Any, expected: str) -> bool:
+    if op == "is":
+        target = {"null": None, "true": True, "false": False}[expected]
+        return actual is target if target is None else actual == target
+    if op == "in":
+        options = [item.strip().strip('"') for item in _split_top(expected.strip("()"))]
+        return actual is not None and _coerce(actual) in [_coerce(item) for item in options]
+    if actual is None:
+        return False
+    left, right = _coerce(actual), _coerce(expected)
+    if type(left) is not type(right):
+        left, right = str(actual), expected
+    if op == "eq":
+        return left == right
+    if op == "neq":
+        return left != right
+    if op == "gt":
+        return left > right
+    if op == "gte":
+        return left >= right
+    if op == "lt":
+        return left < right
+    if op == "lte":
+        return left <= right
+    raise ValueError(f"unsupported operator {op}")
+
+
+def _condition(column: str, expression: str) -> Callable[[Dict[str, Any]], bool]:
+    negate = expression.startswith("not.")
+    if negate:
+        expression = expression[len("not.") :]
+    op, _, value = expression.partition(".")
+
+    def check(row: Dict[str, Any]) -> bool:
+        return _compare(op, row.get(column), value) != negate
+
+    return check
+
+
+def _parse_select(select: str) -> Tuple[List[str], Dict[str, str]]:
+    """Returns (columns, {embedded table: its select}) for e.g. "*,predictions(id)"."""
+    columns, embeds = [], {}
+    for part in _split_top(select or "*"):
+        part = part.strip()
+        if "(" in part:
+            name, _, inner = part.partition("(")
+            embeds[name.split(":")[-1].strip()] = inner[:-1]
+        elif part:
+            columns.append(part)
+    return columns, embeds
+
+
+class Store:
+    def __init__(self):
+        self.tables: Dict[str, List[Dict[str, Any]]] = {name: [] for name in PRIMARY_KEYS}
+        self.requests: Counter = Counter()
+        self.lock = threading.RLock()
+        self._span_ids = 0
+
+    # -- reads ------------------------------------------------------------------------------
+
+    def _embed(self, table: str, row: Dict[str, Any], name: str, select: str) -> Any:
+        columns, embeds = _parse_select(select)
+        if table == "matches":
+            children = [r for r in self.tables.get(name, []) if str(r.get("match_id")) == str(row["id"])]
+            return [self._shape(name, r, columns, embeds) for r in children]
+        if name == "matches" and "match_id" in row:
+            parent = next((r for r in self.tables["matches"] if str(r["id"]) == str(row["match_id"])), None)
+            return self._shape("matches", parent, columns, embeds) if parent else None
+        raise ValueError(f"no relation between {table} and {name}")
+
+    def _shape(self, table: str, row: Dict[str, Any], columns: List[str], embeds: Dict[str, str]) -> Dict[str, Any]:
+        out = dict(row) if "*" in columns or not columns else {c: row.get(c) for c in columns}
+        for name, select in embeds.items():
+            out[name] = self._embed(table, row, name, select)
+        return out
+
+    @staticmethod
+    def _checks(params: List[Tuple[str, str]], embeds: Dict[str, str]):
+        checks, embed_checks = [], []
+        for key, value in params:
+            if key in ("select", "order", "limit", "offset", "on_conflict"):
+                continue
+            if key == "and":
+                for clause in _split_top(value.strip()[1:-1]):
+                    column, _, expression = clause.partition(".")
+                    checks.append(_condition(column, expression))
+            elif key in embeds:
+                # Filtering on an embedded resource: is.null keeps rows without related rows
+                wanted_empty = value == "is.null"
+                embed_checks.append((key, wanted_empty))
+            else:
+                checks.append(_condition(key, value))
+        return checks, embed_checks
+
+    def _matching(self, table: str, checks) -> List[Dict[str, Any]]:
+        return [row for row in self.tables.setdefault(table, []) if all(check(row) for check in checks)]
+
+    def select(self, table: str, params: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        query = dict(params)
+        columns, embeds = _parse_select(query.get("select", "*"))
+        checks, embed_checks = self._checks(params, embeds)
+        with self.lock:
+            rows = self._matching(table, checks)
+            shaped = [self._shape(table, row, columns, embeds) for row in rows]
+        for name, wanted_empty in embed_checks:
+            shaped = [row for row in shaped if (not row[name]) == wanted_empty]
+        for spec in reversed(_split_top(query.get("order", ""))):
+            if not spec:
+                continue
+            column, _, direction = spec.partition(".")
+            present = [r for r in shaped if r.get(column) is not None]
+            missing = [r for r in shaped if r.get(column) is None]
+            present.sort(key=lambda r: _coerce(r[column]), reverse=direction.startswith("desc"))
+            shaped = present + missing
+        offset = int(query.get("offset", 0))
+        limit = int(query["limit"]) if "limit" in query else None
+        return shaped[offset : None if limit is None else offset + limit]
+
+    # -- writes -----------------------------------------------------------------------------
+
+    def _fill(self, table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        row = dict(row)
+        if PRIMARY_KEYS.get(table) == ("id",) and row.get("id") is None:
+            if table == "run_spans":
+                self._span_ids += 1
+                row["id"] = self._span_ids
+            else:
+                row["id"] = str(uuid.uuid4())
+        for column, default in DEFAULTS.items():
+            row.setdefault(column, default())
+        if table == "matches":
+            row.setdefault("updated_at", _now().isoformat())
+        return row
+
+    def _find(self, table: str, row: Dict[str, Any], keys: List[Tuple[str, ...]]) -> Optional[Dict[str, Any]]:
+        for key in keys:
+            if not all(row.get(column) is not None for column in key):
+                continue
+            wanted = tuple(_coerce(row[column]) for column in key)
+            for existing in self.tables[table]:
+                if tuple(_coerce(existing.get(column)) for column in key) == wanted:
+                    return existing
+        return None
+
+    def insert(self, table: str, rows: List[Dict[str, Any]], on_conflict: Optional[str], resolution: str):
+        """Returns (status, stored rows). A conflict without a resolution fails the whole request."""
+        keys = [PRIMARY_KEYS.get(table, ("id",))] + UNIQUE_KEYS.get(table, [])
+        if on_conflict:
+            keys = [tuple(column.strip() for column in on_conflict.split(","))]
+        with self.lock:
+            stored, pending = [], []
+            for row in rows:
+                existing = self._find(table, row, keys)
+                if existing is not None and not resolution:
+                    return 409, [{"code": "23505", "message": f"duplicate key value violates unique constraint on {table}"}]
+                pending.append((row, existing))
+            for row, existing in pending:
+                if existing is None:
+                    new = self._fill(table, row)
+                    self.tables.setdefault(table, []).append(new)
+                    stored.append(new)
+                    if table == "results":
+                        self._rollup(new, 1)
+                elif resolution == "merge-duplicates":
+                    if table == "results":
+                        self._rollup(existing, -1)
+                    existing.update(row)
+                    if table == "matches":
+                        existing["updated_at"] = _now().isoformat()
+                    if table == "results":
+                        self._rollup(existing, 1)
+                    stored.append(existing)
+        return 201, stored
+
+    def update(self, table: str, params: List[Tuple[str, str]], values: Dict[str, Any]) -> List[Dict[str, Any]]:
+        checks, _ = self._checks(params, {})
+        with self.lock:
+            changed = self._matching(table, checks)
+            for row in changed:
+                if table == "results":
+                    self._rollup(row, -1)
+                row.update(values)
+                if table == "results":
+                    self._rollup(row, 1)
+                if table == "matches":
+                    row["updated_at"] = _now().isoformat()
+        return changed
+
+    # -- trigger on results (stats_rollup_apply in db/schema.sql) ----------------------------
+
+    def _rollup(self, result: Dict[str, Any], sign: int) -> None:
+        match_id = str(result["match_id"])
+        pred = next((r for r in self.tables["predictions"] if str(r.get("match_id")) == match_id), None)
+        match = next((r for r in self.tables["matches"] if str(r["id"]) == match_id), None)
+        if pred is None or match is None:
+            return
+        base = next((r for r in self.tables["baselines"] if str(r.get("match_id")) == match_id), None)
+        kickoff = _coerce(match["kickoff_utc"]).astimezone(timezone.utc).date()
+        key = {
+            "league": match["league"],
+            "week": (kickoff - timedelta(days=kickoff.weekday())).isoformat(),
+            "prompt_version": pred.get("prompt_version") or "?",
+            "model_name": pred.get("model_name") or "?",
+        }
+        outcome = result.get("result_text")
+        actual = OUTCOMES.index(outcome) if outcome in OUTCOMES else None
+        p, b = _normalized(pred), _normalized(base)
+
+        def scores(probs):
+            if probs is None or actual is None:
+                return None, None
+            brier = sum((q - (i == actual)) ** 2 for i, q in enumerate(probs))
+            return brier, -math.log(max(probs[actual], 1e-15))
+
+        brier, log_loss = scores(p)
+        base_brier, base_log_loss = scores(b)
+        paired = brier is not None and base_brier is not None
+        add = {
+            "n": 1,
+            "correct_n": int(bool(result.get("correct"))),
+            "scored_n": int(brier is not None),
+            "brier_sum": brier or 0.0,
+            "log_loss_sum": log_loss or 0.0,
+            "baseline_n": int(paired),
+            "paired_brier_sum": brier if paired else 0.0,
+            "paired_log_loss_sum": log_loss if paired else 0.0,
+            "baseline_brier_sum": base_brier if paired else 0.0,
+            "baseline_log_loss_sum": base_log_loss if paired else 0.0,
+        }
+        self._accumulate("stats_rollup", key, add, sign)
+        if brier is not None:
+            for i, q in enumerate(p):
+                cell = {**key, "bin": min(int(q * 10), 9)}
+                add = {"n": 1, "predicted_sum": q, "observed_sum": int(i == actual)}
+                self._accumulate("stats_rollup_calibration", cell, add, sign)
+
+    def _accumulate(self, table: str, key: Dict[str, Any], add: Dict[str, float], sign: int) -> None:
+        row = self._find(table, key, [PRIMARY_KEYS[table]])
+        if row is None:
+            row = {**key, **{column: 0 for column in add}}
+            self.tables[table].append(row)
+        for column, value in add.items():
+            row[column] += sign * value
+        row["updated_at"] = _now().isoformat()
+
+    # -- RPCs -------------------------------------------------------------------------------
+
+    def rpc(self, name: str, args: Dict[str, Any]) -> Any:
+        with self.lock:
+            if name == "claim_matches":
+                now = _now()
+                leases = self.tables["work_leases"]
+                claimed = []
+                for match_id in args["p_match_ids"]:
+                    if args.get("p_limit") is not None and len(claimed) >= args["p_limit"]:
+                        break
+                    lease = next(
+                        (l for l in leases if l["match_id"] == match_id and l["job_name"] == args["p_job"]), None
+                    )
+                    if lease is None:
+                        lease = {"match_id": match_id, "job_name": args["p_job"], "owner": None, "expires_at": None}
+                        leases.append(lease)
+                    free = lease["owner"] is None or lease["owner"] == args["p_owner"] or lease["expires_at"] < now
+                    if free:
+                        lease.update(
+                            owner=args["p_owner"],
+                            claimed_at=now,
+                            expires_at=now + timedelta(seconds=args.get("p_lease_seconds") or 900),
+                        )
+                        claimed.append({"match_id": match_id})
+                return claimed
+            if name == "release_matches":
+                for lease in self.tables["work_leases"]:
+                    if (
+                        lease["match_id"] in args["p_match_ids"]
+                        and lease["job_name"] == args["p_job"]
+                        and lease["owner"] == args["p_owner"]
+                    ):
+                        lease["owner"] = None
+                return None
+            if name == "tokens_used_since":
+                since = _coerce(args["p_since"])
+                return int(
+                    sum(
+                        run.get("total_tokens") or 0
+                        for run in self.tables["runs"]
+                        if run.get("started_at") and _coerce(run["started_at"]) >= since
+                    )
+                )
+        raise KeyError(name)
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(type(value).__name__)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    store: Store
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _reply(self, status: int, body: Any = None) -> None:
+        data = b"" if body is None else json.dumps(body, default=_json_default, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self) -> Tuple[str, List[Tuple[str, str]]]:
+        parts = urlsplit(self.path)
+        table = parts.path.split("/rest/v1/", 1)[-1]
+        return table, parse_qsl(parts.query, keep_blank_values=True)
+
+    def _body(self) -> Any:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"null") if length else None
+
+    def _prefer(self, name: str) -> str:
+        for item in (self.headers.get("Prefer") or "").split(","):
+            key, _, value = item.strip().partition("=")
+            if key == name:
+                return value
+        return ""
+
+    def _handle(self, method: str) -> None:
+        table, params = self._route()
+        self.store.requests[f"{method} {table}"] += 1
+        body = self._body()
+        try:
+            if table.startswith("rpc/"):
+                self._reply(200, self.store.rpc(table[len("rpc/") :], body or {}))
+            elif method == "GET":
+                self._reply(200, self.store.select(table, params))
+            elif method == "POST":
+                rows = body if isinstance(body, list) else [body]
+                status, stored = self.store.insert(
+                    table, rows, dict(params).get("on_conflict"), self._prefer("resolution")
+                )
+                if status != 201:
+                    self._reply(status, stored[0])
+                elif self._prefer("return") == "representation":
+                    self._reply(201, stored)
+                else:
+                    self._reply(201)
+            elif method == "PATCH":
+                changed = self.store.update(table, params, body or {})
+                self._reply(200, changed) if self._prefer("return") == "representation" else self._reply(204)
+            else:
+                self._reply(405, {"message": f"{method} not supported"})
+        except (KeyError, ValueError, TypeError) as exc:
+            self._reply(400, {"message": f"{type(exc).__name__}: {exc}"})
+
+    def do_GET(self) -> None:
+        self._handle("GET")
+
+    def do_POST(self) -> None:
+        self._handle("POST")
+
+    def do_PATCH(self) -> None:
+        self._handle("PATCH")
+
+
+def serve(store: Optional[Store] = None, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Starts the stand-in on a background thread; server.server_address has the bound port."""
+    handler = type("Handler", (_Handler,), {"store": store or Store()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="postgrest-stub", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8787)
+    args = parser.parse_args()
+    srv = serve(port=args.port)
+    print(f"PostgREST stand-in on http://127.0.0.1:{srv.server_address[1]} (SUPABASE_URL)")
+    threading.Event().wait()
@@ -0,0 +1,120 @@
+"""
+Recording proxy: forwards requests to a real upstream and appends every exchange to a cassette
+(JSON lines) that gemini_stub.py can replay offline.
+
+    python bench/recorder.py --upstream https://generativelanguage.googleapis.com \\
+        --cassette bench/cassettes/gemini.jsonl --port 8790
+    GEMINI_BASE_URL=http://127.0.0.1:8790 python jobs/pre_match.py
+
+The API key (key= query parameter, apikey/Authorization headers) is forwarded but never written.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+SECRET_PARAMS = {"key"}
+FORWARDED_HEADERS = ("Content-Type", "Accept", "Prefer", "apikey", "Authorization")
+
+
+def cassette_key(method: str, path: str, body: Any) -> str:
+    """Identity of a request: method, path, non-secret query and canonical JSON body."""
+    parts = urlsplit(path)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query) if k not in SECRET_PARAMS)
+    blob = json.dumps([method, parts.path, query, body], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def load_cassette(path: Optional[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """Recorded exchanges by cassette_key, in recording order."""
+    entries: Dict[str, List[Dict[str, Any]]] = {}
+    if not path:
+        return entries
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                entry = json.loads(line)
+                entries.setdefault(entry["key"], []).append(entry)
+    return entries
+
+
+class _Proxy(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    upstream: str
+    cassette: str
+    lock = threading.Lock()
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _forward(self, method: str) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        body = json.loads(raw) if raw else None
+        headers = {name: self.headers[name] for name in FORWARDED_HEADERS if self.headers.get(name)}
+        request = urllib.request.Request(self.upstream + self.path, data=raw or None, headers=headers, method=method)
+        start = time.time()
+        try:
+            with urllib.request.urlopen(request, timeout=300) as resp:
+                status, content_type, data = resp.status, resp.headers.get("Content-Type", ""), resp.read()
+        except urllib.error.HTTPError as exc:
+            status, content_type, data = exc.code, exc.headers.get("Content-Type", ""), exc.read()
+        latency_ms = int((time.time() - start) * 1000)
+        parts = urlsplit(self.path)
+        query = [(k, v) for k, v in parse_qsl(parts.query) if k not in SECRET_PARAMS]
+        entry = {
+            "key": cassette_key(method, self.path, body),
+            "method": method,
+            "path": parts.path + ("?" + urlencode(query) if query else ""),
+            "request": body,
+            "status": status,
+            "content_type": content_type,
+            "body": data.decode("utf-8", errors="replace"),
+            "latency_ms": latency_ms,
+        }
+        with self.lock:
+            with open(self.cassette, "a", encoding="utf-8") as fh:
+                fh.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type or "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        self._forward("GET")
+
+    def do_POST(self) -> None:
+        self._forward("POST")
+
+    def do_PATCH(self) -> None:
+        self._forward("PATCH")
+
+
+def serve(upstream: str, cassette: str, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    handler = type("Proxy", (_Proxy,), {"upstream": upstream.rstrip("/"), "cassette": cassette})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="recorder", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Record upstream traffic into a cassette")
+    parser.add_argument("--upstream", required=True)
+    parser.add_argument("--cassette", required=True)
+    parser.add_argument("--port", type=int, default=8790)
+    args = parser.parse_args()
+    srv = serve(args.upstream, args.cassette, port=args.port)
+    print(f"Recording {args.upstream} -> {args.cassette} on http://127.0.0.1:{srv.server_address[1]}")
+    threading.Event().wait()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Runs whole jobs offline against the PostgREST and Gemini stand-ins at synthetic scale and
+reports wall time, throughput and round trips per job.
+
+    python bench/run.py --matches 500 --jobs weekly_sync,pre_match,post_match --out bench_report.json
+
+The job settings come from the environment as usual (e.g. PREMATCH_WORKERS, POSTMATCH_BATCH_SIZE,
+GEMINI_STREAM), so a change can be compared by running the bench twice with different values.
+pre_match runs with the planner, as in production; PREMATCH_PLANNER=0 benchmarks the fixed window.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "jobs"))
+
+import gemini_stub  # noqa: E402
+import postgrest_stub  # noqa: E402
+
+UTC = timezone.utc
+JOB_ORDER = ("weekly_sync", "research", "pre_match", "post_match", "metrics")
+# Table whose new rows count as the job's output
+OUTPUT_TABLE = {
+    "weekly_sync": "matches",
+    "research": "research_snapshots",
+    "pre_match": "predictions",
+    "post_match": "results",
+    "metrics": "evaluation_metrics",
+}
+
+
+def _match(i: int, kickoff: datetime, prefix: str) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "league": ("EPL", "LaLiga", "SerieA", "Bundesliga", "Ligue1")[i % 5],
+        "home_team": f"{prefix} Home {i}",
+        "away_team": f"{prefix} Away {i}",
+        "venue": f"Stadium {i}",
+        "kickoff_utc": kickoff.isoformat(),
+        "kickoff_israel": kickoff.isoformat(),
+        "status": "scheduled",
+        "created_at": datetime.now(UTC).isoformat(),
+        "updated_at": datetime.now(UTC).isoformat(),
+    }
+
+
+def seed(store: postgrest_stub.Store, n: int) -> None:
+    """n upcoming matches inside the pre_match window and n finished ones awaiting verification."""
+    now = datetime.now(UTC).replace(microsecond=0)
+    # Kickoffs 50-60 minutes out: inside the fixed T-45..T-120 window, and all due now for the planner
+    for i in range(n):
+        store.tables["matches"].append(_match(i, now + timedelta(minutes=50 + 10 * i // n), "Upcoming"))
+    for i in range(n):
+        match = _match(i, now - timedelta(hours=3) - timedelta(minutes=2 * 24 * 60 * i // n), "Played")
+        store.tables["matches"].append(match)
+        store.tables["predictions"].append(
+            {
+                "id": str(uuid.uuid4()),
+                "match_id": match["id"],
+                "predicted_winner": "HOME",
+                "prob_home": 0.5,
+                "prob_draw": 0.25,
+                "prob_away": 0.25,
+                "prompt_version": "v1",
+                "model_name": "bench",
+                "duration_ms": 1000,
+            }
+        )
+        store.tables["baselines"].append({"match_id": match["id"], "prob_home": 0.45, "prob_draw": 0.27, "prob_away": 0.28})
+
+
+def configure(args, supabase_url: str, gemini_url: str, workdir: str) -> None:
+    env = {
+        "SUPABASE_URL": supabase_url,
+        "SUPABASE_SERVICE_ROLE": "bench",
+        "GEMINI_API_KEY": "bench",
+        "GEMINI_BASE_URL": gemini_url,
+        "RATE_LIMIT_DB": os.path.join(workdir, "rate_limits.sqlite"),
+        "PREMATCH_MAX_PER_RUN": str(args.matches),
+        "POSTMATCH_MAX_PER_RUN": str(args.matches),
+        "RESEARCH_MIN_LEAD_MIN": "0",
+        "RESEARCH_MAX_PER_RUN": str(args.matches),
+    }
+    for key, value in env.items():
+        os.environ.setdefault(key, value)
+    # A warm response cache would hide the calls being measured
+    os.environ.pop("GEMINI_CACHE_DIR", None)
+
+
+def run_job(name: str, store: postgrest_stub.Store, stub: gemini_stub.GeminiStub) -> dict:
+    module = __import__(name)
+    requests_before = store.requests.copy()
+    calls_before = stub.calls.copy()
+    rows_before = len(store.tables[OUTPUT_TABLE[name]])
+    start = time.perf_counter()
+    module.main()
+    wall = time.perf_counter() - start
+    rows = len(store.tables[OUTPUT_TABLE[name]]) - rows_before
+    round_trips = store.requests - requests_before
+    run = next(r for r in reversed(store.tables["runs"]) if r.get("job_name") == name)
+    return {
+        "status": run.get("status"),
+        "wall_sec": round(wall, 3),
+        "rows": rows,
+        "rows_per_sec": round(rows / wall, 1) if wall else None,
+        "gemini_calls": dict(stub.calls - calls_before),
+        "supabase_requests": sum(round_trips.values()),
+        "supabase_by_table": dict(sorted(round_trips.items())),
+        "total_tokens": run.get("total_tokens"),
+        "notes": (run.get("notes") or "")[:500],
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline job benchmark")
+    parser.add_argument("--matches", type=int, default=500)
+    parser.add_argument("--jobs", default="weekly_sync,pre_match,post_match")
+    parser.add_argument("--latency-median-ms", type=float, default=50)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--cassette", help="recorded Gemini exchanges to replay (bench/recorder.py)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the report as JSON to this file")
+    args = parser.parse_args()
+
+    jobs = [job for job in JOB_ORDER if job in args.jobs.split(",")]
+    store = postgrest_stub.Store()
+    seed(store, args.matches)
+    profile = gemini_stub.Profile(
+        latency_median_ms=args.latency_median_ms,
+        latency_sigma=args.latency_sigma,
+        fail_rate=args.fail_rate,
+        fixtures_per_league=max(1, args.matches // 5),
+        seed=args.seed,
+    )
+    stub = gemini_stub.GeminiStub(profile, args.cassette)
+    supabase_server = postgrest_stub.serve(store)
+    gemini_server = gemini_stub.serve(stub)
+    with tempfile.TemporaryDirectory() as workdir:
+        configure(
+            args,
+            f"http://127.0.0.1:{supabase_server.server_address[1]}",
+            f"http://127.0.0.1:{gemini_server.server_address[1]}",
+            workdir,
+        )
+        report = {
+            "matches": args.matches,
+            "profile": vars(profile),
+            "jobs": {job: run_job(job, store, stub) for job in jobs},
+        }
+    supabase_server.shutdown()
+    gemini_server.shutdown()
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+    failed = [job for job, result in report["jobs"].items() if result["status"] == "error" or not result["rows"]]
+    if failed:
+        print(f"Jobs without output or with errors: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -21,6 +21,15 @@ create table if not exists matches (
 create unique index if not exists idx_matches_unique
   on matches (league, kickoff_utc, home_team, away_team);
 
+-- Incremental refresh of the daemon's queue (app.py) by updated_at watermark
+create index if not exists idx_matches_updated_at
+  on matches (updated_at);
+
+-- post_match only looks at matches that are not finished yet
+create index if not exists idx_matches_unresolved
+  on matches (status, kickoff_utc)
+  where status <> 'finished';
+
 create table if not exists predictions (
   id uuid primary key default uuid_generate_v4(),
   match_id uuid references matches(id) on delete cascade,
@@ -72,6 +81,94 @@ create table if not exists runs (
   notes text
 );
 
+-- Work leases: a job claims a match before paying for a Gemini call, so overlapping
+-- runs (or several workers splitting one backlog) never process the same match twice.
+create table if not exists work_leases (
+  match_id uuid references matches(id) on delete cascade,
+  job_name text not null,
+  owner text,
+  claimed_at timestamptz,
+  expires_at timestamptz,
+  primary key (match_id, job_name)
+);
+
+-- Returns the subset of p_match_ids now leased to p_owner (in the given order, at most
+-- p_limit). Rows leased by another live owner, or locked by a concurrent claim, are skipped.
+create or replace function claim_matches(
+  p_job text,
+  p_owner text,
+  p_match_ids uuid[],
+  p_lease_seconds integer default 900,
+  p_limit integer default null
+)
+returns table (match_id uuid)
+language sql
+as $$
+  insert into work_leases (match_id, job_name)
+  select unnest(p_match_ids), p_job
+  on conflict (match_id, job_name) do nothing;
+
+  with candidates as (
+    select w.match_id
+    from work_leases w
+    where w.job_name = p_job
+      and w.match_id = any(p_match_ids)
+      and (w.expires_at is null or w.expires_at < now() or w.owner = p_owner)
+    order by array_position(p_match_ids, w.match_id)
+    limit p_limit
+    for update skip locked
+  ), claimed as (
+    update work_leases l
+    set owner = p_owner,
+        claimed_at = now(),
+        expires_at = now() + make_interval(secs => p_lease_seconds)
+    from candidates c
+    where l.job_name = p_job and l.match_id = c.match_id
+    returning l.match_id
+  )
+  select claimed.match_id from claimed;
+$$;
+
+-- Gives leases back early (e.g. after a failed attempt) so the next run can retry at once.
+create or replace function release_matches(p_job text, p_owner text, p_match_ids uuid[])
+returns void
+language sql
+as $$
+  update work_leases
+  set owner = null, expires_at = null
+  where job_name = p_job and owner = p_owner and match_id = any(p_match_ids);
+$$;
+
+-- Per-phase timings written in bulk at the end of each run (jobs/tracing.py)
+create table if not exists run_spans (
+  id bigserial primary key,
+  run_id uuid references runs(id) on delete cascade,
+  name text not null,
+  started_at timestamptz,
+  duration_ms numeric,
+  status text,
+  league text,
+  attempt integer,
+  table_name text,
+  attrs jsonb
+);
+
+create index if not exists idx_run_spans_run on run_spans (run_id);
+create index if not exists idx_run_spans_name_started on run_spans (name, started_at);
+
+create or replace view run_span_stats as
+select
+  name,
+  league,
+  attempt,
+  table_name,
+  count(*) as n,
+  percentile_cont(0.5) within group (order by duration_ms) as p50_ms,
+  percentile_cont(0.95) within group (order by duration_ms) as p95_ms
+from run_spans
+where started_at > now() - interval '30 days'
+group by name, league, attempt, table_name;
+
 create or replace function set_updated_at()
 returns trigger as $$
 begin
@@ -85,3 +182,420 @@ create trigger trg_matches_updated
 before update on matches
 for each row
 execute procedure set_updated_at();
+
+-- Gemini token usage from usageMetadata: per call (summed over its attempts) and per run
+alter table predictions
+  add column if not exists prompt_tokens integer,
+  add column if not exists output_tokens integer,
+  add column if not exists tool_tokens integer,
+  add column if not exists thinking_tokens integer,
+  add column if not exists total_tokens integer;
+
+alter table results
+  add column if not exists prompt_tokens integer,
+  add column if not exists output_tokens integer,
+  add column if not exists tool_tokens integer,
+  add column if not exists thinking_tokens integer,
+  add column if not exists total_tokens integer;
+
+alter table runs
+  add column if not exists prompt_tokens integer,
+  add column if not exists output_tokens integer,
+  add column if not exists tool_tokens integer,
+  add column if not exists thinking_tokens integer,
+  add column if not exists total_tokens integer;
+
+create index if not exists idx_runs_started_at on runs (started_at);
+
+-- Daily budget guard (GEMINI_DAILY_TOKEN_BUDGET): spend of runs started since a point in time
+create or replace function tokens_used_since(p_since timestamptz)
+returns bigint
+language sql
+stable
+as $$
+  select coalesce(sum(total_tokens), 0)::bigint from runs where started_at >= p_since;
+$$;
+
+-- Recent prediction latencies for the pre_match planner
+create index if not exists idx_predictions_created_at on predictions (created_at);
+
+-- Two-stage predictions: research done hours ahead (jobs/research.py), refreshed near kickoff
+create table if not exists research_snapshots (
+  match_id uuid primary key references matches(id) on delete cascade,
+  created_at timestamptz default now(),
+  model_name text,
+  prompt_version text,
+  duration_ms integer,
+  json_payload jsonb,
+  sources jsonb,
+  prompt_tokens integer,
+  output_tokens integer,
+  tool_tokens integer,
+  thinking_tokens integer,
+  total_tokens integer
+);
+
+-- Snapshot the prediction was built on; null for a single-stage prediction
+alter table predictions
+  add column if not exists research_at timestamptz;
+
+-- Latest evaluation per slice (jobs/metrics.py); slice_type is all, league, prompt_version, model_name or week
+create table if not exists evaluation_metrics (
+  slice_type text not null,
+  slice_value text not null,
+  computed_at timestamptz,
+  n integer,
+  accuracy numeric,
+  brier numeric,
+  log_loss numeric,
+  baseline_n integer,
+  baseline_brier numeric,
+  baseline_log_loss numeric,
+  brier_skill numeric,
+  log_loss_skill numeric,
+  ece numeric,
+  calibration jsonb,
+  primary key (slice_type, slice_value)
+);
+
+-- Running totals per league, week (Monday, UTC), prompt version and model, kept up to date by a
+-- trigger on results so the dashboard and jobs/metrics.py read a handful of rows instead of
+-- rescanning every result. Only results with a prediction count. Sums, not means, so a result
+-- can be added or taken back; brier/log_loss sums cover the scored rows (complete probabilities).
+create table if not exists stats_rollup (
+  league text not null,
+  week date not null,
+  prompt_version text not null,
+  model_name text not null,
+  n integer not null default 0,
+  correct_n integer not null default 0,
+  scored_n integer not null default 0,
+  brier_sum numeric not null default 0,
+  log_loss_sum numeric not null default 0,
+  -- Scored rows that also have a baseline: the model's and the baseline's sums over the same rows
+  baseline_n integer not null default 0,
+  paired_brier_sum numeric not null default 0,
+  paired_log_loss_sum numeric not null default 0,
+  baseline_brier_sum numeric not null default 0,
+  baseline_log_loss_sum numeric not null default 0,
+  updated_at timestamptz default now(),
+  primary key (league, week, prompt_version, model_name)
+);
+
+-- Reliability bins (0-9) pooled over the three outcomes of every scored row
+create table if not exists stats_rollup_calibration (
+  league text not null,
+  week date not null,
+  prompt_version text not null,
+  model_name text not null,
+  bin integer not null,
+  n integer not null default 0,
+  predicted_sum numeric not null default 0,
+  observed_sum numeric not null default 0,
+  primary key (league, week, prompt_version, model_name, bin)
+);
+
+-- Scores of one result against its match's prediction and baseline (no row without a prediction)
+create or replace function stats_rollup_scores(p_match_id uuid, p_result_text text, p_correct boolean)
+returns table (
+  league text,
+  week date,
+  prompt_version text,
+  model_name text,
+  correct boolean,
+  probs numeric[],
+  actual integer,
+  brier numeric,
+  log_loss numeric,
+  baseline_brier numeric,
+  baseline_log_loss numeric
+)
+language sql
+stable
+as $$
+  with normalized as (
+    select
+      m.league,
+      date_trunc('week', m.kickoff_utc at time zone 'utc')::date as week,
+      coalesce(p.prompt_version, '?') as prompt_version,
+      coalesce(p.model_name, '?') as model_name,
+      coalesce(p_correct, false) as correct,
+      array_position(array['HOME', 'DRAW', 'AWAY'], p_result_text) as actual,
+      array[p.prob_home, p.prob_draw, p.prob_away] as raw,
+      p.prob_home + p.prob_draw + p.prob_away as total,
+      array[b.prob_home, b.prob_draw, b.prob_away] as base_raw,
+      b.prob_home + b.prob_draw + b.prob_away as base_total
+    from matches m
+    join predictions p on p.match_id = m.id
+    left join baselines b on b.match_id = m.id
+    where m.id = p_match_id
+  ), scored as (
+    select
+      n.*,
+      array(select x / nullif(n.total, 0) from unnest(n.raw) x) as p,
+      array(select x / nullif(n.base_total, 0) from unnest(n.base_raw) x) as b
+    from normalized n
+  )
+  select
+    s.league,
+    s.week,
+    s.prompt_version,
+    s.model_name,
+    s.correct,
+    s.p,
+    s.actual,
+    (s.p[1] - (s.actual = 1)::int) ^ 2 + (s.p[2] - (s.actual = 2)::int) ^ 2 + (s.p[3] - (s.actual = 3)::int) ^ 2,
+    case when s.p[s.actual] is not null then -ln(greatest(s.p[s.actual], 1e-15)) end,
+    (s.b[1] - (s.actual = 1)::int) ^ 2 + (s.b[2] - (s.actual = 2)::int) ^ 2 + (s.b[3] - (s.actual = 3)::int) ^ 2,
+    case when s.b[s.actual] is not null then -ln(greatest(s.b[s.actual], 1e-15)) end
+  from scored s;
+$$;
+
+-- Adds (p_sign = 1) or takes back (p_sign = -1) one result's contribution
+create or replace function stats_rollup_apply(p_match_id uuid, p_result_text text, p_correct boolean, p_sign integer)
+returns void
+language sql
+as $$
+  insert into stats_rollup as r (
+    league, week, prompt_version, model_name, n, correct_n, scored_n, brier_sum, log_loss_sum,
+    baseline_n, paired_brier_sum, paired_log_loss_sum, baseline_brier_sum, baseline_log_loss_sum
+  )
+  select
+    s.league, s.week, s.prompt_version, s.model_name,
+    p_sign,
+    p_sign * s.correct::int,
+    p_sign * (s.brier is not null)::int,
+    p_sign * coalesce(s.brier, 0),
+    p_sign * coalesce(s.log_loss, 0),
+    p_sign * (s.brier is not null and s.baseline_brier is not null)::int,
+    p_sign * case when s.baseline_brier is not null then coalesce(s.brier, 0) else 0 end,
+    p_sign * case when s.baseline_brier is not null then coalesce(s.log_loss, 0) else 0 end,
+    p_sign * case when s.brier is not null then coalesce(s.baseline_brier, 0) else 0 end,
+    p_sign * case when s.brier is not null then coalesce(s.baseline_log_loss, 0) else 0 end
+  from stats_rollup_scores(p_match_id, p_result_text, p_correct) s
+  on conflict (league, week, prompt_version, model_name) do update set
+    n = r.n + excluded.n,
+    correct_n = r.correct_n + excluded.correct_n,
+    scored_n = r.scored_n + excluded.scored_n,
+    brier_sum = r.brier_sum + excluded.brier_sum,
+    log_loss_sum = r.log_loss_sum + excluded.log_loss_sum,
+    baseline_n = r.baseline_n + excluded.baseline_n,
+    paired_brier_sum = r.paired_brier_sum + excluded.paired_brier_sum,
+    paired_log_loss_sum = r.paired_log_loss_sum + excluded.paired_log_loss_sum,
+    baseline_brier_sum = r.baseline_brier_sum + excluded.baseline_brier_sum,
+    baseline_log_loss_sum = r.baseline_log_loss_sum + excluded.baseline_log_loss_sum,
+    updated_at = now();
+
+  insert into stats_rollup_calibration as c (league, week, prompt_version, model_name, bin, n, predicted_sum, observed_sum)
+  select
+    s.league, s.week, s.prompt_version, s.model_name,
+    least(floor(x.prob * 10)::int, 9) as bin,
+    p_sign * count(*),
+    p_sign * sum(x.prob),
+    p_sign * sum((x.outcome = s.actual)::int)
+  from stats_rollup_scores(p_match_id, p_result_text, p_correct) s
+  cross join lateral unnest(s.probs) with ordinality as x(prob, outcome)
+  where s.brier is not null
+  group by 1, 2, 3, 4, 5
+  on conflict (league, week, prompt_version, model_name, bin) do update set
+    n = c.n + excluded.n,
+    predicted_sum = c.predicted_sum + excluded.predicted_sum,
+    observed_sum = c.observed_sum + excluded.observed_sum;
+$$;
+
+create or replace function results_stats_rollup()
+returns trigger as $$
+begin
+  if tg_op in ('UPDATE', 'DELETE') then
+    perform stats_rollup_apply(old.match_id, old.result_text, old.correct, -1);
+  end if;
+  if tg_op in ('INSERT', 'UPDATE') then
+    perform stats_rollup_apply(new.match_id, new.result_text, new.correct, 1);
+  end if;
+  return null;
+end;
+$$ language plpgsql;
+
+drop trigger if exists trg_results_stats_rollup on results;
+create trigger trg_results_stats_rollup
+after insert or update of result_text, correct or delete on results
+for each row
+execute procedure results_stats_rollup();
+
+-- Rebuilds both tables from results; also the backfill for results stored before the trigger.
+-- Run it again after editing predictions or baselines of already verified matches.
+create or replace function refresh_stats_rollup()
+returns void
+language sql
+as $$
+  delete from stats_rollup_calibration where true;
+  delete from stats_rollup where true;
+  select stats_rollup_apply(r.match_id, r.result_text, r.correct, 1) from results r;
+$$;
+
+select refresh_stats_rollup();
+
+-- Totals over all history for the dashboard; league 'all' is the sum over leagues
+create or replace view stats_totals as
+select
+  coalesce(league, 'all') as league,
+  sum(n)::bigint as n,
+  sum(correct_n)::bigint as correct_n,
+  sum(scored_n)::bigint as scored_n,
+  sum(brier_sum) as brier_sum
+from stats_rollup
+group by rollup (league);
+
+-- Writing a prediction or result bumps its match's updated_at, so matches.updated_at is the
+-- change marker of everything the dashboard shows for that match
+create or replace function touch_match()
+returns trigger as $$
+begin
+  update matches set updated_at = now() where id = new.match_id;
+  return null;
+end;
+$$ language plpgsql;
+
+drop trigger if exists trg_predictions_touch_match on predictions;
+create trigger trg_predictions_touch_match
+after insert or update on predictions
+for each row
+execute procedure touch_match();
+
+drop trigger if exists trg_results_touch_match on results;
+create trigger trg_results_touch_match
+after insert or update on results
+for each row
+execute procedure touch_match();
+
+-- The week window of the dashboard
+create index if not exists idx_matches_kickoff on matches (kickoff_utc);
+
+-- Only the columns web/index.html renders (no json_payload), with the sources flattened to a
+-- list of URLs. Poll with changed_at=gt.<last seen> for the matches changed since.
+-- security_invoker keeps the RLS policies of the underlying tables in force for anon.
+create or replace view dashboard_feed
+with (security_invoker = true) as
+select
+  m.id,
+  m.league,
+  m.kickoff_utc,
+  m.kickoff_israel,
+  m.home_team,
+  m.away_team,
+  m.status,
+  m.updated_at as changed_at,
+  p.predicted_winner,
+  p.prob_home,
+  p.prob_draw,
+  p.prob_away,
+  p.duration_ms,
+  r.final_home_goals,
+  r.final_away_goals,
+  r.correct,
+  array(
+    select jsonb_array_elements_text(s.urls)
+    from jsonb_each(coalesce(p.sources, r.sources)) as s(section, urls)
+    where jsonb_typeof(s.urls) = 'array'
+  ) as source_urls
+from matches m
+left join predictions p on p.match_id = m.id
+left join results r on r.match_id = m.id;
+
+-- Team strength for the baselines (jobs/ratings.py): one Elo rating per league and team, updated
+-- in O(1) by a trigger when a result is stored. Home advantage (60) matches HOME_ADVANTAGE in
+-- jobs/ratings.py; K = 20, scaled up for wider winning margins.
+create table if not exists team_ratings (
+  league text not null,
+  team text not null,
+  rating numeric not null default 1500,
+  matches_played integer not null default 0,
+  last_kickoff timestamptz,
+  updated_at timestamptz default now(),
+  primary key (league, team)
+);
+
+create or replace function apply_team_rating(p_match_id uuid, p_home_goals integer, p_away_goals integer)
+returns void
+language plpgsql
+as $$
+declare
+  m matches%rowtype;
+  r_home numeric;
+  r_away numeric;
+  expected numeric;
+  actual numeric;
+  margin numeric;
+  delta numeric;
+begin
+  if p_home_goals is null or p_away_goals is null then
+    return;
+  end if;
+  select * into m from matches where id = p_match_id;
+  if not found then
+    return;
+  end if;
+  insert into team_ratings (league, team)
+  values (m.league, m.home_team), (m.league, m.away_team)
+  on conflict (league, team) do nothing;
+  -- Both rows are locked in a fixed order, so concurrent results of a team neither deadlock nor
+  -- overwrite each other
+  perform 1 from team_ratings
+  where league = m.league and team in (m.home_team, m.away_team)
+  order by team
+  for update;
+  select rating into r_home from team_ratings where league = m.league and team = m.home_team;
+  select rating into r_away from team_ratings where league = m.league and team = m.away_team;
+
+  expected := 1 / (1 + power(10::numeric, -(r_home + 60 - r_away) / 400));
+  actual := case when p_home_goals > p_away_goals then 1 when p_home_goals = p_away_goals then 0.5 else 0 end;
+  margin := case abs(p_home_goals - p_away_goals)
+    when 0 then 1 when 1 then 1 when 2 then 1.5
+    else (11 + abs(p_home_goals - p_away_goals)) / 8.0
+  end;
+  delta := 20 * margin * (actual - expected);
+
+  update team_ratings
+  set rating = rating + case when team = m.home_team then delta else -delta end,
+      matches_played = matches_played + 1,
+      last_kickoff = greatest(last_kickoff, m.kickoff_utc),
+      updated_at = now()
+  where league = m.league and team in (m.home_team, m.away_team);
+end;
+$$;
+
+create or replace function results_team_rating()
+returns trigger as $$
+begin
+  perform apply_team_rating(new.match_id, new.final_home_goals, new.final_away_goals);
+  return null;
+end;
+$$ language plpgsql;
+
+drop trigger if exists trg_results_team_rating on results;
+create trigger trg_results_team_rating
+after insert on results
+for each row
+execute procedure results_team_rating();
+
+-- Replays every result in kickoff order; the backfill, and the fix after a corrected score
+create or replace function refresh_team_ratings()
+returns void
+language plpgsql
+as $$
+declare
+  r record;
+begin
+  delete from team_ratings where true;
+  for r in
+    select res.match_id, res.final_home_goals, res.final_away_goals
+    from results res
+    join matches m on m.id = res.match_id
+    order by m.kickoff_utc, res.match_id
+  loop
+    perform apply_team_rating(r.match_id, r.final_home_goals, r.final_away_goals);
+  end loop;
+end;
+$$;
+
+select refresh_team_ratings();
@@ -0,0 +1,128 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from gemini_client import GeminiClient
+from supabase_client import BatchWriter, SupabaseClient
+
+# Coroutine facades over the synchronous clients. The calls themselves still go through
+# GeminiClient/SupabaseClient (pooled keep-alive sessions, _retry_parse, _validate_*), so
+# retry and validation semantics are identical; each facade runs them on its own bounded
+# executor so a job can overlap Gemini calls, database reads and writes in one event loop.
+
+
+class _AsyncFacade:
+    def __init__(self, max_concurrency: int, name: str):
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=name)
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        # Keep contextvars (e.g. tracing state) visible inside the worker thread
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(ctx.run, fn, *args, **kwargs))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        # Waiting for calls still in flight must not block the event loop (and the other facade)
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+
+class AsyncGeminiClient(_AsyncFacade):
+    def __init__(self, client: GeminiClient, max_concurrency: int = 8):
+        super().__init__(max_concurrency, "gemini")
+        self.client = client
+
+    async def generate_pre_match_prediction(
+        self, match: Dict[str, Any], deadline: Optional[float] = None
+    ) -> Tuple[Dict[str, Any], int, Dict[str, int]]:
+        return await self.run(self.client.generate_pre_match_prediction, match, deadline=deadline)
+
+    async def verify_match_result(
+        self, match: Dict[str, Any], predicted_winner: str
+    ) -> Tuple[Dict[str, Any], int, Dict[str, int]]:
+        return await self.run(self.client.verify_match_result, match, predicted_winner)
+
+    async def verify_match_results_batch(
+        self, matches: List[Dict[str, Any]], predicted_winners: List[str]
+    ) -> Tuple[List[Optional[Dict[str, Any]]], int, Dict[str, int]]:
+        return await self.run(self.client.verify_match_results_batch, matches, predicted_winners)
+
+    async def fetch_fixtures(
+        self, league_code: str, league_name: str
+    ) -> Tuple[List[Dict[str, Any]], int, Dict[str, int]]:
+        return await self.run(self.client.fetch_fixtures, league_code, league_name)
+
+
+class AsyncBatchWriter:
+    def __init__(self, facade: "AsyncSupabaseClient", writer: BatchWriter):
+        self._facade = facade
+        self.writer = writer
+
+    @property
+    def failures(self) -> List[str]:
+        return self.writer.failures
+
+    def rejected(self, label: str) -> bool:
+        return self.writer.rejected(label)
+
+    async def insert(self, table: str, row: Dict[str, Any], label: str) -> None:
+        await self._facade.run(self.writer.insert, table, row, label)
+
+    async def upsert(self, table: str, row: Dict[str, Any], on_conflict: str, label: str) -> None:
+        await self._facade.run(self.writer.upsert, table, row, on_conflict, label)
+
+    async def patch(self, table: str, values: Dict[str, Any], row_id: str, label: str) -> None:
+        await self._facade.run(self.writer.patch, table, values, row_id, label)
+
+    async def flush(self) -> None:
+        await self._facade.run(self.writer.flush)
+
+    async def __aenter__(self) -> "AsyncBatchWriter":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.flush()
+
+
+class AsyncSupabaseClient(_AsyncFacade):
+    def __init__(self, client: SupabaseClient, max_concurrency: int = 8):
+        super().__init__(max_concurrency, "supabase")
+        self.client = client
+
+    def batch(self, max_rows: Optional[int] = None, max_age_sec: Optional[float] = None) -> AsyncBatchWriter:
+        return AsyncBatchWriter(self, self.client.batch(max_rows, max_age_sec))
+
+    async def log_run(self, job_name: str) -> str:
+        return await self.run(self.client.log_run, job_name)
+
+    async def finish_run(
+        self, run_id: str, status: str, notes: Optional[str] = None, usage: Optional[Dict[str, int]] = None
+    ) -> None:
+        await self.run(self.client.finish_run, run_id, status, notes, usage)
+
+    async def fetch_matches(self, params: Dict[str, str]) -> List[Dict[str, Any]]:
+        return await self.run(self.client.fetch_matches, params)
+
+    async def fetch_unpredicted_matches(self, params: Dict[str, str]) -> List[Dict[str, Any]]:
+        return await self.run(self.client.fetch_unpredicted_matches, params)
+
+    async def fetch_unresolved_matches(self, params: Dict[str, str]) -> List[Dict[str, Any]]:
+        return await self.run(self.client.fetch_unresolved_matches, params)
+
+    async def claim_matches(
+        self, job_name: str, owner: str, match_ids: List[str], lease_seconds: int, limit: Optional[int] = None
+    ) -> List[str]:
+        return await self.run(self.client.claim_matches, job_name, owner, match_ids, lease_seconds, limit)
+
+    async def release_matches(self, job_name: str, owner: str, match_ids: List[str]) -> None:
+        await self.run(self.client.release_matches, job_name, owner, match_ids)
+
+    async def fetch_results(self, params: Dict[str, str]) -> List[Dict[str, Any]]:
+        return await self.run(self.client.fetch_results, params)
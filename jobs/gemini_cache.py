@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# Seconds a cached response stays valid per call type; None means it never expires.
+CACHE_TTLS: Dict[str, Optional[int]] = {
+    "fixtures": 6 * 3600,
+    "result": None,  # a verified final score does not change
+    "result_batch": None,  # items that failed validation are re-verified one by one, not re-batched
+    "prediction": 10 * 60,
+    "research": 3 * 3600,
+    "prediction_delta": 10 * 60,
+}
+
+DEFAULT_MAX_MB = 50
+
+
+def cache_key(model: str, request_body: Dict[str, Any]) -> str:
+    """Content address of a request: model + system prompt + user prompt + tool/generation config."""
+    blob = json.dumps({"model": model, "request": request_body}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Cache interface with hit/miss counters. The base class stores nothing."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        return None
+
+    def _store(self, key: str, value: Dict[str, Any], expires_at: Optional[float]) -> None:
+        return None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._load(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: Dict[str, Any], ttl: Optional[int]) -> None:
+        expires_at = time.time() + ttl if ttl is not None else None
+        self._store(key, value, expires_at)
+
+    def summary(self) -> str:
+        return f"cache:hits={self.hits},misses={self.misses}"
+
+
+class DiskCache(ResponseCache):
+    """One JSON file per entry; least recently used entries are evicted beyond max_bytes."""
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024):
+        super().__init__()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as fh:
+                entry = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        expires_at = entry.get("expires_at")
+        if expires_at is not None and expires_at < time.time():
+            self._remove(path)
+            return None
+        try:
+            # mtime doubles as the LRU clock
+            os.utime(path)
+        except OSError:
+            pass
+        return entry.get("value")
+
+    def _store(self, key: str, value: Dict[str, Any], expires_at: Optional[float]) -> None:
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                json.dump({"expires_at": expires_at, "value": value}, fh, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            self._remove(tmp_path)
+            return
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for item in it:
+                if not item.name.endswith(".json"):
+                    continue
+                try:
+                    stat = item.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, item.path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            self._remove(path)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def cache_from_env() -> Optional[ResponseCache]:
+    directory = os.getenv("GEMINI_CACHE_DIR")
+    if not directory:
+        return None
+    max_mb = int(os.getenv("GEMINI_CACHE_MAX_MB", str(DEFAULT_MAX_MB)))
+    return DiskCache(directory, max_bytes=max_mb * 1024 * 1024)
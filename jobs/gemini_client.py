@@ -1,14 +1,67 @@
 import json
+import os
 import re
+import threading
 import time
+from concurrent.futures import Future
+from datetime import datetime, tzinfo
 from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from gemini_cache import CACHE_TTLS, ResponseCache, cache_from_env, cache_key
+from hedging import HedgePolicy, hedge_from_env
+from json_repair import normalize_probabilities, repair_json_text
+from json_stream import JSONStreamScanner
+from rate_limit import guard_from_env
+from schemas import (
+    FIXTURE_SCHEMA,
+    FIXTURES_SCHEMA,
+    PREDICTION_DELTA_SCHEMA,
+    PREDICTION_SCHEMA,
+    RESEARCH_SCHEMA,
+    RESULT_BATCH_SCHEMA,
+    RESULT_SCHEMA,
+    required_keys,
+)
+from tracing import current_run, span
 
 MODEL_ID = "gemini-3-flash-preview"
-GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+# Overridable to point the jobs at a stand-in or a recording proxy (bench/)
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com").rstrip("/")
+GEMINI_URL = GEMINI_BASE_URL + "/v1beta/models/{model}:generateContent"
+GEMINI_STREAM_URL = GEMINI_BASE_URL + "/v1beta/models/{model}:streamGenerateContent"
+API_TIMEOUT_SEC = 90
+# Below this much time left before a deadline, another attempt is not worth starting
+MIN_ATTEMPT_SEC = 5
+# Keep-alive connections shared by concurrent callers of one client
+HTTP_POOL_SIZE = 16
+CHARS_PER_TOKEN = 3
+# usageMetadata field -> column name used in predictions/results/runs
+USAGE_FIELDS = {
+    "promptTokenCount": "prompt_tokens",
+    "candidatesTokenCount": "output_tokens",
+    "toolUsePromptTokenCount": "tool_tokens",
+    "thoughtsTokenCount": "thinking_tokens",
+    "totalTokenCount": "total_tokens",
+}
 GROUNDING_RETRY_NOTE = "\n\nחובה לבצע חיפוש עם google_search ולהחזיר JSON בלבד עם מקורות (URLs) אמיתיים."
 JSON_FIX_NOTE = "\n\nתקן והחזר JSON תקני בעברית בלבד וללא טקסט נוסף."
+# v1 embeds the JSON template in the prompt; v2 sends the schemas in generationConfig.responseSchema
+PROMPT_VERSIONS = ("v1", "v2")
+DEFAULT_PROMPT_VERSION = "v1"
+# Expected shape per call kind, used to cut off a streamed answer early
+STREAM_SHAPES = {
+    "prediction": PREDICTION_SCHEMA,
+    "research": RESEARCH_SCHEMA,
+    "prediction_delta": PREDICTION_DELTA_SCHEMA,
+    "result": RESULT_SCHEMA,
+    "result_batch": RESULT_BATCH_SCHEMA,
+    "fixtures": FIXTURES_SCHEMA,
+}
+# A failed batch falls back to single-match calls, so it gets fewer attempts of its own
+BATCH_MAX_ATTEMPTS = 2
 
 # Prompt templates (Hebrew)
 PRE_MATCH_SYSTEM = (
@@ -37,56 +90,147 @@ PRE_MATCH_USER = """
 4) לצרף מקורות אינטרנט (URLs אמיתיים) תחת "sources" בתוך אותו JSON, לכל מקטע לפחות.
 
 החזר את ה-JSON EXACT במבנה הבא (מפתחות זהים):
-{
-  "match_details": {
+{{
+  "match_details": {{
     "fixture": "בית vs חוץ",
     "date": "DD/MM/YYYY",
     "time_israel": "HH:MM",
     "venue": "…",
-    "league_position": {
+    "league_position": {{
       "home": "…",
       "away": "…"
-    }
-  },
-  "team_news": {
-    "home": {
+    }}
+  }},
+  "team_news": {{
+    "home": {{
       "status": "Home Team",
       "current_form": "…",
       "missing_players": ["שם (סיבה)", "..."],
       "predicted_lineup": ["GK: ...", "DEF: ...", "MID: ...", "ATT: ..."],
       "notes": "…"
-    },
-    "away": {
+    }},
+    "away": {{
       "status": "Away Team",
       "current_form": "…",
       "missing_players": ["..."],
       "predicted_lineup": ["..."],
       "notes": "…"
-    }
-  },
-  "head_to_head_trends": {
+    }}
+  }},
+  "head_to_head_trends": {{
     "last_meeting": "…",
     "trend": "…",
     "away_dominance": "…"
-  },
-  "match_prediction": {
+  }},
+  "match_prediction": {{
     "estimated_winner": "HOME/DRAW/AWAY",
-    "win_probability": {
+    "win_probability": {{
       "home": "…%",
       "draw": "…%",
       "away": "…%"
-    },
+    }},
     "reasoning": "…",
     "recommended_bet_focus": "…"
-  },
-  "sources": {
+  }},
+  "sources": {{
     "match_details": ["<url1>", "<url2>"],
     "team_news_home": ["<url…>"],
     "team_news_away": ["<url…>"],
     "head_to_head": ["<url…>"],
     "prediction_context": ["<url…>"]
-  }
-}
+  }}
+}}
+"""
+
+RESEARCH_USER = """
+משימה: הכן תיק מחקר מוקדם למשחק בפורמט JSON קשיח ובעברית, עם חיפוש אינטרנטי חובה לכל פרמטר. אין להפיק תחזית.
+נתוני משחק ידועים:
+- ליגה: {league}
+- בית: {home_team}
+- חוץ: {away_team}
+- תאריך ושעה בישראל: {date_israel} {time_israel}
+- איצטדיון (אם ידוע): {venue_or_unknown}
+
+חובה:
+1) לבצע חיפוש אינטרנטי ולאמת:
+   - עמדות בטבלה ונקודות לשתי הקבוצות
+   - כושר אחרון (לפחות 5 משחקים אחרונים) בשפה תמציתית
+   - חיסורים ידועים (פציעות/השעיות/נבחרות) + סיבת חיסרון לכל שחקן
+   - Head-to-head: משחק אחרון ומגמות רלוונטיות
+2) אסור לנחש. אם אין מידע מאומת, כתוב "לא ידוע".
+3) הפלט חייב להיות JSON בלבד (ללא טקסט נוסף).
+4) לצרף מקורות אינטרנט (URLs אמיתיים) תחת "sources" בתוך אותו JSON, לכל מקטע לפחות.
+
+החזר את ה-JSON EXACT במבנה הבא (מפתחות זהים):
+{{
+  "league_position": {{"home": "…", "away": "…"}},
+  "current_form": {{"home": "…", "away": "…"}},
+  "missing_players": {{"home": ["שם (סיבה)", "..."], "away": ["..."]}},
+  "head_to_head_trends": {{
+    "last_meeting": "…",
+    "trend": "…",
+    "away_dominance": "…"
+  }},
+  "sources": {{
+    "match_details": ["<url1>", "<url2>"],
+    "team_news_home": ["<url…>"],
+    "team_news_away": ["<url…>"],
+    "head_to_head": ["<url…>"]
+  }}
+}}
+"""
+
+PRE_MATCH_DELTA_USER = """
+משימה: הפק תחזית משחק אחת בלבד בפורמט JSON קשיח ובעברית. המחקר הכללי בוצע מראש ומצורף; אל תחזור עליו.
+נתוני משחק ידועים:
+- ליגה: {league}
+- בית: {home_team}
+- חוץ: {away_team}
+- תאריך ושעה בישראל: {date_israel} {time_israel}
+- איצטדיון (אם ידוע): {venue_or_unknown}
+
+מחקר מוקדם (נכון ל-{research_at} UTC):
+{research}
+
+חובה:
+1) לבצע חיפוש אינטרנטי רק לעדכונים שאחרי המחקר:
+   - הרכבים רשמיים, או משוערים אם טרם פורסמו
+   - פציעות/השעיות של הרגע האחרון; החזר את רשימת החיסורים המעודכנת המלאה
+   - חדשות מהשעות האחרונות שמשפיעות על המשחק
+2) לקבוע תחזית על סמך המחקר והעדכונים. אסור לנחש; אם אין מידע מאומת, כתוב "לא ידוע" וציין אי-ודאות ב-notes.
+3) הפלט חייב להיות JSON בלבד (ללא טקסט נוסף).
+4) לצרף מקורות אינטרנט (URLs אמיתיים) לעדכונים ולתחזית תחת "sources".
+
+החזר את ה-JSON EXACT במבנה הבא (מפתחות זהים):
+{{
+  "team_news": {{
+    "home": {{
+      "missing_players": ["שם (סיבה)", "..."],
+      "predicted_lineup": ["GK: ...", "DEF: ...", "MID: ...", "ATT: ..."],
+      "notes": "…"
+    }},
+    "away": {{
+      "missing_players": ["..."],
+      "predicted_lineup": ["..."],
+      "notes": "…"
+    }}
+  }},
+  "match_prediction": {{
+    "estimated_winner": "HOME/DRAW/AWAY",
+    "win_probability": {{
+      "home": "…%",
+      "draw": "…%",
+      "away": "…%"
+    }},
+    "reasoning": "…",
+    "recommended_bet_focus": "…"
+  }},
+  "sources": {{
+    "team_news_home": ["<url…>"],
+    "team_news_away": ["<url…>"],
+    "prediction_context": ["<url…>"]
+  }}
+}}
 """
 
 POST_MATCH_SYSTEM = (
@@ -112,41 +256,311 @@ POST_MATCH_USER = """
 4) הפלט חייב להיות JSON בלבד, ולכלול sources (URLs אמיתיים).
 
 החזר JSON במבנה הבא:
-{
-  "match_details": {
+{{
+  "match_details": {{
     "fixture": "…",
     "date": "DD/MM/YYYY",
     "time_israel": "HH:MM",
     "venue": "…"
-  },
-  "final_score": {
+  }},
+  "final_score": {{
     "home_goals": 0,
     "away_goals": 0
-  },
+  }},
   "winner_result": "HOME/DRAW/AWAY",
-  "comparison": {
+  "comparison": {{
     "predicted_winner": "HOME/DRAW/AWAY",
     "is_correct": true
-  },
+  }},
   "notes": "…",
-  "sources": {
+  "sources": {{
     "result_verification": ["<url1>", "<url2>"]
-  }
-}
+  }}
+}}
+"""
+
+POST_MATCH_BATCH_USER = """
+משימה: אימות תוצאות של {count} משחקים בפורמט JSON קשיח ובעברית, עם חיפוש אינטרנטי חובה לכל משחק.
+משחקים (match_ref: ליגה | בית - חוץ | תאריך ושעה בישראל | predicted_winner):
+{matches}
+
+חובה:
+1) לכל משחק לבצע חיפוש אינטרנטי נפרד ולאמת תוצאה סופית (שערים). אסור לערבב נתונים בין משחקים.
+2) לקבוע winner_result (HOME/DRAW/AWAY) לפי התוצאה ולחשב is_correct ביחס ל-predicted_winner של אותו משחק.
+3) לכל משחק לצרף לפחות שני URLs אמיתיים ב-sources.result_verification.
+4) הפלט חייב להיות מערך JSON בלבד, פריט אחד לכל משחק, עם match_ref זהה לרשימה.
+
+החזר מערך JSON שכל פריט בו במבנה הבא:
+{{
+  "match_ref": "1",
+  "match_details": {{
+    "fixture": "…",
+    "date": "DD/MM/YYYY",
+    "time_israel": "HH:MM",
+    "venue": "…"
+  }},
+  "final_score": {{
+    "home_goals": 0,
+    "away_goals": 0
+  }},
+  "winner_result": "HOME/DRAW/AWAY",
+  "comparison": {{
+    "predicted_winner": "HOME/DRAW/AWAY",
+    "is_correct": true
+  }},
+  "notes": "…",
+  "sources": {{
+    "result_verification": ["<url1>", "<url2>"]
+  }}
+}}
+"""
+
+POST_MATCH_BATCH_ITEM = "{ref}: {league} | {home_team} - {away_team} | {date_israel} {time_israel} | {predicted_winner}"
+
+# v2: instructions only, the output structure comes from schemas.py
+PRE_MATCH_USER_V2 = """
+משימה: הפק תחזית משחק אחת בלבד בעברית, עם חיפוש אינטרנטי חובה לכל פרמטר.
+נתוני משחק ידועים:
+- ליגה: {league}
+- בית: {home_team}
+- חוץ: {away_team}
+- תאריך ושעה בישראל: {date_israel} {time_israel}
+- איצטדיון (אם ידוע): {venue_or_unknown}
+
+חובה:
+1) לאמת ברשת: עמדות בטבלה, כושר ב-5 המשחקים האחרונים, חיסורים וסיבותיהם, הרכב משוער ו-Head-to-head.
+2) אסור לנחש. אם אין מידע מאומת, כתוב "לא ידוע" וציין אי-ודאות ב-notes.
+3) win_probability באחוזים (0-100) שמסתכמים ל-100.
+4) לכל מקטע ב-sources לצרף URLs אמיתיים.
+"""
+
+RESEARCH_USER_V2 = """
+משימה: תיק מחקר מוקדם למשחק בעברית, עם חיפוש אינטרנטי חובה לכל פרמטר. אין להפיק תחזית.
+נתוני משחק ידועים:
+- ליגה: {league}
+- בית: {home_team}
+- חוץ: {away_team}
+- תאריך ושעה בישראל: {date_israel} {time_israel}
+- איצטדיון (אם ידוע): {venue_or_unknown}
+
+חובה:
+1) לאמת ברשת: עמדות בטבלה, כושר ב-5 המשחקים האחרונים, חיסורים ידועים וסיבותיהם ו-Head-to-head.
+2) אסור לנחש. אם אין מידע מאומת, כתוב "לא ידוע".
+3) לכל מקטע ב-sources לצרף URLs אמיתיים.
+"""
+
+PRE_MATCH_DELTA_USER_V2 = """
+משימה: תחזית משחק בעברית. המחקר הכללי בוצע מראש ומצורף; אל תחזור עליו.
+נתוני משחק ידועים:
+- ליגה: {league}
+- בית: {home_team}
+- חוץ: {away_team}
+- תאריך ושעה בישראל: {date_israel} {time_israel}
+- איצטדיון (אם ידוע): {venue_or_unknown}
+
+מחקר מוקדם (נכון ל-{research_at} UTC):
+{research}
+
+חובה:
+1) לחפש ברשת רק עדכונים שאחרי המחקר: הרכבים רשמיים (או משוערים), פציעות/השעיות של הרגע האחרון וחדשות מהשעות האחרונות.
+2) missing_players היא רשימת החיסורים המעודכנת המלאה.
+3) win_probability באחוזים (0-100) שמסתכמים ל-100, על סמך המחקר והעדכונים.
+4) לכל מקטע ב-sources לצרף URLs אמיתיים.
+"""
+
+POST_MATCH_USER_V2 = """
+משימה: אימות תוצאת משחק בעברית, עם חיפוש אינטרנטי חובה.
+נתוני משחק:
+- ליגה: {league}
+- בית: {home_team}
+- חוץ: {away_team}
+- תאריך ושעה בישראל: {date_israel} {time_israel}
+- predicted_winner שנשמר לפני המשחק: {predicted_winner}
+
+חובה:
+1) לאמת ברשת את התוצאה הסופית (שערים) ולקבוע winner_result לפיה.
+2) לחשב is_correct ביחס ל-predicted_winner.
+3) לצרף לפחות שני URLs אמיתיים ב-sources.result_verification.
+"""
+
+POST_MATCH_BATCH_USER_V2 = """
+משימה: אימות תוצאות של {count} משחקים בעברית, עם חיפוש אינטרנטי חובה לכל משחק.
+משחקים (match_ref: ליגה | בית - חוץ | תאריך ושעה בישראל | predicted_winner):
+{matches}
+
+חובה:
+1) לכל משחק לאמת ברשת את התוצאה הסופית (שערים) ולקבוע winner_result לפיה. אסור לערבב נתונים בין משחקים.
+2) לחשב is_correct ביחס ל-predicted_winner של אותו משחק.
+3) פריט אחד לכל משחק עם match_ref זהה לרשימה, ולפחות שני URLs אמיתיים ב-sources.result_verification.
 """
 
+FIXTURES_SYSTEM = "בצע חיפוש אינטרנטי והחזר JSON של משחקי שבוע הקרוב בלבד. השתמש בכלי google_search."
+FIXTURES_USER_V2 = (
+    "החזר את משחקי שבעת הימים הקרובים בליגה {league_name}. "
+    'בשדה league כתוב "{league_code}", ולכל משחק צרף source_urls אמיתיים.'
+)
+
 
 class GroundingError(Exception):
     """Raised when grounding evidence is missing after retries."""
 
 
+class DeadlineExceeded(Exception):
+    """Raised when there is no time left to start another attempt before the caller's deadline."""
+
+
+class TokenBudgetExceeded(Exception):
+    """Raised before a call once the daily token budget (GEMINI_DAILY_TOKEN_BUDGET) is used up."""
+
+
+class StreamAborted(ValueError):
+    """Raised when a streamed answer was cut off because it could no longer pass validation."""
+
+    def __init__(self, reason: str, duration_ms: int, usage: Optional[Dict[str, int]] = None):
+        super().__init__(f"stream aborted: {reason}")
+        self.reason = reason
+        self.duration_ms = duration_ms
+        self.usage = usage or empty_usage()
+
+
+def empty_usage() -> Dict[str, int]:
+    return dict.fromkeys(USAGE_FIELDS.values(), 0)
+
+
+def add_usage(total: Dict[str, int], usage: Dict[str, int]) -> Dict[str, int]:
+    for key in total:
+        total[key] += usage.get(key) or 0
+    return total
+
+
+def _parse_usage(data: Dict[str, Any]) -> Dict[str, int]:
+    meta = data.get("usageMetadata") or {}
+    return {column: int(meta.get(field) or 0) for field, column in USAGE_FIELDS.items()}
+
+
+def merge_research(match: Dict[str, Any], research: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    """Builds the PREDICTION_SCHEMA payload from a research snapshot and the near-kickoff update."""
+
+    def team(side: str, status: str) -> Dict[str, Any]:
+        update = delta["team_news"].get(side) or {}
+        return {
+            "status": status,
+            "current_form": (research.get("current_form") or {}).get(side, "לא ידוע"),
+            # The update carries the full, current list of absences; an empty list is an answer too
+            "missing_players": (
+                update["missing_players"]
+                if isinstance(update.get("missing_players"), list)
+                else (research.get("missing_players") or {}).get(side, [])
+            ),
+            "predicted_lineup": update.get("predicted_lineup") or [],
+            "notes": update.get("notes") or "",
+        }
+
+    sources: Dict[str, List[str]] = {}
+    for part in (research.get("sources") or {}, delta.get("sources") or {}):
+        for key, urls in part.items():
+            merged = sources.setdefault(key, [])
+            merged.extend(url for url in urls or [] if url not in merged)
+    return {
+        "match_details": {
+            "fixture": f"{match['home_team']} vs {match['away_team']}",
+            "date": match["date_israel"],
+            "time_israel": match["time_israel"],
+            "venue": match.get("venue") or "לא ידוע",
+            "league_position": research.get("league_position") or {},
+        },
+        "team_news": {"home": team("home", "Home Team"), "away": team("away", "Away Team")},
+        "head_to_head_trends": research.get("head_to_head_trends") or {},
+        "match_prediction": delta["match_prediction"],
+        "sources": sources,
+    }
+
+
 class GeminiClient:
     """Wrapper around Gemini HTTP API with strict JSON validation and retries."""
 
-    def __init__(self, api_key: str, model: str = MODEL_ID):
+    def __init__(
+        self,
+        api_key: str,
+        model: str = MODEL_ID,
+        cache: Optional[ResponseCache] = None,
+        prompt_version: Optional[str] = None,
+        stream: Optional[bool] = None,
+        hedge: Optional[HedgePolicy] = None,
+        concurrency: int = 1,
+    ):
         self.api_key = api_key
         # Ignore caller-provided model to hard-enforce required id
         self.model = MODEL_ID
+        self.prompt_version = prompt_version or os.getenv("GEMINI_PROMPT_VERSION", DEFAULT_PROMPT_VERSION)
+        if self.prompt_version not in PROMPT_VERSIONS:
+            raise ValueError(f"Unknown prompt_version {self.prompt_version!r}, expected one of {PROMPT_VERSIONS}")
+        self.cache = cache if cache is not None else cache_from_env()
+        self.stream = stream if stream is not None else os.getenv("GEMINI_STREAM", "0") == "1"
+        # concurrency: how many threads of the job share this client; sizes the hedging pool
+        self.hedge = hedge if hedge is not None else hedge_from_env(concurrency)
+        # Quotas, 429/5xx backoff and the circuit breaker are shared with other processes on the host
+        self.guard = guard_from_env("gemini", "GEMINI")
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE))
+        self.daily_token_budget = int(os.getenv("GEMINI_DAILY_TOKEN_BUDGET", "0"))
+        # Tokens counted against the budget: today's finished runs + this process since load_budget
+        self._budget_used = 0
+        self._run_usage: Dict[Optional[str], Dict[str, int]] = {}
+        self._usage_lock = threading.Lock()
+
+    @property
+    def structured(self) -> bool:
+        return self.prompt_version == "v2"
+
+    def cache_note(self) -> Optional[str]:
+        """Hit/miss counters for runs.notes, or None when the cache was not used."""
+        if self.cache is None or not (self.cache.hits or self.cache.misses):
+            return None
+        return self.cache.summary()
+
+    def load_budget(self, supabase, tz: tzinfo) -> None:
+        """Starts the budget from today's recorded spend (runs since local midnight)."""
+        if not self.daily_token_budget:
+            return
+        midnight = datetime.now(tz).replace(hour=0, minute=0, second=0, microsecond=0)
+        used = supabase.tokens_used_since(midnight.isoformat())
+        with self._usage_lock:
+            self._budget_used = used
+
+    def _check_budget(self) -> None:
+        if self.daily_token_budget and self._budget_used >= self.daily_token_budget:
+            raise TokenBudgetExceeded(f"{self._budget_used}/{self.daily_token_budget} tokens used today")
+
+    def _account(self, usage: Dict[str, int], run_id: Optional[str] = None) -> None:
+        with self._usage_lock:
+            self._budget_used += usage["total_tokens"]
+            add_usage(self._run_usage.setdefault(run_id or current_run(), empty_usage()), usage)
+
+    def _account_discarded(self, run_id: Optional[str]) -> Callable[[Future], None]:
+        """Counts the tokens of a hedged attempt whose answer lost, once it finishes."""
+
+        def account(future: Future) -> None:
+            exc = future.exception()
+            if exc is None:
+                self._account(future.result()[3], run_id)
+            elif isinstance(exc, StreamAborted):
+                self._account(exc.usage, run_id)
+
+        return account
+
+    def run_usage(self, run_id: Optional[str]) -> Dict[str, int]:
+        """Token totals of every call made while run_id was bound; for runs (finish_run)."""
+        with self._usage_lock:
+            return self._run_usage.pop(run_id, None) or empty_usage()
+
+    def run_notes(self) -> List[str]:
+        """Cache and hedging counters for runs.notes (empty when neither was used)."""
+        notes = [self.cache_note()]
+        if self.hedge is not None and self.hedge.calls:
+            notes.append(self.hedge.summary())
+        return [note for note in notes if note]
 
     @staticmethod
     def _extract_json_text(text: str) -> str:
@@ -200,18 +614,57 @@ class GeminiClient:
         cleaned = GeminiClient._extract_json_text(text)
         return json.loads(cleaned)
 
-    def _call_api(self, system_instruction: str, user_prompt: str) -> Tuple[str, Dict[str, Any], int]:
-        url = GEMINI_URL.format(model=self.model)
-        headers = {"Content-Type": "application/json"}
-        params = {"key": self.api_key}
-        payload = {
+    @staticmethod
+    def _build_request(
+        system_instruction: str, user_prompt: str, schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        generation_config: Dict[str, Any] = {"responseMimeType": "application/json"}
+        if schema is not None:
+            generation_config["responseSchema"] = schema
+        return {
             "systemInstruction": {"parts": [{"text": system_instruction}]},
             "contents": [{"role": "user", "parts": [{"text": user_prompt}]}],
-            "generationConfig": {"responseMimeType": "application/json"},
+            "generationConfig": generation_config,
             "tools": [{"google_search": {}}],
         }
+
+    def _call_api(
+        self,
+        system_instruction: str,
+        user_prompt: str,
+        timeout: float = API_TIMEOUT_SEC,
+        schema: Optional[Dict[str, Any]] = None,
+        kind: Optional[str] = None,
+    ) -> Tuple[str, Dict[str, Any], int, Dict[str, int]]:
+        if self.hedge is None:
+            return self._send(system_instruction, user_prompt, timeout, schema, kind)
+        return self.hedge.call(
+            lambda remaining: self._send(system_instruction, user_prompt, remaining, schema, kind),
+            timeout,
+            # The callback runs on the hedging thread, outside this run's context
+            on_discard=self._account_discarded(current_run()),
+        )
+
+    def _send(
+        self,
+        system_instruction: str,
+        user_prompt: str,
+        timeout: float,
+        schema: Optional[Dict[str, Any]],
+        kind: Optional[str],
+    ) -> Tuple[str, Dict[str, Any], int, Dict[str, int]]:
+        headers = {"Content-Type": "application/json"}
+        params = {"key": self.api_key}
+        payload = self._build_request(system_instruction, user_prompt, schema)
+        if self.stream:
+            return self._stream_api(payload, params, headers, timeout, kind)
+        url = GEMINI_URL.format(model=self.model)
         start = time.time()
-        resp = requests.post(url, params=params, headers=headers, json=payload, timeout=90)
+        resp = self.guard.send(
+            lambda remaining: self.session.post(url, params=params, headers=headers, json=payload, timeout=remaining),
+            timeout,
+            self._estimate_tokens(payload),
+        )
         duration_ms = int((time.time() - start) * 1000)
         resp.raise_for_status()
         data = resp.json()
@@ -220,7 +673,68 @@ class GeminiClient:
         metadata = candidate.get("groundingMetadata") or {}
         if not text:
             raise ValueError("Gemini response missing text")
-        return text, metadata, duration_ms
+        return text, metadata, duration_ms, _parse_usage(data)
+
+    @staticmethod
+    def _estimate_tokens(payload: Dict[str, Any]) -> int:
+        # Rough input size for the tokens/min bucket; Hebrew runs denser than the usual 4 chars/token
+        return len(json.dumps(payload, ensure_ascii=False)) // CHARS_PER_TOKEN
+
+    def _stream_api(
+        self, payload: Dict[str, Any], params: Dict[str, str], headers: Dict[str, str], timeout: float, kind: Optional[str]
+    ) -> Tuple[str, Dict[str, Any], int, Dict[str, int]]:
+        """
+        Same contract as the blocking call, over server-sent events. Every text chunk is fed to a
+        JSONStreamScanner; as soon as the partial document cannot match the expected shape the
+        connection is closed and StreamAborted is raised. TTFT is recorded on the span.
+        """
+        url = GEMINI_STREAM_URL.format(model=self.model)
+        scanner = JSONStreamScanner(STREAM_SHAPES.get(kind))
+        parts: List[str] = []
+        metadata: Dict[str, Any] = {}
+        usage = empty_usage()
+        start = time.time()
+        with span("gemini.stream") as stream_span:
+            resp = self.guard.send(
+                lambda remaining: self.session.post(
+                    url, params={**params, "alt": "sse"}, headers=headers, json=payload, timeout=remaining, stream=True
+                ),
+                timeout,
+                self._estimate_tokens(payload),
+            )
+            try:
+                resp.raise_for_status()
+                for line in resp.iter_lines(decode_unicode=True):
+                    # requests' timeout is per read; the attempt as a whole is bounded here
+                    if time.time() - start > timeout:
+                        raise requests.Timeout(f"stream exceeded {timeout:.0f}s")
+                    if not line or not line.startswith("data:"):
+                        continue
+                    chunk = json.loads(line[len("data:") :])
+                    candidate = (chunk.get("candidates") or [{}])[0]
+                    metadata = candidate.get("groundingMetadata") or metadata
+                    if chunk.get("usageMetadata"):
+                        # Counts are cumulative; the last chunk carries the totals
+                        usage = _parse_usage(chunk)
+                    for part in (candidate.get("content") or {}).get("parts") or []:
+                        text = part.get("text")
+                        if not text:
+                            continue
+                        if not parts:
+                            stream_span["attrs"]["ttft_ms"] = int((time.time() - start) * 1000)
+                        parts.append(text)
+                        reason = scanner.feed(text)
+                        if reason:
+                            stream_span["attrs"]["aborted"] = reason
+                            raise StreamAborted(reason, int((time.time() - start) * 1000), usage)
+            finally:
+                resp.close()
+            stream_span["attrs"]["chunks"] = len(parts)
+        duration_ms = int((time.time() - start) * 1000)
+        text = "".join(parts)
+        if not text:
+            raise ValueError("Gemini response missing text")
+        return text, metadata, duration_ms, usage
 
     def _retry_parse(
         self,
@@ -228,46 +742,107 @@ class GeminiClient:
         user_prompt: str,
         validator: Optional[Callable[[Dict[str, Any]], None]] = None,
         max_attempts: int = 3,
-    ) -> Tuple[Dict[str, Any], int]:
+        deadline: Optional[float] = None,
+        cache_kind: Optional[str] = None,
+        schema: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[Dict[str, Any], int, Dict[str, int]]:
+        key = None
+        if self.cache is not None and cache_kind:
+            key = cache_key(self.model, self._build_request(system_prompt, user_prompt, schema))
+            with span("gemini.cache", kind=cache_kind) as sp:
+                cached = self.cache.get(key)
+                sp["attrs"]["hit"] = cached is not None
+            if cached is not None:
+                # Served from cache: nothing was spent this time
+                return cached["payload"], cached["duration_ms"], empty_usage()
         last_error: Optional[Exception] = None
         total_duration = 0
+        total_usage = empty_usage()
         prompt_base = user_prompt
         for attempt in range(max_attempts):
+            timeout = API_TIMEOUT_SEC
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining < MIN_ATTEMPT_SEC:
+                    raise DeadlineExceeded(
+                        f"deadline reached after {attempt} attempts"
+                        + (f" (last error: {last_error})" if last_error else "")
+                    )
+                timeout = min(timeout, remaining)
+            self._check_budget()
             prompt = prompt_base + (GROUNDING_RETRY_NOTE if attempt > 0 else "")
-            text, metadata, duration_ms = self._call_api(system_prompt, prompt)
-            total_duration += duration_ms
-            try:
-                parsed = self._parse_json(text)
-            except (json.JSONDecodeError, ValueError) as exc:
-                last_error = exc
-                prompt_base = user_prompt + JSON_FIX_NOTE
-                continue
-            if validator:
+            with span(
+                "gemini.attempt", kind=cache_kind, attempt=attempt + 1, prompt_version=self.prompt_version
+            ) as attempt_span:
+                parsed = None
+                repairs: List[str] = []
                 try:
-                    validator(parsed)
-                except (ValueError, KeyError, TypeError) as exc:
+                    with span("gemini.call"):
+                        text, metadata, duration_ms, usage = self._call_api(
+                            system_prompt, prompt, timeout, schema, cache_kind
+                        )
+                    total_duration += duration_ms
+                except StreamAborted as exc:
+                    # The partial answer already broke the expected shape; generation was cut short
+                    total_duration += exc.duration_ms
+                    usage = exc.usage
                     last_error = exc
-                    prompt_base = user_prompt + JSON_FIX_NOTE
+                    retry_reason = "stream_abort"
+                    text = None
+                self._account(usage)
+                add_usage(total_usage, usage)
+                attempt_span["attrs"].update({k: v for k, v in usage.items() if v})
+                if text is not None:
+                    # Broken JSON and near-miss payloads are first repaired locally; only what
+                    # cannot be fixed here costs another grounded call.
+                    with span("gemini.parse"):
+                        try:
+                            parsed = self._parse_json(text)
+                        except (json.JSONDecodeError, ValueError) as exc:
+                            parsed, repairs = repair_json_text(text, self._extract_json_text)
+                            if parsed is None:
+                                last_error = exc
+                                retry_reason = "json"
+                if parsed is not None and validator:
+                    with span("gemini.validate"):
+                        try:
+                            validator(parsed)
+                        except (ValueError, KeyError, TypeError) as exc:
+                            fixes = normalize_probabilities(parsed)
+                            if fixes and self._passes(validator, parsed):
+                                repairs.extend(fixes)
+                            else:
+                                parsed = None
+                                last_error = exc
+                                retry_reason = "validation"
+                if repairs:
+                    attempt_span["attrs"]["repairs"] = repairs
+                if parsed is not None and not self._has_grounding(metadata):
+                    parsed = None
+                    last_error = GroundingError("grounding metadata missing or empty")
+                    retry_reason = "grounding"
+                if parsed is None:
+                    attempt_span["status"] = "retry"
+                    attempt_span["attrs"]["retry_reason"] = retry_reason
+                    attempt_span["attrs"]["error"] = str(last_error)[:300]
+                    note = GROUNDING_RETRY_NOTE if retry_reason == "grounding" else JSON_FIX_NOTE
+                    prompt_base = user_prompt + note
                     continue
-            if not self._has_grounding(metadata):
-                last_error = GroundingError("grounding metadata missing or empty")
-                prompt_base = user_prompt + GROUNDING_RETRY_NOTE
-                continue
-            return parsed, total_duration
+            if key is not None:
+                self.cache.set(key, {"payload": parsed, "duration_ms": total_duration}, CACHE_TTLS[cache_kind])
+            return parsed, total_duration, total_usage
         raise last_error or GroundingError("Grounding missing after retries")
 
     @staticmethod
-    def _validate_prediction(payload: Dict[str, Any]) -> None:
-        required = [
-            "match_details",
-            "team_news",
-            "head_to_head_trends",
-            "match_prediction",
-            "sources",
-        ]
-        for key in required:
-            if key not in payload:
-                raise ValueError(f"Missing key {key}")
+    def _passes(validator: Callable[[Any], None], payload: Any) -> bool:
+        try:
+            validator(payload)
+        except (ValueError, KeyError, TypeError):
+            return False
+        return True
+
+    @staticmethod
+    def _check_probabilities(payload: Dict[str, Any]) -> None:
         probs = payload["match_prediction"]["win_probability"]
         numbers = []
         for k in ("home", "draw", "away"):
@@ -278,27 +853,53 @@ class GeminiClient:
         total = sum(numbers)
         if not 98 <= total <= 102:
             raise ValueError("Probabilities must sum to ~100")
+
+    @staticmethod
+    def _validate_prediction(payload: Dict[str, Any]) -> None:
+        for key in required_keys(PREDICTION_SCHEMA):
+            if key not in payload:
+                raise ValueError(f"Missing key {key}")
+        GeminiClient._check_probabilities(payload)
         sources = payload.get("sources") or {}
-        GeminiClient._ensure_sources(
-            sources,
-            ["match_details", "team_news_home", "team_news_away", "head_to_head", "prediction_context"],
-        )
+        GeminiClient._ensure_sources(sources, required_keys(PREDICTION_SCHEMA["properties"]["sources"]))
+
+    @staticmethod
+    def _validate_research(payload: Dict[str, Any]) -> None:
+        for key in required_keys(RESEARCH_SCHEMA):
+            if key not in payload:
+                raise ValueError(f"Missing key {key}")
+        sources = payload.get("sources") or {}
+        GeminiClient._ensure_sources(sources, required_keys(RESEARCH_SCHEMA["properties"]["sources"]))
+
+    @staticmethod
+    def _validate_prediction_delta(payload: Dict[str, Any]) -> None:
+        for key in required_keys(PREDICTION_DELTA_SCHEMA):
+            if key not in payload:
+                raise ValueError(f"Missing key {key}")
+        for side in ("home", "away"):
+            if not isinstance(payload["team_news"].get(side), dict):
+                raise ValueError(f"Missing team_news.{side}")
+        GeminiClient._check_probabilities(payload)
+        sources = payload.get("sources") or {}
+        GeminiClient._ensure_sources(sources, required_keys(PREDICTION_DELTA_SCHEMA["properties"]["sources"]))
 
     @staticmethod
     def _validate_result(payload: Dict[str, Any]) -> None:
-        required = [
-            "match_details",
-            "final_score",
-            "winner_result",
-            "comparison",
-            "sources",
-        ]
-        for key in required:
+        for key in required_keys(RESULT_SCHEMA):
             if key not in payload:
                 raise ValueError(f"Missing key {key}")
         sources = payload.get("sources") or {}
         GeminiClient._ensure_sources(sources, ["result_verification"], {"result_verification": 2})
 
+    @staticmethod
+    def _validate_result_batch(payload: Any) -> None:
+        # Only the envelope; every item is checked against _validate_result on its own
+        if not isinstance(payload, list):
+            raise ValueError("Batch result response must be list")
+        for item in payload:
+            if not isinstance(item, dict) or "match_ref" not in item:
+                raise ValueError("Batch result entries must be objects with match_ref")
+
     @staticmethod
     def _validate_fixtures(payload: Any) -> None:
         if not isinstance(payload, list):
@@ -306,15 +907,16 @@ class GeminiClient:
         for item in payload:
             if not isinstance(item, dict):
                 raise ValueError("Fixture entries must be objects")
-            for key in ("league", "home_team", "away_team", "kickoff_utc", "source_urls"):
+            for key in required_keys(FIXTURE_SCHEMA):
                 if key not in item:
                     raise ValueError(f"Missing {key} in fixture row")
             GeminiClient._ensure_sources({"source_urls": item.get("source_urls")}, ["source_urls"])
 
     def generate_pre_match_prediction(
-        self, match: Dict[str, Any]
-    ) -> Tuple[Dict[str, Any], int]:
-        user_prompt = PRE_MATCH_USER.format(
+        self, match: Dict[str, Any], deadline: Optional[float] = None
+    ) -> Tuple[Dict[str, Any], int, Dict[str, int]]:
+        template = PRE_MATCH_USER_V2 if self.structured else PRE_MATCH_USER
+        user_prompt = template.format(
             league=match["league"],
             home_team=match["home_team"],
             away_team=match["away_team"],
@@ -322,13 +924,73 @@ class GeminiClient:
             time_israel=match["time_israel"],
             venue_or_unknown=match.get("venue") or "לא ידוע",
         )
-        payload, duration_ms = self._retry_parse(PRE_MATCH_SYSTEM, user_prompt, self._validate_prediction)
-        return payload, duration_ms
+        payload, duration_ms, usage = self._retry_parse(
+            PRE_MATCH_SYSTEM,
+            user_prompt,
+            self._validate_prediction,
+            deadline=deadline,
+            cache_kind="prediction",
+            schema=PREDICTION_SCHEMA if self.structured else None,
+        )
+        return payload, duration_ms, usage
+
+    def generate_research(
+        self, match: Dict[str, Any], deadline: Optional[float] = None
+    ) -> Tuple[Dict[str, Any], int, Dict[str, int]]:
+        """First stage: standings, form, absences and head-to-head, researched well before kickoff."""
+        template = RESEARCH_USER_V2 if self.structured else RESEARCH_USER
+        user_prompt = template.format(
+            league=match["league"],
+            home_team=match["home_team"],
+            away_team=match["away_team"],
+            date_israel=match["date_israel"],
+            time_israel=match["time_israel"],
+            venue_or_unknown=match.get("venue") or "לא ידוע",
+        )
+        payload, duration_ms, usage = self._retry_parse(
+            PRE_MATCH_SYSTEM,
+            user_prompt,
+            self._validate_research,
+            deadline=deadline,
+            cache_kind="research",
+            schema=RESEARCH_SCHEMA if self.structured else None,
+        )
+        return payload, duration_ms, usage
+
+    def generate_pre_match_update(
+        self, match: Dict[str, Any], research: Dict[str, Any], research_at: str, deadline: Optional[float] = None
+    ) -> Tuple[Dict[str, Any], int, Dict[str, int]]:
+        """
+        Second stage: searches only lineups and late news on top of a stored research snapshot.
+        Returns a full prediction payload (merge_research), like generate_pre_match_prediction.
+        """
+        template = PRE_MATCH_DELTA_USER_V2 if self.structured else PRE_MATCH_DELTA_USER
+        brief = {key: value for key, value in research.items() if key != "sources"}
+        user_prompt = template.format(
+            league=match["league"],
+            home_team=match["home_team"],
+            away_team=match["away_team"],
+            date_israel=match["date_israel"],
+            time_israel=match["time_israel"],
+            venue_or_unknown=match.get("venue") or "לא ידוע",
+            research_at=research_at,
+            research=json.dumps(brief, ensure_ascii=False, separators=(",", ":")),
+        )
+        delta, duration_ms, usage = self._retry_parse(
+            PRE_MATCH_SYSTEM,
+            user_prompt,
+            self._validate_prediction_delta,
+            deadline=deadline,
+            cache_kind="prediction_delta",
+            schema=PREDICTION_DELTA_SCHEMA if self.structured else None,
+        )
+        return merge_research(match, research, delta), duration_ms, usage
 
     def verify_match_result(
         self, match: Dict[str, Any], predicted_winner: str
-    ) -> Tuple[Dict[str, Any], int]:
-        user_prompt = POST_MATCH_USER.format(
+    ) -> Tuple[Dict[str, Any], int, Dict[str, int]]:
+        template = POST_MATCH_USER_V2 if self.structured else POST_MATCH_USER
+        user_prompt = template.format(
             league=match["league"],
             home_team=match["home_team"],
             away_team=match["away_team"],
@@ -336,11 +998,58 @@ class GeminiClient:
             time_israel=match["time_israel"],
             predicted_winner=predicted_winner,
         )
-        payload, duration_ms = self._retry_parse(POST_MATCH_SYSTEM, user_prompt, self._validate_result)
-        return payload, duration_ms
+        payload, duration_ms, usage = self._retry_parse(
+            POST_MATCH_SYSTEM,
+            user_prompt,
+            self._validate_result,
+            cache_kind="result",
+            schema=RESULT_SCHEMA if self.structured else None,
+        )
+        return payload, duration_ms, usage
 
-    def fetch_fixtures(self, league_code: str, league_name: str) -> Tuple[List[Dict[str, Any]], int]:
-        system_prompt = "בצע חיפוש אינטרנטי והחזר JSON של משחקי שבוע הקרוב בלבד. השתמש בכלי google_search."
+    def verify_match_results_batch(
+        self, matches: List[Dict[str, Any]], predicted_winners: List[str]
+    ) -> Tuple[List[Optional[Dict[str, Any]]], int, Dict[str, int]]:
+        """
+        Verifies several matches in one grounded call. Returns one payload per input match, in
+        order; None where the item is missing or fails _validate_result.
+        """
+        lines = [
+            POST_MATCH_BATCH_ITEM.format(ref=i + 1, predicted_winner=winner, **match)
+            for i, (match, winner) in enumerate(zip(matches, predicted_winners))
+        ]
+        template = POST_MATCH_BATCH_USER_V2 if self.structured else POST_MATCH_BATCH_USER
+        user_prompt = template.format(count=len(matches), matches="\n".join(lines))
+        payload, duration_ms, usage = self._retry_parse(
+            POST_MATCH_SYSTEM,
+            user_prompt,
+            self._validate_result_batch,
+            max_attempts=BATCH_MAX_ATTEMPTS,
+            cache_kind="result_batch",
+            schema=RESULT_BATCH_SCHEMA if self.structured else None,
+        )
+        by_ref: Dict[str, Dict[str, Any]] = {}
+        for item in payload:
+            by_ref.setdefault(str(item["match_ref"]).strip(), item)
+        results: List[Optional[Dict[str, Any]]] = []
+        for i in range(len(matches)):
+            item = by_ref.get(str(i + 1))
+            if item is not None:
+                item = {k: v for k, v in item.items() if k != "match_ref"}
+                if not self._passes(self._validate_result, item):
+                    item = None
+            results.append(item)
+        return results, duration_ms, usage
+
+    def fetch_fixtures(
+        self, league_code: str, league_name: str
+    ) -> Tuple[List[Dict[str, Any]], int, Dict[str, int]]:
+        if self.structured:
+            user_prompt = FIXTURES_USER_V2.format(league_name=league_name, league_code=league_code)
+            payload, duration_ms, usage = self._retry_parse(
+                FIXTURES_SYSTEM, user_prompt, self._validate_fixtures, cache_kind="fixtures", schema=FIXTURES_SCHEMA
+            )
+            return payload, duration_ms, usage
         user_prompt = (
             "השב במבנה JSON של מערך משחקים לשבעת הימים הקרובים בליגה {league_name}. "
             "כל אובייקט במערך חייב להכיל: "
@@ -348,5 +1057,7 @@ class GeminiClient:
             '"kickoff_utc":"YYYY-MM-DDTHH:MM:SSZ","source_urls":["<url1>","<url2>"]}} '
             "החזר JSON בלבד בעברית ללא טקסט נוסף."
         ).format(league_name=league_name, league_code=league_code)
-        payload, duration_ms = self._retry_parse(system_prompt, user_prompt, self._validate_fixtures)
-        return payload, duration_ms
+        payload, duration_ms, usage = self._retry_parse(
+            FIXTURES_SYSTEM, user_prompt, self._validate_fixtures, cache_kind="fixtures"
+        )
+        return payload, duration_ms, usage
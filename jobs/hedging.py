@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable, Optional
+
+from tracing import in_context, span
+
+# Hedged requests: when a call is still running after a high percentile of recently observed
+# latency, a duplicate is sent and whichever answers first wins. The loser is not cancelled
+# (requests cannot abort a blocking call); its answer is discarded, but it is still handed to
+# on_discard when it finishes so the caller can count what it spent.
+
+
+class HedgePolicy:
+    def __init__(
+        self,
+        percentile: float = 0.9,
+        max_rate: float = 0.1,
+        min_samples: int = 20,
+        window: int = 200,
+        min_delay_sec: float = 5.0,
+        callers: int = 1,
+    ):
+        self.percentile = percentile
+        # At most this share of calls may send a duplicate, which caps the extra quota spend
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self.min_delay_sec = min_delay_sec
+        self.calls = 0
+        self.started = 0
+        self.won = 0
+        self._latencies: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+        # Each calling thread has at most a primary and its duplicate in flight, so a primary never
+        # waits for a slot behind other callers' duplicates
+        self._executor = ThreadPoolExecutor(max_workers=2 * max(1, callers), thread_name_prefix="hedge")
+
+    def seed(self, durations_ms: Iterable[float]) -> None:
+        """Preloads latencies from earlier runs (e.g. run_spans) so a short cron job can hedge from its first call."""
+        with self._lock:
+            for value in durations_ms:
+                if value is not None:
+                    self._latencies.append(float(value) / 1000)
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def _observe_attempt(self, future: Future, start: float) -> None:
+        if future.exception() is None:
+            self.observe(time.time() - start)
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None while there are too few samples."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(self.percentile * len(ordered)))
+        return max(self.min_delay_sec, ordered[index])
+
+    def _acquire(self) -> bool:
+        with self._lock:
+            # One hedge is always allowed so short runs are not locked out by the ratio
+            if self.started >= max(1.0, self.max_rate * self.calls):
+                return False
+            self.started += 1
+            return True
+
+    def summary(self) -> str:
+        return f"hedge:calls={self.calls},started={self.started},won={self.won}"
+
+    def call(
+        self,
+        fn: Callable[[float], Any],
+        timeout: float,
+        on_discard: Optional[Callable[[Future], None]] = None,
+    ) -> Any:
+        """
+        Runs fn(timeout), hedging it once if it is slow. fn receives the time it may still take,
+        so a duplicate started late shares the original attempt's deadline. The attempt that is not
+        returned is passed to on_discard once it is done, whether it succeeded or failed.
+        """
+        with self._lock:
+            self.calls += 1
+        delay = self.delay()
+        start = time.time()
+        if delay is None or delay >= timeout:
+            result = fn(timeout)
+            self.observe(time.time() - start)
+            return result
+        running = threading.Event()
+        began = [start]
+
+        def attempt(remaining: float) -> Any:
+            began[0] = time.time()
+            running.set()
+            return fn(remaining)
+
+        primary = self._executor.submit(in_context(attempt), timeout)
+        # Only the primary's own duration is a latency sample: the hedged wall time is the faster
+        # of two attempts and would pull the percentile down
+        primary.add_done_callback(lambda future: self._observe_attempt(future, began[0]))
+        # The hedge clock starts when the primary runs; time spent waiting for a pool thread is
+        # not a slow request and must not trigger a duplicate
+        running.wait()
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._acquire():
+            return primary.result()
+        with span("gemini.hedge", delay_ms=int(delay * 1000)) as sp:
+            backup = self._executor.submit(in_context(fn), timeout - (time.time() - start))
+            winner = self._first_success([primary, backup])
+            sp["attrs"]["won"] = winner is backup
+        if winner is backup:
+            with self._lock:
+                self.won += 1
+        loser = primary if winner is backup else backup
+        if on_discard is not None:
+            loser.add_done_callback(on_discard)
+        return winner.result()
+
+    @staticmethod
+    def _first_success(futures: list) -> Future:
+        pending = set(futures)
+        failed: Optional[Future] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future
+                failed = failed or future
+        return failed
+
+
+def hedge_from_env(callers: int = 1) -> Optional[HedgePolicy]:
+    """callers: how many threads share the client (the job's worker count)."""
+    if os.getenv("GEMINI_HEDGE", "0") != "1":
+        return None
+    return HedgePolicy(
+        percentile=float(os.getenv("GEMINI_HEDGE_PERCENTILE", "0.9")),
+        max_rate=float(os.getenv("GEMINI_HEDGE_MAX_RATE", "0.1")),
+        callers=callers,
+    )
@@ -0,0 +1,193 @@
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+# Deterministic, local fixes for the usual ways a Gemini JSON answer is broken. Every
+# function returns the names of the repairs it applied so they can be recorded.
+
+PROB_KEYS = ("home", "draw", "away")
+_NUMBER_RE = re.compile(r"-?\d+(?:[.,]\d+)?")
+
+
+def _closers(stack: List[str]) -> str:
+    return "".join("}" if c == "{" else "]" for c in reversed(stack))
+
+
+def _sanitize(text: str) -> Tuple[str, List[str]]:
+    """String-aware pass: drops trailing commas and escapes raw control characters inside strings."""
+    out: List[str] = []
+    repairs: List[str] = []
+    in_str = False
+    escaped = False
+    for ch in text:
+        if in_str:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_str = False
+            elif ch in "\n\r\t":
+                out.append({"\n": "\\n", "\r": "\\r", "\t": "\\t"}[ch])
+                if "escaped_control_chars" not in repairs:
+                    repairs.append("escaped_control_chars")
+                continue
+            out.append(ch)
+            continue
+        if ch == '"':
+            in_str = True
+        elif ch in "}]":
+            # A comma directly before a closing bracket is dropped
+            j = len(out) - 1
+            while j >= 0 and out[j] in " \n\r\t":
+                j -= 1
+            if j >= 0 and out[j] == ",":
+                del out[j]
+                if "trailing_comma" not in repairs:
+                    repairs.append("trailing_comma")
+        out.append(ch)
+    return "".join(out), repairs
+
+
+def _close_truncated(text: str) -> Tuple[str, List[str]]:
+    """
+    If the document stops mid-way, cut it after the last complete value and close every
+    open object/array. Keys without a value and half-written literals are dropped.
+    """
+    stack: List[str] = []
+    expect_key: List[bool] = []
+    cut: Optional[Tuple[int, str]] = None
+    in_str = False
+    str_is_key = False
+    escaped = False
+    scalar_start: Optional[int] = None
+
+    def value_done(end: int) -> None:
+        nonlocal cut
+        cut = (end, _closers(stack))
+
+    for i, ch in enumerate(text):
+        if in_str:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_str = False
+                if not str_is_key:
+                    value_done(i + 1)
+            continue
+        if scalar_start is not None:
+            if ch in ",}] \n\r\t":
+                value_done(i)
+                scalar_start = None
+            else:
+                continue
+        if ch == '"':
+            in_str = True
+            str_is_key = bool(stack) and stack[-1] == "{" and expect_key[-1]
+        elif ch in "{[":
+            stack.append(ch)
+            expect_key.append(ch == "{")
+            value_done(i + 1)
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+                expect_key.pop()
+            value_done(i + 1)
+        elif ch == ":":
+            if expect_key:
+                expect_key[-1] = False
+        elif ch == ",":
+            if stack and stack[-1] == "{":
+                expect_key[-1] = True
+        elif not ch.isspace():
+            scalar_start = i
+
+    if not stack and not in_str:
+        return text, []
+    if in_str and not str_is_key:
+        # Keep the partial string value rather than dropping it
+        return text + '"' + _closers(stack), ["closed_truncated"]
+    if scalar_start is not None and not in_str:
+        # A number may simply be cut short; keep it if it parses on its own
+        try:
+            json.loads(text[scalar_start:])
+            value_done(len(text))
+        except ValueError:
+            pass
+    if cut is None:
+        return text, []
+    end, closers = cut
+    head = text[:end].rstrip()
+    # A container opened right at the cut may still hold a dangling comma
+    head = re.sub(r",\s*$", "", head)
+    return head + closers, ["closed_truncated"]
+
+
+def repair_json_text(text: str, extract) -> Tuple[Optional[Any], List[str]]:
+    """
+    Tries to turn a broken answer into JSON. `extract` is the caller's fence/prose stripper.
+    Returns (parsed, repairs), or (None, repairs) when local repair is not enough.
+    """
+    cleaned = extract(text)
+    repairs: List[str] = []
+    if cleaned != text.strip():
+        repairs.append("stripped_wrapper")
+    cleaned, applied = _sanitize(cleaned)
+    repairs.extend(applied)
+    try:
+        return json.loads(cleaned), repairs
+    except ValueError:
+        pass
+    closed, applied = _close_truncated(cleaned)
+    repairs.extend(applied)
+    closed, applied = _sanitize(closed)
+    repairs.extend(a for a in applied if a not in repairs)
+    try:
+        return json.loads(closed), repairs
+    except ValueError:
+        return None, repairs
+
+
+def _to_number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        match = _NUMBER_RE.search(value)
+        if match:
+            return float(match.group(0).replace(",", "."))
+    return None
+
+
+def normalize_probabilities(payload: Any) -> List[str]:
+    """
+    Rewrites match_prediction.win_probability in place as "NN%" strings: fractions are
+    scaled to percent and totals between 97 and 103 are renormalized to 100.
+    """
+    if not isinstance(payload, dict):
+        return []
+    probs = (payload.get("match_prediction") or {}).get("win_probability")
+    if not isinstance(probs, dict):
+        return []
+    values = [_to_number(probs.get(k)) for k in PROB_KEYS]
+    if any(v is None or v < 0 for v in values):
+        return []
+    repairs: List[str] = []
+    if any(not (isinstance(probs.get(k), str) and probs[k].strip().endswith("%")) for k in PROB_KEYS):
+        repairs.append("probability_format")
+    total = sum(values)
+    if 0.97 <= total <= 1.03:
+        values = [v * 100 for v in values]
+        total *= 100
+        repairs.append("fraction_to_percent")
+    if not 97 <= total <= 103:
+        return []
+    if total != 100:
+        values = [v * 100 / total for v in values]
+        repairs.append("renormalized")
+    for k, v in zip(PROB_KEYS, values):
+        probs[k] = f"{round(v, 1):g}%"
+    return repairs
@@ -0,0 +1,85 @@
+from typing import Any, Dict, List, Optional, Set
+
+# Incremental scanner for a JSON answer arriving in chunks. It does not build the document;
+# it only tracks enough structure to tell early that the answer cannot pass validation: the
+# wrong root type or a root object that closed without its required keys. Like
+# GeminiClient._extract_json_text, it skips any text (prose, a ```json fence) before the first
+# { or [, and it ignores extra top-level keys, which the validators accept too.
+
+_ROOT_CHARS = {"OBJECT": "{", "ARRAY": "["}
+
+
+class JSONStreamScanner:
+    def __init__(self, shape: Optional[Dict[str, Any]] = None):
+        shape = shape or {}
+        self._root = _ROOT_CHARS.get(shape.get("type"))
+        self._required: List[str] = list(shape.get("required") or [])
+        self._seen: Set[str] = set()
+        self._started = False
+        self._open = ""
+        self._done = False
+        self._aborted: Optional[str] = None
+        self._depth = 0
+        self._in_str = False
+        self._escaped = False
+        self._expect_key = False
+        self._key_chars: Optional[List[str]] = None
+
+    def feed(self, chunk: str) -> Optional[str]:
+        """Consumes the next piece of text. Returns the abort reason once the answer is known to be bad."""
+        for ch in chunk:
+            if self._aborted or self._done:
+                break
+            if not self._started:
+                self._scan_prefix(ch)
+            else:
+                self._scan(ch)
+        return self._aborted
+
+    def _scan_prefix(self, ch: str) -> None:
+        if ch not in "{[":
+            return
+        if self._root and ch != self._root:
+            self._aborted = "root_type"
+            return
+        self._started = True
+        self._open = ch
+        self._depth = 1
+        self._expect_key = ch == "{"
+
+    def _scan(self, ch: str) -> None:
+        if self._in_str:
+            if self._escaped:
+                self._escaped = False
+            elif ch == "\\":
+                self._escaped = True
+            elif ch == '"':
+                self._in_str = False
+                if self._key_chars is not None:
+                    self._finish_key("".join(self._key_chars))
+                    self._key_chars = None
+                return
+            if self._key_chars is not None:
+                self._key_chars.append(ch)
+            return
+        if ch == '"':
+            self._in_str = True
+            if self._depth == 1 and self._expect_key:
+                self._key_chars = []
+        elif ch in "{[":
+            self._depth += 1
+        elif ch in "}]":
+            self._depth -= 1
+            if self._depth == 0:
+                self._done = True
+                missing = [k for k in self._required if k not in self._seen]
+                if self._open == "{" and missing:
+                    self._aborted = "missing_keys:" + ",".join(missing)
+        elif self._depth == 1 and self._open == "{":
+            if ch == ":":
+                self._expect_key = False
+            elif ch == ",":
+                self._expect_key = True
+
+    def _finish_key(self, key: str) -> None:
+        self._seen.add(key)
@@ -1,43 +1,157 @@
 import os
-from datetime import datetime, timedelta, timezone
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
 
-from supabase_client import SupabaseClient
+import numpy as np
 
+from supabase_client import ROLLUP_KEY, SupabaseClient
+from tracing import flush, span, start_run
 
-def compute_brier(prob_home, prob_draw, prob_away, outcome):
-    actual = {"HOME": 0, "DRAW": 0, "AWAY": 0}
-    actual[outcome] = 1
-    return (
-        (prob_home - actual["HOME"]) ** 2
-        + (prob_draw - actual["DRAW"]) ** 2
-        + (prob_away - actual["AWAY"]) ** 2
-    )
+# Evaluation over the full history from stats_rollup: a trigger on results keeps running sums per
+# league, week, prompt version and model (db/schema.sql), so this job reads those few rows instead
+# of every result and only has to add them up per slice. Accuracy, Brier, log-loss, calibration
+# and skill against the baselines all follow from sums.
+
+SLICES = ("league", "prompt_version", "model_name", "week")
+SUMS = (
+    "n",
+    "correct_n",
+    "scored_n",
+    "brier_sum",
+    "log_loss_sum",
+    "baseline_n",
+    "paired_brier_sum",
+    "paired_log_loss_sum",
+    "baseline_brier_sum",
+    "baseline_log_loss_sum",
+)
+CALIBRATION_SUMS = ("n", "predicted_sum", "observed_sum")
+CALIBRATION_BINS = 10
+
+
+def to_arrays(rows: List[Dict[str, Any]], calibration: bool = False) -> Dict[str, np.ndarray]:
+    """Key columns as strings and sum columns as floats (plus the bin of calibration rows)."""
+    data = {key: np.array([str(row.get(key)) for row in rows], dtype=object) for key in ROLLUP_KEY}
+    for column in CALIBRATION_SUMS if calibration else SUMS:
+        data[column] = np.array([float(row.get(column) or 0) for row in rows], dtype=float)
+    if calibration:
+        data["bin"] = np.array([int(row["bin"]) for row in rows], dtype=np.int64)
+    return data
+
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+
+def _value(x: Any) -> Optional[float]:
+    x = float(x)
+    return None if np.isnan(x) or np.isinf(x) else round(x, 4)
+
+
+def _labels(slice_type: str, data: Dict[str, np.ndarray], calibration: Dict[str, np.ndarray]):
+    """Slice labels and the index of each rollup and calibration row into them."""
+    if slice_type == "all":
+        zeros = np.zeros(len(data["n"]), np.int64), np.zeros(len(calibration["n"]), np.int64)
+        return (np.array(["all"], dtype=object),) + zeros
+    labels, index = np.unique(data[slice_type], return_inverse=True)
+    # Calibration rows exist only for rollup keys that have scored rows, so every value is in labels
+    return labels, index, np.searchsorted(labels, calibration[slice_type]).astype(np.int64)
+
+
+def evaluate(data: Dict[str, np.ndarray], calibration: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+    """One metrics row per slice value, plus slice_type "all"."""
+    if not data["n"].sum():
+        return []
+    out = []
+    for slice_type in ("all",) + SLICES:
+        labels, index, cal_index = _labels(slice_type, data, calibration)
+        groups = len(labels)
+        totals = {column: np.bincount(index, weights=data[column], minlength=groups) for column in SUMS}
+        accuracy = _ratio(totals["correct_n"], totals["n"])
+        brier = _ratio(totals["brier_sum"], totals["scored_n"])
+        log_loss = _ratio(totals["log_loss_sum"], totals["scored_n"])
+        # Skill is measured on the rows that have a baseline, for model and baseline alike
+        paired_brier = _ratio(totals["paired_brier_sum"], totals["baseline_n"])
+        paired_log_loss = _ratio(totals["paired_log_loss_sum"], totals["baseline_n"])
+        base_brier = _ratio(totals["baseline_brier_sum"], totals["baseline_n"])
+        base_log_loss = _ratio(totals["baseline_log_loss_sum"], totals["baseline_n"])
+        brier_skill = 1 - _ratio(paired_brier, base_brier)
+        log_loss_skill = 1 - _ratio(paired_log_loss, base_log_loss)
+
+        cell = cal_index * CALIBRATION_BINS + calibration["bin"]
+        size = groups * CALIBRATION_BINS
+        bins = {
+            column: np.bincount(cell, weights=calibration[column], minlength=size).reshape(groups, CALIBRATION_BINS)
+            for column in CALIBRATION_SUMS
+        }
+        bin_predicted = _ratio(bins["predicted_sum"], bins["n"])
+        bin_observed = _ratio(bins["observed_sum"], bins["n"])
+        gap = np.where(bins["n"] > 0, np.abs(bin_predicted - bin_observed), 0.0)
+        ece = _ratio((bins["n"] * gap).sum(axis=1), bins["n"].sum(axis=1))
+
+        for g, label in enumerate(labels):
+            if not totals["n"][g]:
+                continue
+            out.append(
+                {
+                    "slice_type": slice_type,
+                    "slice_value": str(label),
+                    "n": int(totals["n"][g]),
+                    "accuracy": _value(accuracy[g]),
+                    "brier": _value(brier[g]),
+                    "log_loss": _value(log_loss[g]),
+                    "baseline_n": int(totals["baseline_n"][g]),
+                    "baseline_brier": _value(base_brier[g]),
+                    "baseline_log_loss": _value(base_log_loss[g]),
+                    "brier_skill": _value(brier_skill[g]),
+                    "log_loss_skill": _value(log_loss_skill[g]),
+                    "ece": _value(ece[g]),
+                    "calibration": [
+                        {
+                            "bin": b,
+                            "n": int(bins["n"][g, b]),
+                            "predicted": _value(bin_predicted[g, b]),
+                            "observed": _value(bin_observed[g, b]),
+                        }
+                        for b in np.flatnonzero(bins["n"][g] > 0).tolist()
+                    ],
+                }
+            )
+    return out
 
 
 def main():
-    os.environ["TZ"] = "UTC"
     supabase = SupabaseClient()
-    end = datetime.now(timezone.utc)
-    start = end - timedelta(days=7)
-    results = supabase.fetch_results({"and": f"(verified_at.gte.{start.isoformat()})"})
-    total = len(results)
-    if total == 0:
-        print("No results to summarize")
-        return
-    correct = 0
-    brier_sum = 0.0
-    for res in results:
-        preds = supabase.fetch_predictions(res["match_id"])
-        if preds:
-            pred = preds[0]
-            brier_sum += compute_brier(pred["prob_home"], pred["prob_draw"], pred["prob_away"], res["result_text"])
-            if res["result_text"] == pred["predicted_winner"]:
-                correct += 1
-    accuracy = correct / total if total else 0
-    brier = brier_sum / total if total else 0
-    print(
-        f"סטטיסטיקה שבועית: משחקים={total}, דיוק={accuracy:.2%}, Brier={brier:.3f}"
-    )
+    run_id = supabase.log_run("metrics")
+    start_run(run_id)
+    status = "ok"
+    notes = []
+    try:
+        page_size = int(os.getenv("METRICS_PAGE_SIZE", "1000"))
+        with span("metrics.load"):
+            rollup = supabase.fetch_stats_rollup(page_size)
+            calibration = supabase.fetch_stats_calibration(page_size)
+        start = time.perf_counter()
+        with span("metrics.compute"):
+            metrics = evaluate(to_arrays(rollup), to_arrays(calibration, calibration=True))
+        compute_ms = int((time.perf_counter() - start) * 1000)
+        computed_at = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+        for row in metrics:
+            row["computed_at"] = computed_at
+        supabase.upsert_evaluation_metrics(metrics)
+        overall = metrics[0] if metrics else {}
+        notes.append(
+            f"rollup_rows={len(rollup)} calibration_rows={len(calibration)} n={overall.get('n', 0)} "
+            f"slices={len(metrics)} compute={compute_ms}ms accuracy={overall.get('accuracy')} brier={overall.get('brier')}"
+        )
+    except Exception as exc:  # noqa: BLE001
+        status = "error"
+        notes.append(f"שגיאת מערכת: {exc}")
+    finally:
+        flush(supabase, run_id)
+        supabase.finish_run(run_id, status, "; ".join(notes) if notes else None)
 
 
 if __name__ == "__main__":
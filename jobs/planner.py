@@ -0,0 +1,62 @@
+import heapq
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Capacity-aware planning for pre_match. Every upcoming match needs one prediction of roughly
+# `latency` seconds, finished by a per-match time, with `workers` predictions in flight at once.
+# Scheduling backwards from the latest finish time (reverse EDF) gives each match the latest start
+# that still leaves room for everything after it: a lone match waits, a cluster of kickoffs is
+# pulled forward, and a match whose latest start is already past cannot be fitted.
+
+DEFAULT_LATENCY_SEC = 120.0
+
+
+def latency_estimate(
+    durations_ms: Iterable[Optional[float]], percentile: float = 0.9, min_samples: int = 10
+) -> float:
+    """High percentile of recent end-to-end prediction times (retries included), in seconds."""
+    values = sorted(float(v) / 1000 for v in durations_ms if v)
+    if len(values) < min_samples:
+        return DEFAULT_LATENCY_SEC
+    return values[min(len(values) - 1, int(percentile * len(values)))]
+
+
+def latest_starts(finish_by: Dict[str, float], latency_sec: float, workers: int) -> Dict[str, float]:
+    """Latest start per key so that every key is finished by its time on `workers` parallel lanes."""
+    # Max-heap (negated) of the time each lane must be free by, working backwards
+    lanes = [-float("inf")] * max(1, workers)
+    starts: Dict[str, float] = {}
+    for key, due in sorted(finish_by.items(), key=lambda item: item[1], reverse=True):
+        lane_free_by = -heapq.heappop(lanes)
+        start = min(due, lane_free_by) - latency_sec
+        starts[key] = start
+        heapq.heappush(lanes, -start)
+    return starts
+
+
+def plan(
+    matches: List[Dict[str, Any]],
+    kickoff_ts: Callable[[Dict[str, Any]], float],
+    now_ts: float,
+    latency_sec: float,
+    workers: int,
+    target_before_sec: float,
+    deadline_before_sec: float,
+    lookahead_sec: float,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Returns (due, unfit). `due` are the matches whose planned start falls before the next run
+    (now + lookahead), most urgent first. Starts are planned against the preferred finish
+    (kickoff - target_before_sec); `unfit` are matches that cannot be finished even by their hard
+    deadline (kickoff - deadline_before_sec) with the given capacity. They are still in `due`.
+    """
+    by_id = {m["id"]: m for m in matches}
+    kickoffs = {match_id: kickoff_ts(m) for match_id, m in by_id.items()}
+    preferred = latest_starts(
+        {match_id: ko - target_before_sec for match_id, ko in kickoffs.items()}, latency_sec, workers
+    )
+    hard = latest_starts(
+        {match_id: ko - deadline_before_sec for match_id, ko in kickoffs.items()}, latency_sec, workers
+    )
+    due_ids = sorted((mid for mid, start in preferred.items() if start <= now_ts + lookahead_sec), key=preferred.get)
+    unfit = [by_id[mid] for mid in due_ids if hard[mid] < now_ts]
+    return [by_id[mid] for mid in due_ids], unfit
@@ -1,11 +1,14 @@
+import asyncio
 import os
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 
 import requests
 
-from gemini_client import GeminiClient, GroundingError
-from supabase_client import SupabaseClient
+from async_clients import AsyncGeminiClient, AsyncSupabaseClient
+from gemini_client import GeminiClient, GroundingError, TokenBudgetExceeded, add_usage
+from supabase_client import SupabaseClient, embedded_one, lease_owner
+from tracing import flush, span, start_run
 
 
 def decide_winner(home_goals, away_goals):
@@ -18,67 +21,245 @@ def decide_winner(home_goals, away_goals):
     return "DRAW"
 
 
-def main():
-    tz = ZoneInfo(os.getenv("APP_TZ", "Asia/Jerusalem"))
-    gemini = GeminiClient(os.environ["GEMINI_API_KEY"])
-    supabase = SupabaseClient()
-    run_id = supabase.log_run("post_match")
+def _match_label(match):
+    return f"משחק {match.get('home_team')} - {match.get('away_team')}"
+
+
+def _predicted_winner(match):
+    pred = embedded_one(match.get("predictions"))
+    return pred["predicted_winner"] if pred else "DRAW"
+
+
+def _match_context(match, tz):
+    kickoff_raw = match.get("kickoff_utc") or match.get("kickoff_israel")
+    kickoff_dt = datetime.fromisoformat(kickoff_raw.replace("Z", "+00:00"))
+    kickoff_israel = kickoff_dt.astimezone(tz)
+    return {
+        "league": match["league"],
+        "home_team": match["home_team"],
+        "away_team": match["away_team"],
+        "date_israel": kickoff_israel.strftime("%d/%m/%Y"),
+        "time_israel": kickoff_israel.strftime("%H:%M"),
+    }
+
+
+async def verify_match(match, gemini, writer, tz, carry=None):
+    """carry: (duration_ms, usage) of an earlier call for this match that no stored row accounts for."""
+    predicted_winner = _predicted_winner(match)
+    payload, duration_ms, usage = await gemini.verify_match_result(_match_context(match, tz), predicted_winner)
+    if carry is not None:
+        duration_ms += carry[0]
+        usage = add_usage(dict(usage), carry[1])
+    await store_result(match, predicted_winner, payload, duration_ms, usage, writer)
+
+
+def _split(total, parts):
+    """total spread over parts in whole numbers; the first part takes the remainder."""
+    total = total or 0
+    return [total // parts + (total % parts if i == 0 else 0) for i in range(parts)]
+
+
+async def verify_batch(matches, gemini, writer, tz):
+    """
+    Verifies a group of matches in one grounded call. Returns (leftovers, carry): the matches that
+    still need a single call, and the call's (duration_ms, usage) when no result took it.
+    """
+    winners = [_predicted_winner(match) for match in matches]
+    payloads, duration_ms, usage = await gemini.verify_match_results_batch(
+        [_match_context(match, tz) for match in matches], winners
+    )
+    verified = [(m, w, p) for m, w, p in zip(matches, winners, payloads) if p is not None]
+    leftovers = [match for match, payload in zip(matches, payloads) if payload is None]
+    if not verified:
+        # Every match falls back to a single call; the first of them stores this call's spend
+        return leftovers, (duration_ms, usage)
+    # The call's time and tokens are split over the results it produced, so they add up to the call
+    durations = _split(duration_ms, len(verified))
+    usage_shares = {key: _split(value, len(verified)) for key, value in usage.items()}
+    for i, (match, winner, payload) in enumerate(verified):
+        share = {key: values[i] for key, values in usage_shares.items()}
+        await store_result(match, winner, payload, durations[i], share, writer)
+    return leftovers, None
+
+
+async def store_result(match, predicted_winner, payload, duration_ms, usage, writer):
+    final_score = payload.get("final_score", {})
+    home_goals = final_score.get("home_goals")
+    away_goals = final_score.get("away_goals")
+    result_text = decide_winner(home_goals, away_goals)
+    is_correct = result_text == predicted_winner
+    result_row = {
+        "match_id": match["id"],
+        "verified_at": datetime.now(timezone.utc).isoformat(),
+        "duration_ms": duration_ms,
+        "final_home_goals": home_goals,
+        "final_away_goals": away_goals,
+        "result_text": result_text,
+        "correct": is_correct,
+        "json_payload": payload,
+        "sources": payload.get("sources"),
+        "data_cutoff_time": datetime.now(timezone.utc).isoformat(),
+        **usage,
+    }
+    label = _match_label(match)
+    await writer.insert("results", result_row, label)
+    await writer.patch("matches", {"status": "finished"}, match["id"], label)
+
+
+def settings_from_env():
+    return {
+        "tz": ZoneInfo(os.getenv("APP_TZ", "Asia/Jerusalem")),
+        # Only unresolved matches from the recent past are considered, so the cost of a run
+        # does not grow with the size of the matches table.
+        "lookback_days": int(os.getenv("POSTMATCH_LOOKBACK_DAYS", "7")),
+        "max_per_run": int(os.getenv("POSTMATCH_MAX_PER_RUN", "40")),
+        "concurrency": int(os.getenv("POSTMATCH_CONCURRENCY", "4")),
+        "lease_sec": int(os.getenv("POSTMATCH_LEASE_SEC", "900")),
+        # Matches of one league are verified together in groups of up to this many; 1 disables batching
+        "batch_size": int(os.getenv("POSTMATCH_BATCH_SIZE", "10")),
+    }
+
+
+def _batch_groups(matches, batch_size):
+    by_league = {}
+    for match in matches:
+        by_league.setdefault(match["league"], []).append(match)
+    size = max(batch_size, 1)
+    return [group[i : i + size] for group in by_league.values() for i in range(0, len(group), size)]
+
+
+async def _traced_verify(match, gemini, writer, tz, carry=None):
+    with span("post_match.match", league=match["league"]):
+        await verify_match(match, gemini, writer, tz, carry)
+
+
+async def _traced_batch(matches, gemini, writer, tz):
+    with span("post_match.batch", league=matches[0]["league"], size=len(matches)) as sp:
+        carry = None
+        try:
+            leftovers, carry = await verify_batch(matches, gemini, writer, tz)
+        except (GroundingError, requests.RequestException, ValueError) as exc:
+            sp["attrs"]["error"] = str(exc)[:300]
+            leftovers = matches
+        sp["attrs"]["fallback"] = len(leftovers)
+        if carry is not None:
+            # Kept on the span too, in case the fallback fails and stores no row either
+            sp["attrs"].update({"carried_ms": carry[0], **{k: v for k, v in carry[1].items() if v}})
+    return leftovers, carry
+
+
+async def process_matches(candidates, gemini, supabase, settings, failure_notes=None):
+    """
+    Claim, verify and store the given unresolved matches. Returns (status, failure_notes).
+    Notes are appended to the caller's failure_notes as they happen, so they survive an exception
+    (e.g. TokenBudgetExceeded) that ends the batch early.
+    """
+    status = "ok"
+    failure_notes = [] if failure_notes is None else failure_notes
+    # Take ownership before calling Gemini; matches leased by another run are skipped
+    owner = lease_owner("post_match")
+    claimed = set(
+        await supabase.claim_matches(
+            "post_match", owner, [m["id"] for m in candidates], settings["lease_sec"], settings["max_per_run"]
+        )
+    )
+    matches = [m for m in candidates if m["id"] in claimed]
+    verified = set()
+    # match id -> (duration_ms, usage) of a batch call that stored no row
+    carried = {}
+    writer = None
+
+    async def _settle_batch(group):
+        leftovers, carry = await _traced_batch(group, gemini, writer, settings["tz"])
+        left = {match["id"] for match in leftovers}
+        verified.update(match["id"] for match in group if match["id"] not in left)
+        if carry is not None and leftovers:
+            carried[leftovers[0]["id"]] = carry
+        return leftovers
+
+    try:
+        async with supabase.batch() as writer:
+            # One grounded call per league group; only items the batch could not settle are
+            # verified one by one. Calls overlap, bounded by the Gemini facade's executor.
+            groups = _batch_groups(matches, settings["batch_size"])
+            leftovers = await asyncio.gather(*(_settle_batch(group) for group in groups if len(group) > 1))
+            singles = [group[0] for group in groups if len(group) == 1]
+            singles.extend(match for group in leftovers for match in group)
+            outcomes = await asyncio.gather(
+                *(_traced_verify(match, gemini, writer, settings["tz"], carried.get(match["id"])) for match in singles),
+                return_exceptions=True,
+            )
+        unexpected = None
+        for match, outcome in zip(singles, outcomes):
+            if isinstance(outcome, (GroundingError, requests.RequestException, ValueError)):
+                failure_notes.append(f"{_match_label(match)}: שגיאה ({outcome})")
+                status = "partial_fail"
+            elif isinstance(outcome, BaseException):
+                unexpected = unexpected or outcome
+            else:
+                verified.add(match["id"])
+        if unexpected is not None:
+            raise unexpected
+    finally:
+        if writer is not None and writer.failures:
+            failure_notes.extend(writer.failures)
+            status = "partial_fail"
+        # Let the next run retry every match it did not verify right away instead of waiting for
+        # the lease to expire; that includes matches never reached when the batch was cut short
+        # and matches whose rows the writer rejected at flush
+        unfinished = [m["id"] for m in matches if m["id"] not in verified or writer.rejected(_match_label(m))]
+        try:
+            await supabase.release_matches("post_match", owner, unfinished)
+        except requests.RequestException as exc:
+            # The leases then expire on their own
+            failure_notes.append(f"שחרור נעילות נכשל ({exc})")
+    return status, failure_notes
+
+
+async def run(gemini, supabase, settings):
+    run_id = await supabase.log_run("post_match")
+    start_run(run_id)
     status = "ok"
     failure_notes = []
     try:
+        await supabase.run(gemini.client.load_budget, supabase.client, settings["tz"])
         now = datetime.now(timezone.utc)
         cutoff = now - timedelta(minutes=120)
+        lower = now - timedelta(days=settings["lookback_days"])
+        # Served by the partial index idx_matches_unresolved
         params = {
-            "and": f"(kickoff_utc.lte.{cutoff.isoformat()})",
+            "and": f"(kickoff_utc.gte.{lower.isoformat()},kickoff_utc.lte.{cutoff.isoformat()})",
+            "status": "neq.finished",
+            "order": "kickoff_utc.asc",
+            # Read past the per-run cap so an overlapping run can claim the next matches
+            "limit": str(settings["max_per_run"] * 2),
         }
-        matches = supabase.fetch_matches(params)
-        for match in matches:
-            try:
-                existing = supabase._rest("results", params={"match_id": f"eq.{match['id']}"}, method="get") or []
-                if existing:
-                    continue
-                preds = supabase.fetch_predictions(match["id"])
-                predicted_winner = preds[0]["predicted_winner"] if preds else "DRAW"
-                kickoff_raw = match.get("kickoff_utc") or match.get("kickoff_israel")
-                kickoff_dt = datetime.fromisoformat(kickoff_raw.replace("Z", "+00:00"))
-                kickoff_israel = kickoff_dt.astimezone(tz)
-                match_ctx = {
-                    "league": match["league"],
-                    "home_team": match["home_team"],
-                    "away_team": match["away_team"],
-                    "date_israel": kickoff_israel.strftime("%d/%m/%Y"),
-                    "time_israel": kickoff_israel.strftime("%H:%M"),
-                }
-                payload, duration_ms = gemini.verify_match_result(match_ctx, predicted_winner)
-                final_score = payload.get("final_score", {})
-                home_goals = final_score.get("home_goals")
-                away_goals = final_score.get("away_goals")
-                result_text = decide_winner(home_goals, away_goals)
-                is_correct = result_text == predicted_winner
-                result_row = {
-                    "match_id": match["id"],
-                    "verified_at": datetime.now(timezone.utc).isoformat(),
-                    "duration_ms": duration_ms,
-                    "final_home_goals": home_goals,
-                    "final_away_goals": away_goals,
-                    "result_text": result_text,
-                    "correct": is_correct,
-                    "json_payload": payload,
-                    "sources": payload.get("sources"),
-                    "data_cutoff_time": datetime.now(timezone.utc).isoformat(),
-                }
-                supabase.insert_result(result_row)
-                supabase.update_match_status(match["id"], "finished")
-            except (GroundingError, requests.RequestException, ValueError) as exc:
-                failure_notes.append(f"משחק {match.get('home_team')} - {match.get('away_team')}: שגיאה ({exc})")
-                status = "partial_fail"
-                continue
+        # Matches that already have a result are filtered out by the query itself
+        candidates = await supabase.fetch_unresolved_matches(params)
+        status, _ = await process_matches(candidates, gemini, supabase, settings, failure_notes)
+    except TokenBudgetExceeded as exc:
+        status = "budget_exceeded"
+        failure_notes.append(f"תקציב טוקנים יומי נוצל ({exc})")
     except Exception as exc:  # noqa: BLE001
         status = "error"
         failure_notes.append(f"שגיאת מערכת: {exc}")
     finally:
+        failure_notes.extend(gemini.client.run_notes())
         notes_text = "; ".join(failure_notes) if failure_notes else None
-        supabase.finish_run(run_id, status, notes_text)
+        await supabase.run(flush, supabase.client, run_id)
+        await supabase.finish_run(run_id, status, notes_text, gemini.client.run_usage(run_id))
+
+
+def main():
+    settings = settings_from_env()
+
+    async def _main():
+        gemini_client = GeminiClient(os.environ["GEMINI_API_KEY"], concurrency=settings["concurrency"])
+        async with AsyncGeminiClient(gemini_client, settings["concurrency"]) as gemini:
+            async with AsyncSupabaseClient(SupabaseClient()) as supabase:
+                await run(gemini, supabase, settings)
+
+    asyncio.run(_main())
 
 
 if __name__ == "__main__":
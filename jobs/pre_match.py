@@ -1,11 +1,15 @@
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 
 import requests
 
-from gemini_client import GeminiClient, GroundingError, MODEL_ID
-from supabase_client import SupabaseClient
+import planner
+import ratings
+from gemini_client import DeadlineExceeded, GeminiClient, GroundingError, MODEL_ID, TokenBudgetExceeded
+from supabase_client import SupabaseClient, lease_owner
+from tracing import flush, in_context, span, start_run
 
 UTC = timezone.utc
 
@@ -49,23 +53,6 @@ def parse_prob(value):
     return x
 
 
-def compute_baseline(match):
-    # Simple baseline: home advantage + placeholder league position effect if available
-    home_rank = match.get("home_rank") or 10
-    away_rank = match.get("away_rank") or 10
-    total = home_rank + away_rank
-    home_strength = (away_rank / total) + 0.1
-    away_strength = (home_rank / total)
-    draw = 0.2
-    norm = home_strength + away_strength + draw
-    return {
-        "method": "simple_table_home_adv",
-        "prob_home": round(home_strength / norm, 3),
-        "prob_draw": round(draw / norm, 3),
-        "prob_away": round(away_strength / norm, 3),
-    }
-
-
 def _parse_kickoff_any(match: dict) -> datetime:
     kickoff_raw = match.get("kickoff_utc") or match.get("kickoff_israel")
     if not kickoff_raw:
@@ -74,99 +61,263 @@ def _parse_kickoff_any(match: dict) -> datetime:
     return datetime.fromisoformat(str(kickoff_raw).replace("Z", "+00:00")).astimezone(UTC)
 
 
-def main():
-    tz = ZoneInfo(os.getenv("APP_TZ", "Asia/Jerusalem"))
+def _match_label(match: dict) -> str:
+    return f"משחק {match.get('home_team','?')} - {match.get('away_team','?')}"
+
+
+def predict_match(match, gemini, writer, tz, deadline_min, snapshot=None, baseline=None):
+    kickoff_dt_utc = _parse_kickoff_any(match)
+    kickoff_israel = kickoff_dt_utc.astimezone(tz)
+    # The prediction is worthless once the match is about to start
+    deadline = (kickoff_dt_utc - timedelta(minutes=deadline_min)).timestamp()
+
+    match_ctx = {
+        "league": match["league"],
+        "home_team": match["home_team"],
+        "away_team": match["away_team"],
+        "date_israel": kickoff_israel.strftime("%d/%m/%Y"),
+        "time_israel": kickoff_israel.strftime("%H:%M"),
+        "venue": match.get("venue"),
+    }
+
+    if snapshot is not None:
+        # Research was done earlier (jobs/research.py); only lineups and late news are searched now
+        payload, duration_ms, usage = gemini.generate_pre_match_update(
+            match_ctx, snapshot["json_payload"], snapshot["created_at"], deadline=deadline
+        )
+    else:
+        payload, duration_ms, usage = gemini.generate_pre_match_prediction(match_ctx, deadline=deadline)
+
+    mp = payload.get("match_prediction") or {}
+    probs = (mp.get("win_probability") or {})
+
+    pred_row = {
+        "match_id": match["id"],
+        "duration_ms": int(duration_ms) if duration_ms is not None else None,
+        "model_name": MODEL_ID,
+        "predicted_winner": mp.get("estimated_winner"),
+        "prob_home": parse_prob(probs.get("home")),
+        "prob_draw": parse_prob(probs.get("draw")),
+        "prob_away": parse_prob(probs.get("away")),
+        "recommended_focus": mp.get("recommended_bet_focus"),
+        "json_payload": payload,
+        "sources": payload.get("sources"),
+        "data_cutoff_time": datetime.now(UTC).replace(microsecond=0).isoformat(),
+        "prompt_version": gemini.prompt_version,
+        "research_at": snapshot["created_at"] if snapshot is not None else None,
+        **usage,
+    }
+
+    label = _match_label(match)
+    writer.insert("predictions", pred_row, label)
+
+    if baseline is not None:
+        writer.upsert("baselines", baseline, "match_id", label)
+
+
+def settings_from_env():
+    return {
+        "tz": ZoneInfo(os.getenv("APP_TZ", "Asia/Jerusalem")),
+        # Window tuning (defaults widened so you don't miss matches between runs)
+        "start_min": int(os.getenv("PREMATCH_START_MIN", "45")),   # minutes from now
+        "end_min": int(os.getenv("PREMATCH_END_MIN", "120")),      # minutes from now
+        "max_per_run": int(os.getenv("PREMATCH_MAX_PER_RUN", "10")),
+        # Matches are predicted concurrently; 1 restores the old sequential behaviour
+        "workers": int(os.getenv("PREMATCH_WORKERS", "5")),
+        # A prediction must be finished this many minutes before kickoff
+        "deadline_min": int(os.getenv("PREMATCH_DEADLINE_MIN", "15")),
+        # Must outlast the slowest prediction (3 attempts x 90s) so a live run keeps its matches
+        "lease_sec": int(os.getenv("PREMATCH_LEASE_SEC", "900")),
+        # Plan start times over the next hours instead of taking the fixed START/END window
+        "planner": os.getenv("PREMATCH_PLANNER", "1") == "1",
+        "horizon_min": int(os.getenv("PREMATCH_PLAN_HORIZON_MIN", "360")),
+        # Time until the next run can be relied on; above the cron period to absorb scheduling delays
+        "interval_min": int(os.getenv("PREMATCH_RUN_INTERVAL_MIN", "15")),
+        # Research snapshots older than this are ignored and the match gets a single-stage prediction
+        "research_max_age_hours": int(os.getenv("PREMATCH_RESEARCH_MAX_AGE_HOURS", "48")),
+    }
+
+
+def fresh_snapshots(supabase, match_ids, max_age_hours):
+    """Research snapshots of the given matches that are recent enough to build on."""
+    oldest = datetime.now(UTC) - timedelta(hours=max_age_hours)
+    snapshots = supabase.fetch_research_snapshots(match_ids)
+    return {
+        match_id: row
+        for match_id, row in snapshots.items()
+        if row.get("json_payload")
+        and datetime.fromisoformat(str(row["created_at"]).replace("Z", "+00:00")) >= oldest
+    }
 
-    # Window tuning (defaults widened so you don't miss matches between runs)
-    start_min = int(os.getenv("PREMATCH_START_MIN", "45"))   # minutes from now
-    end_min = int(os.getenv("PREMATCH_END_MIN", "120"))      # minutes from now
-    max_per_run = int(os.getenv("PREMATCH_MAX_PER_RUN", "5"))
 
-    gemini = GeminiClient(os.environ["GEMINI_API_KEY"])
+def plan_candidates(supabase, settings, now):
+    """Upcoming unpredicted matches that must start before the next run. Returns (candidates, notes)."""
+    lower = now + timedelta(minutes=settings["deadline_min"])
+    upper = now + timedelta(minutes=settings["horizon_min"])
+    upcoming = supabase.fetch_unpredicted_matches(
+        {
+            "and": f"(kickoff_utc.gte.{_iso_z(lower)},kickoff_utc.lte.{_iso_z(upper)})",
+            "status": "eq.scheduled",
+            "order": "kickoff_utc.asc",
+        }
+    )
+    latency = planner.latency_estimate(supabase.fetch_prediction_durations())
+    due, unfit = planner.plan(
+        upcoming,
+        lambda m: _parse_kickoff_any(m).timestamp(),
+        now.timestamp(),
+        latency,
+        settings["workers"],
+        target_before_sec=settings["start_min"] * 60,
+        deadline_before_sec=settings["deadline_min"] * 60,
+        lookahead_sec=settings["interval_min"] * 60,
+    )
+    notes = [f"planner:due={len(due)},upcoming={len(upcoming)},latency={latency:.0f}s"]
+    notes.extend(f"{_match_label(m)}: לא ניתן לשבץ לפני המועד האחרון" for m in unfit)
+    return due, notes
+
+
+def process_matches(candidates, gemini, supabase, settings, failure_notes=None):
+    """
+    Claim, predict and store the given unpredicted matches. Returns (status, failure_notes).
+    Notes are appended to the caller's failure_notes as they happen, so they survive an exception
+    (e.g. TokenBudgetExceeded) that ends the batch early.
+    """
+    status = "ok"
+    failure_notes = [] if failure_notes is None else failure_notes
+
+    # Take ownership before calling Gemini; matches leased by another run are skipped
+    owner = lease_owner("pre_match")
+    claimed = set(
+        supabase.claim_matches(
+            "pre_match", owner, [m["id"] for m in candidates], settings["lease_sec"], settings["max_per_run"]
+        )
+    )
+    pending = [m for m in candidates if m["id"] in claimed]
+    if not pending:
+        failure_notes.append(f"all_matches_leased:{len(candidates)}")
+        return status, failure_notes
+
+    predicted = set()
+    writer = None
+    try:
+        # Both reads only enrich the predictions, so a failure must not abort a run that holds leases
+        snapshots = {}
+        if settings["research_max_age_hours"] > 0:
+            try:
+                snapshots = fresh_snapshots(supabase, [m["id"] for m in pending], settings["research_max_age_hours"])
+            except requests.RequestException as exc:
+                failure_notes.append(f"מחקר מוקדם לא נטען, חיזוי בשלב אחד ({exc})")
+        # Rating baselines for the whole batch at once; no Gemini call involved
+        baselines = {}
+        with span("pre_match.baselines", size=len(pending)):
+            try:
+                baselines = ratings.baselines(pending, supabase.fetch_team_ratings(pending))
+            except requests.RequestException as exc:
+                # Without the ratings every team would look equal; store no baseline instead
+                failure_notes.append(f"דירוגי קבוצות לא נטענו, ללא baseline ({exc})")
+
+        def _predict(match, writer):
+            snapshot = snapshots.get(match["id"])
+            with span("pre_match.match", league=match["league"], two_stage=snapshot is not None):
+                baseline = baselines.get(match["id"])
+                predict_match(match, gemini, writer, settings["tz"], settings["deadline_min"], snapshot, baseline)
+
+        # Rows are buffered and written in bulk; the writer reports rows that were rejected
+        with supabase.batch() as writer:
+            with ThreadPoolExecutor(max_workers=max(1, min(settings["workers"], len(pending)))) as pool:
+                futures = {pool.submit(in_context(_predict), match, writer): match for match in pending}
+                for future in as_completed(futures):
+                    match = futures[future]
+                    try:
+                        future.result()
+                        predicted.add(match["id"])
+                    except (
+                        GroundingError,
+                        DeadlineExceeded,
+                        requests.RequestException,
+                        ValueError,
+                        KeyError,
+                        TypeError,
+                    ) as exc:
+                        failure_notes.append(f"{_match_label(match)}: שגיאה ({exc})")
+                        status = "partial_fail"
+    finally:
+        if writer is not None and writer.failures:
+            failure_notes.extend(writer.failures)
+            status = "partial_fail"
+        # Let the next run retry every match it did not predict right away instead of waiting for
+        # the lease to expire; that includes matches never reached when the batch was cut short
+        # and matches whose rows the writer rejected at flush
+        unfinished = [m["id"] for m in pending if m["id"] not in predicted or writer.rejected(_match_label(m))]
+        try:
+            supabase.release_matches("pre_match", owner, unfinished)
+        except requests.RequestException as exc:
+            # The leases then expire on their own
+            failure_notes.append(f"שחרור נעילות נכשל ({exc})")
+    return status, failure_notes
+
+
+def main():
+    settings = settings_from_env()
+    start_min = settings["start_min"]
+    end_min = settings["end_min"]
+
+    gemini = GeminiClient(os.environ["GEMINI_API_KEY"], concurrency=settings["workers"])
     supabase = SupabaseClient()
 
     run_id = supabase.log_run("pre_match")
+    start_run(run_id)
     status = "ok"
     failure_notes = []
 
     try:
+        if gemini.hedge is not None:
+            # A cron run is too short to learn the latency distribution by itself
+            gemini.hedge.seed(supabase.fetch_span_durations("gemini.call"))
+        gemini.load_budget(supabase, settings["tz"])
         now = datetime.now(UTC)
 
-        start = now + timedelta(minutes=start_min)
-        end = now + timedelta(minutes=end_min)
-
-        params = {
-            "and": f"(kickoff_utc.gte.{_iso_z(start)},kickoff_utc.lte.{_iso_z(end)})",
-            "status": "eq.scheduled",
-            "order": "kickoff_utc.asc",
-            "limit": str(max_per_run),
-        }
-
-        matches = supabase.fetch_matches(params)
-        if not matches:
-            # Not an error; just no games in the window.
-            supabase.finish_run(run_id, "ok", f"no_matches_in_window:{start_min}-{end_min}min")
+        if settings["planner"]:
+            candidates, plan_notes = plan_candidates(supabase, settings, now)
+            failure_notes.extend(plan_notes)
+            # The planner already sized the batch to what has to start now
+            settings["max_per_run"] = max(settings["max_per_run"], len(candidates))
+        else:
+            start = now + timedelta(minutes=start_min)
+            end = now + timedelta(minutes=end_min)
+
+            params = {
+                "and": f"(kickoff_utc.gte.{_iso_z(start)},kickoff_utc.lte.{_iso_z(end)})",
+                "status": "eq.scheduled",
+                "order": "kickoff_utc.asc",
+                # Read past the per-run cap so an overlapping run can claim the next matches
+                "limit": str(settings["max_per_run"] * 2),
+            }
+
+            # Already-predicted matches are filtered out by the query itself
+            candidates = supabase.fetch_unpredicted_matches(params)
+        if not candidates:
+            # Not an error; just no games due. The run is closed in `finally`.
+            if not settings["planner"]:
+                failure_notes.append(f"no_matches_in_window:{start_min}-{end_min}min")
             return
 
-        for match in matches:
-            try:
-                # Skip if prediction already exists for this match
-                existing = supabase.fetch_predictions(match["id"])
-                if existing:
-                    continue
-
-                kickoff_dt_utc = _parse_kickoff_any(match)
-                kickoff_israel = kickoff_dt_utc.astimezone(tz)
-
-                match_ctx = {
-                    "league": match["league"],
-                    "home_team": match["home_team"],
-                    "away_team": match["away_team"],
-                    "date_israel": kickoff_israel.strftime("%d/%m/%Y"),
-                    "time_israel": kickoff_israel.strftime("%H:%M"),
-                    "venue": match.get("venue"),
-                }
-
-                payload, duration_ms = gemini.generate_pre_match_prediction(match_ctx)
-
-                mp = payload.get("match_prediction") or {}
-                probs = (mp.get("win_probability") or {})
-
-                pred_row = {
-                    "match_id": match["id"],
-                    "duration_ms": int(duration_ms) if duration_ms is not None else None,
-                    "model_name": MODEL_ID,
-                    "predicted_winner": mp.get("estimated_winner"),
-                    "prob_home": parse_prob(probs.get("home")),
-                    "prob_draw": parse_prob(probs.get("draw")),
-                    "prob_away": parse_prob(probs.get("away")),
-                    "recommended_focus": mp.get("recommended_bet_focus"),
-                    "json_payload": payload,
-                    "sources": payload.get("sources"),
-                    "data_cutoff_time": datetime.now(UTC).replace(microsecond=0).isoformat(),
-                    "prompt_version": "v1",
-                }
-
-                supabase.insert_prediction(pred_row)
-
-                baseline = compute_baseline(match)
-                baseline["match_id"] = match["id"]
-                supabase.upsert_baseline(baseline)
-
-            except (GroundingError, requests.RequestException, ValueError, KeyError, TypeError) as exc:
-                failure_notes.append(
-                    f"משחק {match.get('home_team','?')} - {match.get('away_team','?')}: שגיאה ({exc})"
-                )
-                status = "partial_fail"
-                continue
+        status, _ = process_matches(candidates, gemini, supabase, settings, failure_notes)
+
+    except TokenBudgetExceeded as exc:
+        status = "budget_exceeded"
+        failure_notes.append(f"תקציב טוקנים יומי נוצל ({exc})")
 
     except Exception as exc:  # noqa: BLE001
         status = "error"
         failure_notes.append(f"שגיאת מערכת: {exc}")
 
     finally:
+        failure_notes.extend(gemini.run_notes())
         notes_text = "; ".join(failure_notes) if failure_notes else None
-        supabase.finish_run(run_id, status, notes_text)
+        flush(supabase, run_id)
+        supabase.finish_run(run_id, status, notes_text, gemini.run_usage(run_id))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,189 @@
+import os
+import random
+import sqlite3
+import time
+from contextlib import closing
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional
+
+import requests
+
+from tracing import span
+
+# Client-side protection for an upstream API, shared by every process on the host through one
+# sqlite file: a token bucket per quota (requests/min, tokens/min), retries on 429/5xx that honour
+# Retry-After, and a circuit breaker that fails fast while the upstream keeps erroring.
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Statuses that mean the request was turned away before doing anything; safe to repeat for any method
+REJECTED_STATUSES = {429, 503}
+DEFAULT_DB = os.path.join(".cache", "rate_limits.sqlite")
+BACKOFF_BASE_SEC = 1.0
+BACKOFF_CAP_SEC = 30.0
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class _Store:
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("create table if not exists buckets (name text primary key, tokens real, updated real)")
+            conn.execute(
+                "create table if not exists breakers (name text primary key, failures integer, open_until real)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode; writers take the lock explicitly with BEGIN IMMEDIATE
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def take(self, name: str, per_min: float, cost: float) -> float:
+        """Takes `cost` tokens from the bucket if they are there. Returns 0, or the seconds to wait."""
+        capacity = per_min
+        cost = min(cost, capacity)
+        with closing(self._connect()) as conn:
+            conn.execute("begin immediate")
+            row = conn.execute("select tokens, updated from buckets where name = ?", (name,)).fetchone()
+            now = time.time()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * per_min / 60)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) * 60 / per_min
+            conn.execute("insert or replace into buckets values (?, ?, ?)", (name, tokens, now))
+            conn.execute("commit")
+        return wait
+
+    def open_until(self, name: str) -> float:
+        with closing(self._connect()) as conn:
+            row = conn.execute("select open_until from breakers where name = ?", (name,)).fetchone()
+        return row[0] if row else 0.0
+
+    def record(self, name: str, ok: bool, threshold: int, cooldown_sec: float) -> None:
+        with closing(self._connect()) as conn:
+            conn.execute("begin immediate")
+            row = conn.execute("select failures from breakers where name = ?", (name,)).fetchone()
+            failures = 0 if ok else (row[0] if row else 0) + 1
+            open_until = time.time() + cooldown_sec if failures >= threshold else 0.0
+            conn.execute("insert or replace into breakers values (?, ?, ?)", (name, failures, open_until))
+            conn.execute("commit")
+
+
+class UpstreamGuard:
+    def __init__(
+        self,
+        name: str,
+        store: _Store,
+        rpm: float = 0,
+        tpm: float = 0,
+        max_retries: int = 3,
+        breaker_threshold: int = 5,
+        breaker_cooldown_sec: float = 60,
+    ):
+        self.name = name
+        self.store = store
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown_sec = breaker_cooldown_sec
+        # Only touch the breaker row on success after a failure was seen by this process
+        self._dirty = True
+
+    def _throttle(self, tokens: int, deadline: float) -> None:
+        for bucket, per_min, cost in ((f"{self.name}:rpm", self.rpm, 1), (f"{self.name}:tpm", self.tpm, tokens)):
+            if per_min <= 0 or cost <= 0:
+                continue
+            wait = self.store.take(bucket, per_min, cost)
+            if not wait:
+                continue
+            with span("upstream.throttle", upstream=self.name, bucket=bucket):
+                while wait:
+                    if time.time() + wait > deadline:
+                        raise requests.Timeout(f"{self.name}: quota wait exceeds the call's time budget")
+                    time.sleep(wait)
+                    wait = self.store.take(bucket, per_min, cost)
+
+    def _record(self, ok: bool) -> None:
+        if ok and not self._dirty:
+            return
+        self.store.record(self.name, ok, self.breaker_threshold, self.breaker_cooldown_sec)
+        self._dirty = not ok
+
+    @staticmethod
+    def _retry_after(resp: requests.Response) -> Optional[float]:
+        value = resp.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def send(
+        self, fn: Callable[[float], requests.Response], timeout: float, tokens: int = 0, idempotent: bool = True
+    ) -> requests.Response:
+        """
+        Calls fn(remaining_timeout) under the quotas, retrying 429/5xx and connection errors with
+        jittered exponential backoff (or Retry-After) while the time budget allows. The last
+        response is returned as is, so callers keep using raise_for_status(). Non-idempotent
+        requests are only repeated when they cannot have reached the upstream's logic.
+        """
+        retry_statuses = RETRY_STATUSES if idempotent else REJECTED_STATUSES
+        retry_errors = (requests.ConnectionError, requests.Timeout) if idempotent else (requests.ConnectTimeout,)
+        deadline = time.time() + timeout
+        attempt = 0
+        while True:
+            open_until = self.store.open_until(self.name)
+            if open_until > time.time():
+                raise CircuitOpenError(f"{self.name}: circuit open for {open_until - time.time():.0f}s")
+            self._throttle(tokens, deadline)
+            error: Optional[Exception] = None
+            try:
+                resp = fn(max(1.0, deadline - time.time()))
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                self._record(False)
+                if not isinstance(exc, retry_errors):
+                    raise
+                error = exc
+            else:
+                if resp.status_code not in retry_statuses:
+                    self._record(resp.status_code not in RETRY_STATUSES)
+                    return resp
+                self._record(False)
+            wait = random.uniform(0, min(BACKOFF_CAP_SEC, BACKOFF_BASE_SEC * 2**attempt))
+            if error is None:
+                wait = max(wait, self._retry_after(resp) or 0.0)
+            if attempt >= self.max_retries or time.time() + wait >= deadline:
+                if error is not None:
+                    raise error
+                return resp
+            if error is None:
+                resp.close()
+            attempt += 1
+            with span("upstream.backoff", upstream=self.name, attempt=attempt) as sp:
+                sp["attrs"]["reason"] = type(error).__name__ if error else str(resp.status_code)
+                time.sleep(wait)
+
+
+def guard_from_env(name: str, prefix: str) -> UpstreamGuard:
+    """Reads <prefix>_RPM, <prefix>_TPM (0 = unlimited), <prefix>_MAX_RETRIES and the breaker settings."""
+    return UpstreamGuard(
+        name,
+        _Store(os.getenv("RATE_LIMIT_DB", DEFAULT_DB)),
+        rpm=float(os.getenv(f"{prefix}_RPM", "0")),
+        tpm=float(os.getenv(f"{prefix}_TPM", "0")),
+        max_retries=int(os.getenv(f"{prefix}_MAX_RETRIES", "3")),
+        breaker_threshold=int(os.getenv(f"{prefix}_BREAKER_THRESHOLD", "5")),
+        breaker_cooldown_sec=float(os.getenv(f"{prefix}_BREAKER_COOLDOWN_SEC", "60")),
+    )
@@ -0,0 +1,68 @@
+from math import factorial
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+# Baseline probabilities from team ratings. The ratings themselves live in team_ratings and are
+# updated by a trigger on results (apply_team_rating in db/schema.sql), one Elo step per finished
+# match. Here the rating gap of each fixture, home advantage included, sets the expected goals of
+# both sides, and independent Poisson scores give P(home), P(draw), P(away) for a whole batch of
+# fixtures in one array computation.
+
+DEFAULT_RATING = 1500.0
+# Same as in apply_team_rating
+HOME_ADVANTAGE = 60.0
+# Goals per team in an even match, and how strongly 400 rating points tilt them (about 3.3:1)
+GOALS_AVG = 1.35
+GOALS_PER_400 = 0.6
+MAX_GOALS = 10
+METHOD = "elo_poisson"
+
+_GOALS = np.arange(MAX_GOALS + 1)
+_LOG_FACTORIAL = np.log([float(factorial(k)) for k in range(MAX_GOALS + 1)])
+
+
+def expected_goals(home_ratings: np.ndarray, away_ratings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    gap = (home_ratings + HOME_ADVANTAGE - away_ratings) / 400
+    return GOALS_AVG * np.exp(GOALS_PER_400 * gap), GOALS_AVG * np.exp(-GOALS_PER_400 * gap)
+
+
+def _poisson(lam: np.ndarray) -> np.ndarray:
+    """(n, MAX_GOALS + 1) probabilities of 0..MAX_GOALS goals."""
+    return np.exp(_GOALS * np.log(lam)[:, None] - lam[:, None] - _LOG_FACTORIAL)
+
+
+def outcome_probabilities(home_ratings: np.ndarray, away_ratings: np.ndarray) -> np.ndarray:
+    """(n, 3) home/draw/away probabilities, renormalized over the truncated score grid."""
+    lam_home, lam_away = expected_goals(home_ratings, away_ratings)
+    scores = _poisson(lam_home)[:, :, None] * _poisson(lam_away)[:, None, :]
+    home = np.tril(scores, -1).sum(axis=(1, 2))
+    draw = np.trace(scores, axis1=1, axis2=2)
+    away = np.triu(scores, 1).sum(axis=(1, 2))
+    probs = np.stack([home, draw, away], axis=1)
+    return probs / probs.sum(axis=1, keepdims=True)
+
+
+def baselines(
+    matches: List[Dict[str, Any]], ratings: Dict[Tuple[str, str], float]
+) -> Dict[str, Dict[str, Any]]:
+    """Baseline row per match id; teams without a rating yet start at DEFAULT_RATING."""
+    if not matches:
+        return {}
+
+    def rating(match: Dict[str, Any], side: str) -> float:
+        return ratings.get((match["league"], match[side]), DEFAULT_RATING)
+
+    home = np.array([rating(m, "home_team") for m in matches], dtype=float)
+    away = np.array([rating(m, "away_team") for m in matches], dtype=float)
+    probs = outcome_probabilities(home, away)
+    return {
+        match["id"]: {
+            "match_id": match["id"],
+            "method": METHOD,
+            "prob_home": round(float(p[0]), 3),
+            "prob_draw": round(float(p[1]), 3),
+            "prob_away": round(float(p[2]), 3),
+        }
+        for match, p in zip(matches, probs)
+    }
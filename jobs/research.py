@@ -0,0 +1,173 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import requests
+
+from gemini_client import DeadlineExceeded, GeminiClient, GroundingError, MODEL_ID, TokenBudgetExceeded
+from supabase_client import SupabaseClient, lease_owner
+from tracing import flush, in_context, span, start_run
+
+# First stage of the prediction pipeline. Standings, form, known absences and head-to-head
+# barely move on match day, so they are researched off-peak and stored in research_snapshots.
+# pre_match then only asks for lineups and late news on top of the snapshot.
+
+UTC = timezone.utc
+
+
+def _iso_z(dt: datetime) -> str:
+    dt = dt.astimezone(UTC).replace(microsecond=0)
+    return dt.isoformat().replace("+00:00", "Z")
+
+
+def _match_label(match):
+    return f"משחק {match.get('home_team','?')} - {match.get('away_team','?')}"
+
+
+def _match_context(match, tz):
+    kickoff_dt = datetime.fromisoformat(str(match["kickoff_utc"]).replace("Z", "+00:00"))
+    kickoff_israel = kickoff_dt.astimezone(tz)
+    return {
+        "league": match["league"],
+        "home_team": match["home_team"],
+        "away_team": match["away_team"],
+        "date_israel": kickoff_israel.strftime("%d/%m/%Y"),
+        "time_israel": kickoff_israel.strftime("%H:%M"),
+        "venue": match.get("venue"),
+    }
+
+
+def settings_from_env():
+    return {
+        "tz": ZoneInfo(os.getenv("APP_TZ", "Asia/Jerusalem")),
+        # Matches kicking off sooner are left to a single-stage prediction
+        "min_lead_min": int(os.getenv("RESEARCH_MIN_LEAD_MIN", "180")),
+        "horizon_hours": int(os.getenv("RESEARCH_HORIZON_HOURS", "36")),
+        "max_per_run": int(os.getenv("RESEARCH_MAX_PER_RUN", "40")),
+        "workers": int(os.getenv("RESEARCH_WORKERS", "3")),
+        "lease_sec": int(os.getenv("RESEARCH_LEASE_SEC", "900")),
+    }
+
+
+def research_match(match, gemini, writer, tz):
+    payload, duration_ms, usage = gemini.generate_research(_match_context(match, tz))
+    row = {
+        "match_id": match["id"],
+        "created_at": datetime.now(UTC).replace(microsecond=0).isoformat(),
+        "model_name": MODEL_ID,
+        "prompt_version": gemini.prompt_version,
+        "duration_ms": int(duration_ms) if duration_ms is not None else None,
+        "json_payload": payload,
+        "sources": payload.get("sources"),
+        **usage,
+    }
+    writer.upsert("research_snapshots", row, "match_id", _match_label(match))
+
+
+def process_matches(candidates, gemini, supabase, settings, failure_notes=None):
+    """
+    Claim, research and store the given matches. Returns (status, failure_notes).
+    Notes are appended to the caller's failure_notes as they happen, so they survive an exception
+    (e.g. TokenBudgetExceeded) that ends the batch early.
+    """
+    status = "ok"
+    failure_notes = [] if failure_notes is None else failure_notes
+
+    owner = lease_owner("research")
+    claimed = set(
+        supabase.claim_matches(
+            "research", owner, [m["id"] for m in candidates], settings["lease_sec"], settings["max_per_run"]
+        )
+    )
+    pending = [m for m in candidates if m["id"] in claimed]
+    if not pending:
+        failure_notes.append(f"all_matches_leased:{len(candidates)}")
+        return status, failure_notes
+
+    def _research(match, writer):
+        with span("research.match", league=match["league"]):
+            research_match(match, gemini, writer, settings["tz"])
+
+    researched = set()
+    writer = None
+    try:
+        with supabase.batch() as writer:
+            with ThreadPoolExecutor(max_workers=max(1, min(settings["workers"], len(pending)))) as pool:
+                futures = {pool.submit(in_context(_research), match, writer): match for match in pending}
+                for future in as_completed(futures):
+                    match = futures[future]
+                    try:
+                        future.result()
+                        researched.add(match["id"])
+                    except (
+                        GroundingError,
+                        DeadlineExceeded,
+                        requests.RequestException,
+                        ValueError,
+                        KeyError,
+                        TypeError,
+                    ) as exc:
+                        failure_notes.append(f"{_match_label(match)}: שגיאה במחקר מוקדם ({exc})")
+                        status = "partial_fail"
+    finally:
+        if writer is not None and writer.failures:
+            failure_notes.extend(writer.failures)
+            status = "partial_fail"
+        # Every match that was not researched is released, including those never reached when
+        # the batch was cut short and those whose snapshot the writer rejected at flush
+        unfinished = [m["id"] for m in pending if m["id"] not in researched or writer.rejected(_match_label(m))]
+        try:
+            supabase.release_matches("research", owner, unfinished)
+        except requests.RequestException as exc:
+            # The leases then expire on their own
+            failure_notes.append(f"שחרור נעילות נכשל ({exc})")
+    return status, failure_notes
+
+
+def main():
+    settings = settings_from_env()
+    gemini = GeminiClient(os.environ["GEMINI_API_KEY"], concurrency=settings["workers"])
+    supabase = SupabaseClient()
+
+    run_id = supabase.log_run("research")
+    start_run(run_id)
+    status = "ok"
+    failure_notes = []
+
+    try:
+        gemini.load_budget(supabase, settings["tz"])
+        now = datetime.now(UTC)
+        lower = now + timedelta(minutes=settings["min_lead_min"])
+        upper = now + timedelta(hours=settings["horizon_hours"])
+        candidates = supabase.fetch_unresearched_matches(
+            {
+                "and": f"(kickoff_utc.gte.{_iso_z(lower)},kickoff_utc.lte.{_iso_z(upper)})",
+                "status": "eq.scheduled",
+                "order": "kickoff_utc.asc",
+                "limit": str(settings["max_per_run"] * 2),
+            }
+        )
+        if not candidates:
+            failure_notes.append(f"no_matches_to_research:{settings['horizon_hours']}h")
+            return
+
+        status, _ = process_matches(candidates, gemini, supabase, settings, failure_notes)
+
+    except TokenBudgetExceeded as exc:
+        status = "budget_exceeded"
+        failure_notes.append(f"תקציב טוקנים יומי נוצל ({exc})")
+
+    except Exception as exc:  # noqa: BLE001
+        status = "error"
+        failure_notes.append(f"שגיאת מערכת: {exc}")
+
+    finally:
+        failure_notes.extend(gemini.run_notes())
+        notes_text = "; ".join(failure_notes) if failure_notes else None
+        flush(supabase, run_id)
+        supabase.finish_run(run_id, status, notes_text, gemini.run_usage(run_id))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+from typing import Any, Dict
+
+# Response schemas for Gemini structured output (OpenAPI subset used by generationConfig.responseSchema).
+# The local validators in gemini_client read their required keys from here, so the
+# prompt contract and the checks cannot drift apart.
+
+_STR = {"type": "STRING"}
+_URLS = {"type": "ARRAY", "items": {"type": "STRING"}, "description": "URLs אמיתיים בלבד"}
+_OUTCOME = {"type": "STRING", "enum": ["HOME", "DRAW", "AWAY"]}
+_ABSENCES = {"type": "ARRAY", "items": _STR, "description": "שם (סיבה)"}
+_PERCENT = {"type": "NUMBER", "description": "אחוזים 0-100; שלושת הערכים מסתכמים ל-100"}
+
+
+def _obj(properties: Dict[str, Any], required=None) -> Dict[str, Any]:
+    return {
+        "type": "OBJECT",
+        "properties": properties,
+        "required": list(properties) if required is None else required,
+    }
+
+
+def _team_news(status: str) -> Dict[str, Any]:
+    return _obj(
+        {
+            "status": {"type": "STRING", "description": status},
+            "current_form": _STR,
+            "missing_players": _ABSENCES,
+            "predicted_lineup": {"type": "ARRAY", "items": _STR},
+            "notes": _STR,
+        }
+    )
+
+
+def _team_update() -> Dict[str, Any]:
+    return _obj({"missing_players": _ABSENCES, "predicted_lineup": {"type": "ARRAY", "items": _STR}, "notes": _STR})
+
+
+PREDICTION_SCHEMA = _obj(
+    {
+        "match_details": _obj(
+            {
+                "fixture": _STR,
+                "date": {"type": "STRING", "description": "DD/MM/YYYY"},
+                "time_israel": {"type": "STRING", "description": "HH:MM"},
+                "venue": _STR,
+                "league_position": _obj({"home": _STR, "away": _STR}),
+            }
+        ),
+        "team_news": _obj({"home": _team_news("Home Team"), "away": _team_news("Away Team")}),
+        "head_to_head_trends": _obj({"last_meeting": _STR, "trend": _STR, "away_dominance": _STR}),
+        "match_prediction": _obj(
+            {
+                "estimated_winner": _OUTCOME,
+                "win_probability": _obj({"home": _PERCENT, "draw": _PERCENT, "away": _PERCENT}),
+                "reasoning": _STR,
+                "recommended_bet_focus": _STR,
+            }
+        ),
+        "sources": _obj(
+            {
+                "match_details": _URLS,
+                "team_news_home": _URLS,
+                "team_news_away": _URLS,
+                "head_to_head": _URLS,
+                "prediction_context": _URLS,
+            }
+        ),
+    }
+)
+
+# Stage one (jobs/research.py): what changes slowly, researched hours before kickoff
+RESEARCH_SCHEMA = _obj(
+    {
+        "league_position": _obj({"home": _STR, "away": _STR}),
+        "current_form": _obj({"home": _STR, "away": _STR}),
+        "missing_players": _obj({"home": _ABSENCES, "away": _ABSENCES}),
+        "head_to_head_trends": PREDICTION_SCHEMA["properties"]["head_to_head_trends"],
+        "sources": _obj(
+            {"match_details": _URLS, "team_news_home": _URLS, "team_news_away": _URLS, "head_to_head": _URLS}
+        ),
+    }
+)
+
+# Stage two (pre_match near kickoff): what the snapshot cannot know yet, plus the prediction.
+# Merged with the snapshot into a PREDICTION_SCHEMA payload (gemini_client.merge_research).
+PREDICTION_DELTA_SCHEMA = _obj(
+    {
+        "team_news": _obj({"home": _team_update(), "away": _team_update()}),
+        "match_prediction": PREDICTION_SCHEMA["properties"]["match_prediction"],
+        "sources": _obj({"team_news_home": _URLS, "team_news_away": _URLS, "prediction_context": _URLS}),
+    }
+)
+
+RESULT_SCHEMA = _obj(
+    {
+        "match_details": _obj(
+            {
+                "fixture": _STR,
+                "date": {"type": "STRING", "description": "DD/MM/YYYY"},
+                "time_israel": {"type": "STRING", "description": "HH:MM"},
+                "venue": _STR,
+            }
+        ),
+        "final_score": _obj(
+            {
+                "home_goals": {"type": "INTEGER", "nullable": True},
+                "away_goals": {"type": "INTEGER", "nullable": True},
+            }
+        ),
+        "winner_result": _OUTCOME,
+        "comparison": _obj({"predicted_winner": _OUTCOME, "is_correct": {"type": "BOOLEAN"}}),
+        "notes": _STR,
+        "sources": _obj({"result_verification": _URLS}),
+    },
+    required=["match_details", "final_score", "winner_result", "comparison", "sources"],
+)
+
+# One item per requested match; match_ref echoes the number the prompt gave it
+RESULT_BATCH_SCHEMA = {
+    "type": "ARRAY",
+    "items": _obj(
+        {"match_ref": {"type": "STRING", "description": "match_ref מהרשימה"}, **RESULT_SCHEMA["properties"]},
+        required=["match_ref"] + RESULT_SCHEMA["required"],
+    ),
+}
+
+FIXTURE_SCHEMA = _obj(
+    {
+        "league": _STR,
+        "home_team": _STR,
+        "away_team": _STR,
+        "venue": _STR,
+        "kickoff_utc": {"type": "STRING", "description": "YYYY-MM-DDTHH:MM:SSZ"},
+        "source_urls": _URLS,
+    },
+    required=["league", "home_team", "away_team", "kickoff_utc", "source_urls"],
+)
+
+FIXTURES_SCHEMA = {"type": "ARRAY", "items": FIXTURE_SCHEMA}
+
+
+def required_keys(schema: Dict[str, Any]) -> list:
+    return list(schema.get("required") or [])
@@ -1,8 +1,130 @@
+import json
 import os
+import socket
+import threading
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limit import guard_from_env
+from tracing import span
+
+HTTP_POOL_SIZE = 16
+REQUEST_TIMEOUT_SEC = 60
+# Primary key of stats_rollup (db/schema.sql)
+ROLLUP_KEY = ("league", "week", "prompt_version", "model_name")
+
+
+def embedded_one(value: Any) -> Optional[Dict[str, Any]]:
+    """PostgREST embeds to-one relations as an object and to-many as a list; return the first row either way."""
+    if isinstance(value, list):
+        return value[0] if value else None
+    if isinstance(value, dict):
+        return value
+    return None
+
+
+def lease_owner(job_name: str) -> str:
+    """Identifies this process as the holder of work leases."""
+    runner = os.getenv("GITHUB_RUN_ID") or socket.gethostname()
+    return f"{job_name}:{runner}:{os.getpid()}"
+
+
+class BatchWriter:
+    """
+    Write-behind buffer. Rows are grouped per table and operation and sent as one array
+    POST (or one PATCH with id=in.(...)) when max_rows is reached, when the oldest buffered
+    row is older than max_age_sec at the time of the next write, or on flush()/context exit.
+
+    Every row carries a label (e.g. the match name). When a bulk request fails it is split
+    in halves until the failing rows are isolated, and their labels are reported in
+    `failures`. Rows sharing a label form a unit: once one fails, later rows with the same
+    label are dropped, so e.g. a match is not marked finished when its result was rejected.
+    """
+
+    def __init__(self, client: "SupabaseClient", max_rows: int = 50, max_age_sec: float = 5.0):
+        self.client = client
+        self.max_rows = max_rows
+        self.max_age_sec = max_age_sec
+        self.failures: List[str] = []
+        self._buffers: Dict[Tuple, List[Tuple[Any, str]]] = {}
+        self._count = 0
+        self._oldest: Optional[float] = None
+        self._failed_labels = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def __enter__(self) -> "BatchWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.flush()
+
+    def rejected(self, label: str) -> bool:
+        """True once a row with this label failed to write; its unit counts as not stored."""
+        return label in self._failed_labels
+
+    def insert(self, table: str, row: Dict[str, Any], label: str) -> None:
+        self._add(("insert", table, None, tuple(sorted(row))), row, label)
+
+    def upsert(self, table: str, row: Dict[str, Any], on_conflict: str, label: str) -> None:
+        self._add(("upsert", table, on_conflict, tuple(sorted(row))), row, label)
+
+    def patch(self, table: str, values: Dict[str, Any], row_id: str, label: str) -> None:
+        # PATCH applies one body to every matched row, so rows are grouped by identical values
+        self._add(("patch", table, json.dumps(values, sort_keys=True), None), row_id, label)
+
+    def _add(self, key: Tuple, item: Any, label: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._buffers.setdefault(key, []).append((item, label))
+            self._count += 1
+            if self._oldest is None:
+                self._oldest = now
+            due = self._count >= self.max_rows or now - self._oldest >= self.max_age_sec
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        # Buffers are flushed in the order their first row arrived, so an insert is always
+        # sent before a patch that was queued after it.
+        with self._flush_lock:
+            with self._lock:
+                buffers, self._buffers = self._buffers, {}
+                self._count = 0
+                self._oldest = None
+            for key, items in buffers.items():
+                items = [(item, label) for item, label in items if label not in self._failed_labels]
+                if items:
+                    self._send(key, items)
+
+    def _send(self, key: Tuple, items: List[Tuple[Any, str]]) -> None:
+        op, table, extra, _ = key
+        try:
+            if op == "patch":
+                ids = ",".join(str(item) for item, _ in items)
+                self.client._rest(table, params={"id": f"in.({ids})"}, json_body=json.loads(extra), method="patch")
+            elif op == "upsert":
+                self.client._rest(
+                    table,
+                    params={"on_conflict": extra},
+                    json_body=[item for item, _ in items],
+                    method="post",
+                    extra_headers={"Prefer": "resolution=merge-duplicates"},
+                )
+            else:
+                self.client._rest(table, json_body=[item for item, _ in items], method="post")
+        except requests.RequestException as exc:
+            if len(items) > 1:
+                mid = len(items) // 2
+                self._send(key, items[:mid])
+                self._send(key, items[mid:])
+                return
+            label = items[0][1]
+            self._failed_labels.add(label)
+            self.failures.append(f"{label}: שגיאה בכתיבה ל-{table} ({exc})")
 
 
 class SupabaseClient:
@@ -10,6 +132,10 @@ class SupabaseClient:
         self.url = os.environ["SUPABASE_URL"].rstrip("/")
         self.key = os.environ["SUPABASE_SERVICE_ROLE"]
         self.session = requests.Session()
+        # Sized for the job worker pools so concurrent requests reuse keep-alive connections
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE))
+        self.guard = guard_from_env("supabase", "SUPABASE")
         self.headers = {
             "apikey": self.key,
             "Authorization": f"Bearer {self.key}",
@@ -30,9 +156,16 @@ class SupabaseClient:
         if extra_headers:
             headers.update(extra_headers)
 
-        resp = self.session.request(
-            method, url, headers=headers, params=params, json=json_body, timeout=60
-        )
+        with span("supabase.request", table_name=table, method=method) as sp:
+            resp = self.guard.send(
+                lambda remaining: self.session.request(
+                    method, url, headers=headers, params=params, json=json_body, timeout=remaining
+                ),
+                REQUEST_TIMEOUT_SEC,
+                # A repeated insert could store a row twice; other verbs are safe to repeat
+                idempotent=method != "post",
+            )
+            sp["attrs"]["status_code"] = resp.status_code
 
         if not resp.ok:
             # חשוב: לא להדפיס headers/מפתחות. רק status + body.
@@ -44,6 +177,13 @@ class SupabaseClient:
             return resp.json()
         return None
 
+    def batch(self, max_rows: Optional[int] = None, max_age_sec: Optional[float] = None) -> BatchWriter:
+        return BatchWriter(
+            self,
+            max_rows=max_rows or int(os.getenv("SUPABASE_BATCH_ROWS", "50")),
+            max_age_sec=max_age_sec or float(os.getenv("SUPABASE_BATCH_AGE_SEC", "5")),
+        )
+
     def log_run(self, job_name: str) -> str:
         start = time.strftime("%Y-%m-%dT%H:%M:%SZ")
         data = {"job_name": job_name, "started_at": start, "status": "running"}
@@ -61,11 +201,15 @@ class SupabaseClient:
 
         return str(res[0]["id"])
 
-    def finish_run(self, run_id: str, status: str, notes: Optional[str] = None):
+    def finish_run(
+        self, run_id: str, status: str, notes: Optional[str] = None, usage: Optional[Dict[str, int]] = None
+    ):
         finished_at = time.strftime("%Y-%m-%dT%H:%M:%SZ")
         payload = {"finished_at": finished_at, "status": status}
         if notes is not None:
             payload["notes"] = notes
+        if usage:
+            payload.update(usage)
 
         self._rest(
             "runs",
@@ -85,9 +229,106 @@ class SupabaseClient:
             extra_headers={"Prefer": "resolution=merge-duplicates"},
         )
 
+    def insert_matches(self, matches: List[Dict[str, Any]]) -> None:
+        if not matches:
+            return
+        # ignore-duplicates: a row inserted concurrently by another sync is left untouched
+        self._rest(
+            "matches",
+            params={"on_conflict": "league,kickoff_utc,home_team,away_team"},
+            json_body=matches,
+            method="post",
+            extra_headers={"Prefer": "resolution=ignore-duplicates"},
+        )
+
     def fetch_matches(self, params: Dict[str, str]) -> List[Dict[str, Any]]:
         return self._rest("matches", params=params, method="get") or []
 
+    def fetch_unpredicted_matches(self, params: Dict[str, str]) -> List[Dict[str, Any]]:
+        """Matches matching `params` that have no prediction yet, in a single request (anti-join)."""
+        query = {"select": "*,predictions(id)", "predictions": "is.null"}
+        query.update(params)
+        return self._rest("matches", params=query, method="get") or []
+
+    def fetch_unresearched_matches(self, params: Dict[str, str]) -> List[Dict[str, Any]]:
+        """Matches matching `params` with neither a research snapshot nor a prediction (anti-join)."""
+        query = {
+            "select": "*,research_snapshots(match_id),predictions(id)",
+            "research_snapshots": "is.null",
+            "predictions": "is.null",
+        }
+        query.update(params)
+        return self._rest("matches", params=query, method="get") or []
+
+    def fetch_research_snapshots(self, match_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Stored research snapshots by match_id."""
+        if not match_ids:
+            return {}
+        rows = self._rest(
+            "research_snapshots",
+            params={"select": "match_id,json_payload,created_at", "match_id": f"in.({','.join(match_ids)})"},
+            method="get",
+        )
+        return {str(row["match_id"]): row for row in rows or []}
+
+    def fetch_team_ratings(self, matches: List[Dict[str, Any]], chunk: int = 50) -> Dict[Tuple[str, str], float]:
+        """Current rating by (league, team) for the teams of `matches`; unrated teams are absent."""
+        by_league: Dict[str, set] = {}
+        for match in matches:
+            by_league.setdefault(match["league"], set()).update((match["home_team"], match["away_team"]))
+        ratings: Dict[Tuple[str, str], float] = {}
+        for league, teams in by_league.items():
+            teams = sorted(teams)
+            # Names are quoted since they may contain spaces, dots or commas
+            for i in range(0, len(teams), chunk):
+                quoted = ",".join('"' + t.replace("\\", "\\\\").replace('"', '\\"') + '"' for t in teams[i : i + chunk])
+                rows = self._rest(
+                    "team_ratings",
+                    params={"select": "team,rating", "league": f"eq.{league}", "team": f"in.({quoted})"},
+                    method="get",
+                )
+                ratings.update({(league, row["team"]): float(row["rating"]) for row in rows or []})
+        return ratings
+
+    def fetch_unresolved_matches(self, params: Dict[str, str]) -> List[Dict[str, Any]]:
+        """Matches matching `params` that have no result yet, with their prediction embedded."""
+        query = {"select": "*,predictions(predicted_winner),results(match_id)", "results": "is.null"}
+        query.update(params)
+        return self._rest("matches", params=query, method="get") or []
+
+    def claim_matches(
+        self,
+        job_name: str,
+        owner: str,
+        match_ids: List[str],
+        lease_seconds: int,
+        limit: Optional[int] = None,
+    ) -> List[str]:
+        """Atomically lease matches for `job_name`; returns the ids this owner now holds."""
+        if not match_ids:
+            return []
+        res = self._rest(
+            "rpc/claim_matches",
+            json_body={
+                "p_job": job_name,
+                "p_owner": owner,
+                "p_match_ids": match_ids,
+                "p_lease_seconds": lease_seconds,
+                "p_limit": limit,
+            },
+            method="post",
+        )
+        return [str(row["match_id"]) for row in res or []]
+
+    def release_matches(self, job_name: str, owner: str, match_ids: List[str]) -> None:
+        if not match_ids:
+            return
+        self._rest(
+            "rpc/release_matches",
+            json_body={"p_job": job_name, "p_owner": owner, "p_match_ids": match_ids},
+            method="post",
+        )
+
     def insert_prediction(self, payload: Dict[str, Any]) -> None:
         self._rest("predictions", json_body=payload, method="post")
 
@@ -109,5 +350,66 @@ class SupabaseClient:
     def update_match_status(self, match_id: str, status: str):
         self._rest("matches", params={"id": f"eq.{match_id}"}, json_body={"status": status}, method="patch")
 
+    def insert_spans(self, rows: List[Dict[str, Any]]) -> None:
+        if rows:
+            self._rest("run_spans", json_body=rows, method="post")
+
+    def tokens_used_since(self, since: str) -> int:
+        """Gemini tokens recorded on runs started at or after `since` (RPC, see schema.sql)."""
+        return int(self._rest("rpc/tokens_used_since", json_body={"p_since": since}) or 0)
+
+    def fetch_prediction_durations(self, limit: int = 200) -> List[int]:
+        """duration_ms of the most recent predictions, for the pre_match planner's latency estimate."""
+        rows = self._rest(
+            "predictions",
+            params={"select": "duration_ms", "order": "created_at.desc", "limit": str(limit)},
+            method="get",
+        )
+        return [row["duration_ms"] for row in rows or []]
+
+    def fetch_span_durations(self, name: str, limit: int = 200) -> List[float]:
+        """Most recent successful durations of one span name (served by idx_run_spans_name_started)."""
+        rows = self._rest(
+            "run_spans",
+            params={
+                "select": "duration_ms",
+                "name": f"eq.{name}",
+                "status": "eq.ok",
+                "order": "started_at.desc",
+                "limit": str(limit),
+            },
+            method="get",
+        )
+        return [row["duration_ms"] for row in rows or []]
+
     def fetch_results(self, params: Dict[str, str]) -> List[Dict[str, Any]]:
         return self._rest("results", params=params, method="get") or []
+
+    def _fetch_pages(self, table: str, order: str, page_size: int) -> List[Dict[str, Any]]:
+        rows: List[Dict[str, Any]] = []
+        while True:
+            params = {"select": "*", "order": order, "limit": str(page_size), "offset": str(len(rows))}
+            page = self._rest(table, params=params, method="get") or []
+            rows.extend(page)
+            if len(page) < page_size:
+                return rows
+
+    def fetch_stats_rollup(self, page_size: int = 1000) -> List[Dict[str, Any]]:
+        """Running totals per league, week, prompt version and model (maintained by a trigger on results)."""
+        return self._fetch_pages("stats_rollup", ",".join(f"{c}.asc" for c in ROLLUP_KEY), page_size)
+
+    def fetch_stats_calibration(self, page_size: int = 1000) -> List[Dict[str, Any]]:
+        return self._fetch_pages(
+            "stats_rollup_calibration", ",".join(f"{c}.asc" for c in ROLLUP_KEY + ("bin",)), page_size
+        )
+
+    def upsert_evaluation_metrics(self, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        self._rest(
+            "evaluation_metrics",
+            params={"on_conflict": "slice_type,slice_value"},
+            json_body=rows,
+            method="post",
+            extra_headers={"Prefer": "resolution=merge-duplicates"},
+        )
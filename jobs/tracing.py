@@ -0,0 +1,118 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Attributes stored in their own run_spans columns; everything else goes to attrs jsonb
+COLUMN_ATTRS = ("league", "attempt", "table_name")
+FLUSH_CHUNK = 500
+
+_run_id: contextvars.ContextVar = contextvars.ContextVar("trace_run_id", default=None)
+_attrs: contextvars.ContextVar = contextvars.ContextVar("trace_attrs", default={})
+
+
+class Tracer:
+    """
+    Collects timing spans in memory and writes them in bulk to run_spans.
+
+    Spans are only recorded while a run is bound (see bind_run), and nested spans inherit
+    their parent's attributes, so e.g. a Gemini attempt inside a match span carries the league.
+    """
+
+    def __init__(self):
+        self._spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def start_run(self, run_id: str) -> None:
+        """Binds run_id for the rest of the current context (a job's main)."""
+        _run_id.set(run_id)
+
+    @contextmanager
+    def bind_run(self, run_id: str) -> Iterator[None]:
+        token = _run_id.set(run_id)
+        try:
+            yield
+        finally:
+            _run_id.reset(token)
+
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+        """Times the block; the yielded dict's "attrs" can be extended from inside it."""
+        run_id = _run_id.get()
+        merged = {**_attrs.get(), **attrs}
+        token = _attrs.set(merged)
+        record = {
+            "run_id": run_id,
+            "name": name,
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "status": "ok",
+            "attrs": dict(merged),
+        }
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException as exc:
+            record["status"] = "error"
+            record["attrs"]["error"] = f"{type(exc).__name__}: {exc}"[:300]
+            raise
+        finally:
+            _attrs.reset(token)
+            record["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            if run_id is not None:
+                with self._lock:
+                    self._spans.append(record)
+
+    def _drain(self, run_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            mine = [s for s in self._spans if s["run_id"] == run_id]
+            self._spans = [s for s in self._spans if s["run_id"] != run_id]
+        return mine
+
+    def flush(self, supabase, run_id: str) -> None:
+        """Writes the run's spans to run_spans. Never raises: tracing must not fail a job."""
+        rows = []
+        for record in self._drain(run_id):
+            attrs = dict(record["attrs"])
+            row = {
+                "run_id": run_id,
+                "name": record["name"],
+                "started_at": record["started_at"],
+                "duration_ms": record["duration_ms"],
+                "status": record["status"],
+            }
+            for column in COLUMN_ATTRS:
+                row[column] = attrs.pop(column, None)
+            row["attrs"] = attrs or None
+            rows.append(row)
+        # The inserts below are not traced themselves (no run bound in this context)
+        ctx = contextvars.Context()
+        try:
+            for i in range(0, len(rows), FLUSH_CHUNK):
+                ctx.run(supabase.insert_spans, rows[i : i + FLUSH_CHUNK])
+        except Exception as exc:  # noqa: BLE001
+            print(f"Failed to write run_spans: {exc}")
+
+
+def current_run() -> Optional[str]:
+    """The run bound in the current context, if any."""
+    return _run_id.get()
+
+
+TRACER = Tracer()
+span = TRACER.span
+bind_run = TRACER.bind_run
+start_run = TRACER.start_run
+flush = TRACER.flush
+
+
+def in_context(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Wraps fn so it runs with the caller's tracing context, e.g. when submitted to a thread pool."""
+    ctx = contextvars.copy_context()
+
+    def _run(*args, **kwargs):
+        return ctx.copy().run(fn, *args, **kwargs)
+
+    return _run
+
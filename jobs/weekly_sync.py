@@ -1,11 +1,13 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 
 import requests
 
-from gemini_client import GeminiClient, GroundingError
+from gemini_client import GeminiClient, GroundingError, TokenBudgetExceeded
 from supabase_client import SupabaseClient
+from tracing import flush, in_context, span, start_run
 
 LEAGUES = {
     "EPL": "Premier League",
@@ -61,47 +63,132 @@ def build_match_row(raw):
     }
 
 
+# Columns compared against the stored row; status is owned by post_match and never overwritten here
+COMPARED_FIELDS = ("kickoff_israel", "fixture_source")
+# Free text that Gemini words differently on every sync (venue spelling, whichever source it found);
+# it only counts as a change when the stored row has no value yet
+FILL_ONLY_FIELDS = ("venue", "fixture_source_url")
+
+
+def match_key(row):
+    return (row["league"], parse_kickoff(row["kickoff_utc"]), row["home_team"], row["away_team"])
+
+
+def _same_value(field, new, old):
+    if field == "kickoff_israel" and new and old:
+        return parse_kickoff(new) == parse_kickoff(old)
+    return (new or None) == (old or None)
+
+
+def _changed(row, old):
+    if not all(_same_value(field, row.get(field), old.get(field)) for field in COMPARED_FIELDS):
+        return True
+    return any(row.get(field) and not old.get(field) for field in FILL_ONLY_FIELDS)
+
+
+def diff_matches(fetched, stored):
+    """Split fetched rows into (inserts, changes, unchanged_keys) against the stored rows."""
+    stored_by_key = {match_key(row): row for row in stored}
+    inserts, changes, unchanged = [], [], []
+    for row in fetched:
+        key = match_key(row)
+        old = stored_by_key.get(key)
+        if old is None:
+            inserts.append(row)
+        elif not _changed(row, old):
+            unchanged.append(key)
+        else:
+            changes.append({k: v for k, v in row.items() if k != "status"})
+    return inserts, changes, unchanged
+
+
+def fetch_league(gemini, code, name):
+    with span("weekly_sync.league", league=code):
+        return gemini.fetch_fixtures(code, name)
+
+
 def main():
     gemini_key = os.environ["GEMINI_API_KEY"]
-    gemini = GeminiClient(gemini_key)
+    gemini = GeminiClient(gemini_key, concurrency=len(LEAGUES))
     supabase = SupabaseClient()
     run_id = supabase.log_run("weekly_sync")
+    start_run(run_id)
     status = "ok"
     failure_notes = []
     duration_notes = []
     try:
-        all_matches = []
-        for code, name in LEAGUES.items():
-            try:
-                fixtures, duration_ms = gemini.fetch_fixtures(code, name)
-                duration_notes.append(f"{code}:{duration_ms}ms")
-            except (GroundingError, requests.RequestException, ValueError) as exc:
-                failure_notes.append(f"ליגה {code}: שגיאה באיסוף משחקים ({exc})")
-                status = "partial_fail"
-                continue
-            for fx in fixtures:
+        gemini.load_budget(supabase, TZ)
+        fetched = {}
+        durations = {}
+        # Leagues are independent, so the sync takes about as long as the slowest one
+        with ThreadPoolExecutor(max_workers=len(LEAGUES)) as pool:
+            futures = {
+                code: pool.submit(in_context(fetch_league), gemini, code, name) for code, name in LEAGUES.items()
+            }
+            for code, future in futures.items():
                 try:
-                    match_row = build_match_row(fx)
-                except (KeyError, TypeError, ValueError) as exc:
-                    failure_notes.append(
-                        f"שגיאת המרה במשחק {fx.get('home_team','?')}-{fx.get('away_team','?')}: ({exc})"
-                    )
+                    fixtures, duration_ms, _usage = future.result()
+                    durations[code] = duration_ms
+                except (GroundingError, requests.RequestException, ValueError) as exc:
+                    failure_notes.append(f"ליגה {code}: שגיאה באיסוף משחקים ({exc})")
                     status = "partial_fail"
                     continue
                 window_end = datetime.now(timezone.utc) + timedelta(days=7)
-                if match_row["_kickoff_dt"] > window_end:
-                    continue
-                match_row.pop("_kickoff_dt", None)
-                all_matches.append(match_row)
-        if all_matches:
-            supabase.upsert_matches(all_matches)
+                rows = {}
+                for fx in fixtures:
+                    try:
+                        match_row = build_match_row(fx)
+                    except (KeyError, TypeError, ValueError) as exc:
+                        failure_notes.append(
+                            f"שגיאת המרה במשחק {fx.get('home_team','?')}-{fx.get('away_team','?')}: ({exc})"
+                        )
+                        status = "partial_fail"
+                        continue
+                    if match_row["_kickoff_dt"] > window_end:
+                        continue
+                    match_row.pop("_kickoff_dt", None)
+                    # A fixture listed twice would make the bulk upsert touch one row twice
+                    rows[match_key(match_row)] = match_row
+                fetched[code] = list(rows.values())
+
+        all_rows = [row for rows in fetched.values() for row in rows]
+        stored = []
+        if all_rows:
+            kickoffs = [parse_kickoff(row["kickoff_utc"]) for row in all_rows]
+            stored = supabase.fetch_matches(
+                {
+                    "select": "league,home_team,away_team,kickoff_utc," + ",".join(COMPARED_FIELDS + FILL_ONLY_FIELDS),
+                    "league": f"in.({','.join(fetched)})",
+                    "and": f"(kickoff_utc.gte.{min(kickoffs).isoformat()},kickoff_utc.lte.{max(kickoffs).isoformat()})",
+                }
+            )
+
+        all_inserts, all_changes = [], []
+        for code in LEAGUES:
+            if code not in fetched:
+                continue
+            inserts, changes, unchanged = diff_matches(fetched[code], stored)
+            all_inserts.extend(inserts)
+            all_changes.extend(changes)
+            duration_notes.append(
+                f"{code}:{durations[code]}ms inserted={len(inserts)} changed={len(changes)} unchanged={len(unchanged)}"
+            )
+        if all_inserts:
+            supabase.insert_matches(all_inserts)
+        if all_changes:
+            supabase.upsert_matches(all_changes)
+    except TokenBudgetExceeded as exc:
+        status = "budget_exceeded"
+        failure_notes.append(f"תקציב טוקנים יומי נוצל ({exc})")
     except Exception as exc:  # noqa: BLE001
         status = "error"
         failure_notes.append(f"שגיאת מערכת: {exc}")
     finally:
+        duration_notes.extend(gemini.run_notes())
         all_notes = failure_notes + duration_notes
         notes_text = "; ".join(all_notes) if all_notes else None
-        supabase.finish_run(run_id, status, notes_text)
+        flush(supabase, run_id)
+        supabase.finish_run(run_id, status, notes_text, gemini.run_usage(run_id))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Publish the dashboard data as static JSON so page views are served by the CDN, not Supabase.
+
+Build step (Cloudflare Pages, after generate_config.py): writes web/data/snapshot-<hash>.json
+with this week's dashboard_feed rows and stats, and web/data/latest.json pointing at it. The
+hash covers the data only, so an unchanged week keeps its file name (and its cached copies).
+
+    python scripts/build_snapshot.py --deploy-if-changed
+
+builds the same data without writing it, compares its hash with the published latest.json
+(SITE_URL) and calls the Pages deploy hook (PAGES_DEPLOY_HOOK_URL) only when they differ.
+A failed build step leaves no latest.json; the page then queries Supabase directly.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from urllib.parse import urlencode
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "web" / "data"
+DEFAULT_SITE_URL = "https://betai.pages.dev"
+# Same columns as FEED_COLUMNS in web/index.html
+FEED_COLUMNS = (
+    "id,league,kickoff_utc,kickoff_israel,home_team,away_team,status,changed_at,predicted_winner,"
+    "prob_home,prob_draw,prob_away,duration_ms,final_home_goals,final_away_goals,correct,source_urls"
+)
+# The window starts at midnight UTC so the data (and its hash) only moves when rows change or
+# the day turns; the page itself hides matches that already kicked off
+WINDOW_DAYS = 8
+TIMEOUT_SEC = 30
+
+
+def _get(url: str, headers: dict | None = None):
+  request = urllib.request.Request(url, headers=headers or {})
+  with urllib.request.urlopen(request, timeout=TIMEOUT_SEC) as resp:
+    return json.loads(resp.read().decode("utf-8"))
+
+
+def fetch_data(supabase_url: str, key: str, now: datetime) -> dict:
+  headers = {"apikey": key, "Authorization": f"Bearer {key}"}
+
+  def rest(path: str, params: list) -> list:
+    return _get(f"{supabase_url.rstrip('/')}/rest/v1/{path}?{urlencode(params)}", headers)
+
+  start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+  end = start + timedelta(days=WINDOW_DAYS)
+  monday = (start - timedelta(days=start.weekday())).date().isoformat()
+  matches = rest(
+      "dashboard_feed",
+      [
+          ("select", FEED_COLUMNS),
+          ("kickoff_utc", f"gte.{start.isoformat()}"),
+          ("kickoff_utc", f"lte.{end.isoformat()}"),
+          ("order", "kickoff_utc.asc,id.asc"),
+      ],
+  )
+  totals = rest("stats_totals", [("select", "league,n,correct_n,scored_n,brier_sum"), ("order", "league.asc")])
+  week = rest(
+      "stats_rollup",
+      [
+          ("select", "n,correct_n,scored_n,brier_sum"),
+          ("week", f"eq.{monday}"),
+          ("order", "league.asc,prompt_version.asc,model_name.asc"),
+      ],
+  )
+  return {
+      "window": {"start": start.isoformat(), "end": end.isoformat()},
+      "matches": matches,
+      "stats": {"totals": totals, "week_start": monday, "week": week},
+  }
+
+
+def content_hash(data: dict) -> str:
+  blob = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+  return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:16]
+
+
+def write_snapshot(data: dict, version: str, now: datetime) -> Path:
+  DATA_DIR.mkdir(parents=True, exist_ok=True)
+  name = f"snapshot-{version}.json"
+  generated_at = now.replace(microsecond=0).isoformat()
+  snapshot = {"version": version, "generated_at": generated_at, **data}
+  (DATA_DIR / name).write_text(json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+  latest = {"version": version, "file": name, "generated_at": generated_at}
+  (DATA_DIR / "latest.json").write_text(json.dumps(latest) + "\n", encoding="utf-8")
+  return DATA_DIR / name
+
+
+def published_version(site_url: str) -> str | None:
+  try:
+    return _get(f"{site_url.rstrip('/')}/data/latest.json").get("version")
+  except (urllib.error.URLError, ValueError, AttributeError) as exc:
+    sys.stderr.write(f"No published snapshot ({exc})\n")
+    return None
+
+
+def main() -> int:
+  parser = argparse.ArgumentParser(description="Dashboard snapshot")
+  parser.add_argument("--deploy-if-changed", action="store_true")
+  args = parser.parse_args()
+
+  supabase_url = os.environ.get("SUPABASE_URL")
+  # The anon key in both modes, so the check sees exactly what the build (and RLS) would publish
+  key = os.environ.get("SUPABASE_ANON_KEY")
+  if not supabase_url or not key:
+    sys.stderr.write("Missing SUPABASE_URL or SUPABASE_ANON_KEY; not building a snapshot\n")
+    return 1 if args.deploy_if_changed else 0
+
+  now = datetime.now(timezone.utc)
+  try:
+    data = fetch_data(supabase_url, key, now)
+  except (urllib.error.URLError, ValueError) as exc:
+    # The site still works without a snapshot, so a Supabase hiccup must not fail the deploy
+    sys.stderr.write(f"Snapshot not built: {exc}\n")
+    return 1 if args.deploy_if_changed else 0
+  version = content_hash(data)
+
+  if not args.deploy_if_changed:
+    path = write_snapshot(data, version, now)
+    print(f"{path.name}: {len(data['matches'])} matches, {path.stat().st_size} bytes")
+    return 0
+
+  published = published_version(os.environ.get("SITE_URL") or DEFAULT_SITE_URL)
+  if published == version:
+    print(f"Snapshot {version} is current; no deploy")
+    return 0
+  hook = os.environ.get("PAGES_DEPLOY_HOOK_URL")
+  if not hook:
+    print(f"Snapshot changed ({published} -> {version}) but PAGES_DEPLOY_HOOK_URL is not set")
+    return 0
+  request = urllib.request.Request(hook, data=b"", method="POST")
+  with urllib.request.urlopen(request, timeout=TIMEOUT_SEC) as resp:
+    print(f"Snapshot changed ({published} -> {version}); deploy hook answered {resp.status}")
+  return 0
+
+
+if __name__ == "__main__":
+  raise SystemExit(main())